@@ -0,0 +1,359 @@
+"""
+Run the client benchmarks against a local mock CMS API server.
+
+Results are appended to a JSON lines file, and compared against the previous run with the same
+options so regressions can be spotted:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --only signing json_decode --fail-on-regression
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+from benchmarks.server import MockCMSServer, make_contact, make_place
+from cofecms import records, transports
+from cofecms.api import PLACE_TYPE_CHURCH, CofeCMS, ContactData
+from cofecms.geo import SpatialIndex, haversine
+from cofecms.privacy import PrivacyFilter, PrivacyProjection
+from cofecms.search import ContactSearchIndex
+
+API_ID = 'benchmark_api_id'
+API_KEY = 'benchmark_api_key'
+DIOCESE_ID = 1
+
+DEFAULT_RESULTS_FILE = os.path.join('.benchmarks', 'results.jsonl')
+
+# The mock server only speaks HTTP/1.1, so HTTP/2 can only be compared against the real API
+TRANSPORT_OPTIONS = {
+    'requests': {'pool_maxsize': 16},
+    'httpx': {'http2': False},
+    'urllib3': {'maxsize': 16},
+}
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def make_client(server, **kwargs):
+    cofe = CofeCMS(API_ID, API_KEY, DIOCESE_ID, **kwargs)
+    cofe.BASE_URL = server.url
+    return cofe
+
+
+@benchmark
+def signing(options):
+    """Cost of building and signing the request params for a typical paged request."""
+    cofe = CofeCMS(API_ID, API_KEY, DIOCESE_ID)
+    number = 20000 // options.scale or 1
+    seconds = timeit.timeit(
+        lambda: cofe.generate_request_params(
+            None,
+            {'keyword': 'smith'},
+            fields={'contact': ['forenames', 'surname']},
+            limit=100,
+            offset=1000,
+        ),
+        number=number,
+    )
+    return {'signing_us_per_request': (seconds / number * 1e6, 'us')}
+
+
+@benchmark
+def import_time(options):
+    """Time taken to import cofecms in a new interpreter, over the interpreter's own start up."""
+    number = 10 // options.scale or 1
+
+    def fastest(code):
+        times = []
+        for _ in range(number):
+            start = time.perf_counter()
+            subprocess.check_call([sys.executable, '-c', code])
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    baseline = fastest('pass')
+    return {
+        'import_cofecms_ms': ((fastest('import cofecms') - baseline) * 1000, 'ms'),
+        'import_cofecms_and_requests_ms': (
+            (fastest('import cofecms, requests') - baseline) * 1000, 'ms'
+        ),
+    }
+
+
+@benchmark
+def json_decode(options):
+    """Cost of decoding the JSON body for 100k contact records."""
+    body = json.dumps([make_contact(contact_id) for contact_id in range(1, 1001)])
+    number = 100 // options.scale or 1
+    seconds = timeit.timeit(lambda: json.loads(body), number=number)
+    return {'json_decode_s_per_100k': (seconds / number * 100, 's')}
+
+
+@benchmark
+def privacy(options):
+    """Applying privacy settings to every field of 5,000 contacts."""
+    records = [make_contact(contact_id) for contact_id in range(1, 5001)]
+    number = 10 // options.scale or 1
+
+    def contact_data():
+        for record in records:
+            contact = ContactData(record)
+            dict((key, contact[key]) for key in record)
+
+    def privacy_filter():
+        list(PrivacyFilter().records(records))
+
+    public = PrivacyProjection(records[0].keys()).for_access_level()
+
+    def privacy_projection():
+        public.many(records)
+
+    return {
+        'privacy_contact_data_ms_per_5k': (
+            timeit.timeit(contact_data, number=number) / number * 1000, 'ms'
+        ),
+        'privacy_filter_ms_per_5k': (
+            timeit.timeit(privacy_filter, number=number) / number * 1000, 'ms'
+        ),
+        'privacy_projection_ms_per_5k': (
+            timeit.timeit(privacy_projection, number=number) / number * 1000, 'ms'
+        ),
+    }
+
+
+@benchmark
+def fetch_all(options):
+    """Serial vs concurrent all() for a paged query, with latency on every response."""
+    results = {}
+    total = 20000 // options.scale or 1
+    with MockCMSServer(API_ID, API_KEY, contacts=total, latency=options.latency) as server:
+        cofe = make_client(server)
+        for workers in (None, 4, 16):
+            start = time.perf_counter()
+            data = cofe.get_contacts(limit=100).all(workers=workers)
+            seconds = time.perf_counter() - start
+            assert len(data) == total, len(data)
+            results['all_workers_{}_s'.format(workers or 1)] = (seconds, 's')
+    return results
+
+
+@benchmark
+def transport_backends(options):
+    """Serial and concurrent all() with each available transport backend."""
+    results = {}
+    total = 20000 // options.scale or 1
+    with MockCMSServer(API_ID, API_KEY, contacts=total, latency=options.latency) as server:
+        for name, transport_class in transports.TRANSPORTS.items():
+            try:
+                transport = transport_class(**TRANSPORT_OPTIONS[name])
+            except ImportError:
+                continue
+
+            cofe = make_client(server, transport=transport)
+            for workers in (None, 16):
+                start = time.perf_counter()
+                data = cofe.get_contacts(limit=100).all(workers=workers)
+                seconds = time.perf_counter() - start
+                assert len(data) == total, len(data)
+                results['transport_{}_workers_{}_s'.format(name, workers or 1)] = (seconds, 's')
+            transport.close()
+    return results
+
+
+@benchmark
+def memory(options):
+    """Peak memory used by all() when retrieving 100k contact records, as dicts and compactly."""
+    results = {}
+    total = 100000 // options.scale or 1
+    with MockCMSServer(API_ID, API_KEY, contacts=total) as server:
+        for name, use_compact_records in (('dicts', False), ('compact', True)):
+            cofe = make_client(server, compact_records=use_compact_records)
+            gc.collect()
+            tracemalloc.start()
+            data = cofe.get_contacts(limit=1000).all()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert len(data) == total, len(data)
+            del data
+            results['all_{}_peak_mb_per_100k'.format(name)] = (
+                peak / 1024 / 1024 * 100000 / total, 'MB'
+            )
+    return results
+
+
+@benchmark
+def compact_records(options):
+    """CPU cost of decoding the JSON for 100k contact records, as dicts and compactly."""
+    body = json.dumps([make_contact(contact_id) for contact_id in range(1, 1001)])
+    number = 100 // options.scale or 1
+    results = {}
+    for name, decode in (
+            ('dicts', lambda: json.loads(body)),
+            ('compact', lambda: records.compact_records(json.loads(body))),
+    ):
+        seconds = timeit.timeit(decode, number=number)
+        results['decode_{}_s_per_100k'.format(name)] = (seconds / number * 100, 's')
+    return results
+
+
+@benchmark
+def search(options):
+    """Prefix and fuzzy queries against a local search index of 20,000 contacts."""
+    index = ContactSearchIndex()
+    for contact_id in range(1, (20000 // options.scale or 1) + 1):
+        index.add(make_contact(contact_id))
+    number = 1000 // options.scale or 1
+
+    return {
+        'search_prefix_ms_per_query': (
+            timeit.timeit(lambda: index.search('jo sm'), number=number) / number * 1000, 'ms'
+        ),
+        'search_fuzzy_ms_per_query': (
+            timeit.timeit(lambda: index.search('wilsn'), number=number) / number * 1000, 'ms'
+        ),
+    }
+
+
+@benchmark
+def geo(options):
+    """Finding the 5 nearest churches among 20,000 places, with and without a SpatialIndex."""
+    places = [make_place(place_id) for place_id in range(1, (20000 // options.scale or 1) + 1)]
+    index = SpatialIndex()
+    for place in places:
+        index.add(place)
+    number = 200 // options.scale or 1
+
+    def brute_force():
+        sorted(
+            (haversine(52.4068, -1.5197, place['latitude'], place['longitude']), place['id'])
+            for place in places if place['place_type_id'] == PLACE_TYPE_CHURCH
+        )[:5]
+
+    def spatial_index():
+        index.nearest(52.4068, -1.5197, k=5, place_type=PLACE_TYPE_CHURCH)
+
+    return {
+        'geo_brute_force_ms_per_query': (
+            timeit.timeit(brute_force, number=number) / number * 1000, 'ms'
+        ),
+        'geo_index_ms_per_query': (
+            timeit.timeit(spatial_index, number=number) / number * 1000, 'ms'
+        ),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(results_file, run_options):
+    """
+    Returns the last saved run made with the same options, as results from a different amount of
+    work or latency can't be compared, or None if there isn't one.
+    """
+    if not os.path.exists(results_file):
+        return None
+    previous = None
+    with open(results_file) as f:
+        for line in f:
+            if line.strip():
+                run = json.loads(line)
+                if run.get('options') == run_options:
+                    previous = run
+    return previous
+
+
+def save(results_file, run):
+    directory = os.path.dirname(results_file)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(results_file, 'a') as f:
+        f.write(json.dumps(run, sort_keys=True) + '\n')
+
+
+def compare(previous, metrics, threshold):
+    """
+    Print each metric alongside the previous run, returning the names of any which regressed.
+
+    All metrics are costs, so a higher value is worse.
+    """
+    regressions = []
+    previous_metrics = previous['metrics'] if previous else {}
+    for name, (value, unit) in sorted(metrics.items()):
+        line = '{:<32} {:>12.3f} {:<3}'.format(name, value, unit)
+        if name in previous_metrics and previous_metrics[name]['value']:
+            change = value / previous_metrics[name]['value'] - 1
+            line += ' {:+7.1%}'.format(change)
+            if change > threshold:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=[func.__name__ for func in BENCHMARKS])
+    parser.add_argument(
+        '--latency', type=float, default=0.01, help='Seconds of latency for each response.'
+    )
+    parser.add_argument(
+        '--scale', type=int, default=1, help='Divide the amount of work by this, for quick runs.'
+    )
+    parser.add_argument('--results-file', default=DEFAULT_RESULTS_FILE)
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1, help='Fractional slowdown counted as a regression.'
+    )
+    parser.add_argument('--fail-on-regression', action='store_true')
+    options = parser.parse_args(argv)
+
+    metrics = {}
+    for func in BENCHMARKS:
+        if options.only and func.__name__ not in options.only:
+            continue
+        metrics.update(func(options))
+
+    run_options = {'latency': options.latency, 'scale': options.scale}
+    previous = load_previous(options.results_file, run_options)
+    regressions = compare(previous, metrics, options.threshold)
+
+    if not options.no_save:
+        save(
+            options.results_file, {
+                'timestamp': datetime.datetime.utcnow().isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'options': run_options,
+                'metrics': dict(
+                    (name, {'value': value, 'unit': unit})
+                    for name, (value, unit) in metrics.items()
+                ),
+            }
+        )
+
+    if regressions and options.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+A local mock of the CofE CMS API, used for benchmarking the client offline.
+
+The server checks the HMAC 'sig' of every request in the same way as the real API, serves paged
+synthetic contacts, posts and places with 'X-Total-Count' and rate limit headers, and can inject a
+configurable amount of latency into every response.
+"""
+import hmac
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+PLACE_TYPES = (5, 1, 4, 2, 8, 3)  # Diocese, archdeaconry, deanery, benefice, parish, church
+
+FORENAMES = ('Anne', 'David', 'Elizabeth', 'James', 'Mary', 'Peter', 'Ruth', 'Thomas')
+SURNAMES = ('Brown', 'Evans', 'Green', 'Jones', 'Patel', 'Smith', 'Taylor', 'Wilson')
+ROLES = ('Vicar', 'Rector', 'Curate', 'Churchwarden', 'Reader', 'Archdeacon', 'Rural Dean')
+
+COLLECTION_RE = re.compile(r'^/v2/(contacts|posts|places)(/deleted)?/?$')
+SINGLE_RE = re.compile(r'^/v2/(contacts|posts|places)/(\d+)/?$')
+
+
+def make_contact(contact_id):
+    rand = random.Random(contact_id)
+    return {
+        'id': contact_id,
+        'title': rand.choice(('Revd', 'Mr', 'Mrs', 'Ms', 'Dr')),
+        'forenames': rand.choice(FORENAMES),
+        'surname': rand.choice(SURNAMES),
+        'known_as': rand.choice(FORENAMES),
+        'email': 'contact{}@example.org'.format(contact_id),
+        'email_privacy_setting': rand.randint(0, 2),
+        'telephone': '01{:09d}'.format(contact_id),
+        'telephone_privacy_setting': rand.randint(0, 2),
+        'mobile': '07{:09d}'.format(contact_id),
+        'mobile_privacy_setting': rand.randint(0, 2),
+        'address1': '{} Church Lane'.format(contact_id % 200 + 1),
+        'address2': None,
+        'town': 'Coventry',
+        'county': 'West Midlands',
+        'postcode': 'CV1 {}AA'.format(contact_id % 10),
+        'address_privacy_setting': rand.randint(0, 2),
+        'date_updated': '2017-03-20 12:00',
+    }
+
+
+def make_place(place_id):
+    rand = random.Random(place_id)
+    depth = min(place_id.bit_length() - 1, len(PLACE_TYPES) - 1)
+    return {
+        'id': place_id,
+        'name': 'Place {}'.format(place_id),
+        'place_type_id': PLACE_TYPES[depth],
+        'parent_id': place_id // 2 or None,
+        'latitude': round(rand.uniform(50.0, 55.0), 6),
+        'longitude': round(rand.uniform(-4.0, 1.5), 6),
+        'postcode': 'CV1 {}AA'.format(place_id % 10),
+        'date_updated': '2017-03-20 12:00',
+    }
+
+
+def make_post(post_id):
+    rand = random.Random(post_id)
+    record = {
+        'post_id': post_id,
+        'role_id': rand.randint(1, len(ROLES)),
+        'role_name': rand.choice(ROLES),
+        'contact_id': rand.randint(1, 100000),
+        'place_id': rand.randint(1, 10000),
+        'date_updated': '2017-03-20 12:00',
+    }
+    return record
+
+
+RECORD_FACTORIES = {
+    'contacts': make_contact,
+    'places': make_place,
+    'posts': make_post,
+}
+
+
+def select_fields(record, fields):
+    if not fields:
+        return record
+    wanted = set()
+    for section_fields in fields.values():
+        wanted.update(section_fields)
+    return dict((key, value) for key, value in record.items() if key in wanted)
+
+
+def calculate_signature(api_key, params):
+    hash_values = [value for key, value in sorted(params.items()) if key != 'sig']
+    msg = ''.join(hash_values).encode('utf-8')
+    return hmac.new(api_key.encode('utf-8'), msg=msg, digestmod=sha256).hexdigest()
+
+
+class MockCMSRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+
+        if params.get('api_id') != server.api_id:
+            return self.send_json(401, {'error': 'Unknown api_id'})
+        if not hmac.compare_digest(params.get('sig', ''),
+                                   calculate_signature(server.api_key, params)):
+            return self.send_json(401, {'error': 'Invalid signature'})
+
+        remaining = server.take_rate_limit()
+        if remaining < 0:
+            return self.send_json(429, {'error': 'Rate limit exceeded'}, remaining=0)
+
+        if server.latency:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        fields = json.loads(params['fields']) if params.get('fields') else None
+
+        match = COLLECTION_RE.match(url.path)
+        if match:
+            resource = match.group(1)
+            offset = int(params.get('offset', 0))
+            limit = min(int(params.get('limit', 100)), 1000)
+            total = server.total_counts[resource]
+            if match.group(2):
+                total = total // 10
+            factory = RECORD_FACTORIES[resource]
+            records = [
+                select_fields(factory(record_id), fields)
+                for record_id in range(offset + 1, min(offset + limit, total) + 1)
+            ]
+            return self.send_json(200, records, total_count=total, remaining=remaining)
+
+        match = SINGLE_RE.match(url.path)
+        if match:
+            record = RECORD_FACTORIES[match.group(1)](int(match.group(2)))
+            return self.send_json(200, record, total_count=1, remaining=remaining)
+
+        if url.path.rstrip('/') == '/v2/roles':
+            roles = [{'id': index, 'name': name} for index, name in enumerate(ROLES, 1)]
+            return self.send_json(200, roles, remaining=remaining)
+
+        return self.send_json(404, {'error': 'Not found'})
+
+    def send_json(self, status, data, total_count=None, remaining=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if total_count is not None:
+            self.send_header('X-Total-Count', str(total_count))
+        if remaining is not None:
+            self.send_header('X-RateLimit-Limit', str(self.server.rate_limit))
+            self.send_header('X-RateLimit-Remaining', str(remaining))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockCMSServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    A threaded mock CMS API server, which runs in a background thread.
+
+    Use as a context manager, then point a client at it by setting 'BASE_URL':
+
+        with MockCMSServer(api_id, api_key, latency=0.05) as server:
+            cofe = CofeCMS(api_id, api_key, diocese_id)
+            cofe.BASE_URL = server.url
+    """
+    daemon_threads = True
+
+    def __init__(
+            self,
+            api_id,
+            api_key,
+            contacts=10000,
+            posts=10000,
+            places=10000,
+            latency=0,
+            jitter=0,
+            rate_limit=1000000,
+            rate_limit_window=60,
+            address=('127.0.0.1', 0),
+    ):
+        HTTPServer.__init__(self, address, MockCMSRequestHandler)
+        self.api_id = api_id
+        self.api_key = api_key
+        self.total_counts = {'contacts': contacts, 'posts': posts, 'places': places}
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._rate_limit_used = 0
+        self._rate_limit_reset = time.monotonic() + rate_limit_window
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def take_rate_limit(self):
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._rate_limit_reset:
+                self._rate_limit_used = 0
+                self._rate_limit_reset = now + self.rate_limit_window
+            self._rate_limit_used += 1
+            return self.rate_limit - self._rate_limit_used
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
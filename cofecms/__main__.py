@@ -0,0 +1,5 @@
+import sys
+
+from cofecms.cli import main
+
+sys.exit(main())
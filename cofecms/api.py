@@ -1,10 +1,15 @@
 import hmac
 import json
 import math
-from collections import OrderedDict
+import time
+from collections import OrderedDict, deque
 from hashlib import sha256
 
-import requests
+from cofecms import records, transports
+from cofecms.circuit import CircuitOpenError
+from cofecms.compression import accept_encoding
+from cofecms.deadlines import Deadline, DeadlineExceededError
+from cofecms.scheduler import with_current_priority
 
 PLACE_TYPE_ARCHDEACONRY = 1
 PLACE_TYPE_BENEFICE = 2
@@ -25,13 +30,37 @@ PRIVACY_SETTING_PRIVATE = 2
 PRIVACY_SETTING_DIOCESE_ONLY = 1
 PRIVACY_SETTING_PUBLIC = 0
 
+# Maps the name of each resource to the CofeCMS method used to fetch it
+RESOURCES = OrderedDict([
+    ('contacts', 'get_contacts'),
+    ('posts', 'get_posts'),
+    ('places', 'get_places'),
+    ('deleted-contacts', 'get_deleted_contacts'),
+    ('deleted-posts', 'get_deleted_posts'),
+    ('deleted-places', 'get_deleted_places'),
+])
+
 
 class CofeCMS(object):
     BASE_URL = 'https://cmsapi.cofeportal.org'
     DATE_FORMAT = '%Y-%m-%d %H:%M'
     DEFAULT_LIMIT = 100
 
-    def __init__(self, api_id, api_key, diocese_id=None):
+    def __init__(
+            self,
+            api_id,
+            api_key,
+            diocese_id=None,
+            transport=None,
+            compression_stats=None,
+            compact_records=False,
+            cache=None,
+            scheduler=None,
+            circuit_breaker=None,
+            timeout=None,
+            hedger=None,
+            schema_registry=None,
+    ):
         self._diocese_id = None
 
         self.api_id = api_id
@@ -42,6 +71,21 @@ class CofeCMS(object):
 
         self.session = None
 
+        if isinstance(transport, str):
+            transport = transports.get_transport(transport)
+        self.transport = transport
+        self.compression_stats = compression_stats
+        self.compact_records = compact_records
+        self.schema_registry = schema_registry
+        if schema_registry is not None and schema_registry.api is None:
+            schema_registry.api = self
+        self.cache = cache
+        self.scheduler = scheduler
+        self.circuit_breaker = circuit_breaker
+        # Seconds, or a tuple of (connect timeout, read timeout), for every request
+        self.timeout = timeout
+        self.hedger = hedger
+
     @property
     def diocese_id(self):
         if not self._diocese_id:
@@ -430,7 +474,9 @@ class CofeCMS(object):
         result = self.get(endpoint_url, diocese_id)
         return result
 
-    def get(self, endpoint_url, diocese_id=None, search_params=None, **basic_params):
+    def get(
+            self, endpoint_url, diocese_id=None, search_params=None, deadline=None, **basic_params
+    ):
         """
         Perform a generic request against the API and retrieves the results.
 
@@ -444,6 +490,8 @@ class CofeCMS(object):
             diocese_id: Optionally supply the diocese_id.
             search_params: A dict containing search params. The API docs contain more information
                 on this: https://cmsapi.cofeportal.org/json-data-string.
+            deadline: Optionally a number of seconds, or a Deadline, by which the request must
+                finish. The request's timeouts are shortened to fit.
             **basic_params: Pass general request parameters as needed by the endpoint. 'api_id',
                 'data' and 'sig' params are automatically added for you. The API docs give more
                 information on what params can be used:
@@ -451,33 +499,71 @@ class CofeCMS(object):
 
         Returns:
             A CofeCMSResult with the results and details of the query.
+
+        Raises:
+            InvalidFieldsError: If a schema_registry is set, and 'fields' contains fields which
+                aren't in the schema for the endpoint.
+            DeadlineExceededError: If the deadline passes before the request finishes.
         """
+        if self.schema_registry is not None and basic_params.get('fields'):
+            self.schema_registry.validate_request(endpoint_url, basic_params['fields'])
+
         request_params = self.generate_request_params(diocese_id, search_params, **basic_params)
-        response = self.do_request(endpoint_url, request_params)
+        deadline = Deadline.coerce(deadline)
+        if deadline is not None:
+            deadline.check()
 
-        from_json = response.json()
+        try:
+            if self.cache is not None:
+                try:
+                    response, headers, from_json = self.cache.request(
+                        self, endpoint_url, request_params, deadline=deadline
+                    )
+                except CircuitOpenError:
+                    cached = None
+                    if self.circuit_breaker.serve_from_cache:
+                        cached = self.cache.lookup(endpoint_url, request_params)
+                    if cached is None:
+                        raise
+                    self.circuit_breaker.stats['served_from_cache'] += 1
+                    response, headers, from_json = cached
+            else:
+                response = self.do_request(endpoint_url, request_params, deadline=deadline)
+                headers = response.headers
+                from_json = response.json()
+        except Exception as e:
+            if deadline is not None and deadline.expired and not isinstance(
+                e, DeadlineExceededError
+            ):
+                raise DeadlineExceededError() from e
+            raise
 
         # Sometimes the response is a dict, but we want it to be a list of dicts
         if isinstance(from_json, dict):
             from_json = [from_json]
 
+        if self.compact_records:
+            from_json = records.compact_records(from_json)
+
         result = CofeCMSResult(from_json)
         result.api_obj = self
         result.response = response
-        result.headers = response.headers
+        result.headers = headers
         result.endpoint_url = endpoint_url
         result.diocese_id = diocese_id
         result.search_params = search_params
         result.basic_params = basic_params
         try:
-            result.rate_limit = int(response.headers.get('X-RateLimit-Limit'))
-            result.rate_limit_remaining = int(response.headers.get('X-RateLimit-Remaining'))
+            result.rate_limit = int(headers.get('X-RateLimit-Limit'))
+            result.rate_limit_remaining = int(headers.get('X-RateLimit-Remaining'))
         except:  # noqa:E722
             result.rate_limit = None
             result.rate_limit_remaining = None
         return result
 
-    def paged_get(self, endpoint_url, diocese_id=None, search_params=None, **basic_params):
+    def paged_get(
+            self, endpoint_url, diocese_id=None, search_params=None, deadline=None, **basic_params
+    ):
         """
         Similar to 'get', however it also populates the result object with the necessary
         information to make requests for more pages of data easier.
@@ -488,6 +574,8 @@ class CofeCMS(object):
             diocese_id: Optionally supply the diocese_id.
             search_params: A dict containing search params. The API docs contain more information
                 on this: https://cmsapi.cofeportal.org/json-data-string.
+            deadline: Optionally a number of seconds, or a Deadline, by which the request must
+                finish. See 'get'.
             **basic_params: Pass general request parameters as needed by the endpoint. 'api_id',
                 'data' and 'sig' params are automatically added for you. The API docs give more
                 information on what params can be used:
@@ -502,7 +590,7 @@ class CofeCMS(object):
         basic_params['offset'] = basic_params.get('offset', 0)
         basic_params['limit'] = basic_params.get('limit', False) or CofeCMS.DEFAULT_LIMIT
 
-        result = self.get(endpoint_url, diocese_id, search_params, **basic_params)
+        result = self.get(endpoint_url, diocese_id, search_params, deadline, **basic_params)
 
         result.total_count = int(result.headers['X-Total-Count'])
 
@@ -515,7 +603,7 @@ class CofeCMS(object):
             del (result.basic_params['limit'])
         return result
 
-    def do_request(self, endpoint_url, request_params):
+    def do_request(self, endpoint_url, request_params, headers=None, timeout=None, deadline=None):
         """
         Performs a request to the given endpoint_url with the supplied request params.
 
@@ -524,23 +612,88 @@ class CofeCMS(object):
                 https://cmsapi.cofeportal.org/v2/contacts
             request_params: A dict containing the GET params for this request. Will be URL encoded
                 for you.
+            headers: Optionally a dict of extra headers to send, such as conditional request
+                headers.
+            timeout: Optionally a timeout in seconds, or a tuple of (connect timeout, read
+                timeout), to use instead of the client's timeout.
+            deadline: Optionally a Deadline, which limits how long to wait for the scheduler, and
+                the request's timeouts once it's allowed to be sent.
+
+        The request is made with the client's transport, which defaults to using the requests
+        session. See cofecms.transports. If the client has a scheduler, this waits until the
+        scheduler allows the request to be sent, and if it has a hedger, slow requests may be sent
+        twice.
 
         Returns:
-            An unmolested requests.Result object.
+            An unmolested requests.Result object, or the response from the transport.
 
         Raises:
             Will raise the appropriate HTTP exception for any non-200 HTTP response.
+            CircuitOpenError: If the client has a circuit breaker, and it's open.
         """
-        session = self._get_session()
-        result = session.get(endpoint_url, params=request_params)
+        if self.hedger is not None and self.hedger.should_hedge(endpoint_url, request_params):
+            return self.hedger.request(
+                self._do_request, endpoint_url, request_params, headers, timeout, deadline
+            )
+        return self._do_request(endpoint_url, request_params, headers, timeout, deadline)
+
+    def _do_request(self, endpoint_url, request_params, headers, timeout, deadline):
+        if self.scheduler is not None:
+            self.scheduler.acquire(
+                endpoint_url,
+                request_params,
+                timeout=deadline.remaining() if deadline is not None else None,
+            )
+        result = None
+        try:
+            if timeout is None:
+                timeout = self.timeout
+            if deadline is not None:
+                # Worked out once the request can be sent, so time spent waiting for the
+                # scheduler counts towards the deadline
+                deadline.check()
+                timeout = deadline.timeout(timeout)
+            result = self._send(endpoint_url, request_params, headers, timeout)
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.release(getattr(result, 'headers', None))
         result.raise_for_status()
+
+        if self.compression_stats is not None:
+            self.compression_stats.record(endpoint_url, result)
+        return result
+
+    def _send(self, endpoint_url, request_params, headers, timeout):
+        transport = self._get_transport()
+        # Only pass headers and timeouts when needed, so transports written before they were
+        # supported keep working
+        kwargs = {}
+        if headers:
+            kwargs['headers'] = headers
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+        breaker = self.circuit_breaker
+        if breaker is None:
+            return transport.get(endpoint_url, request_params, **kwargs)
+
+        # Checked once the scheduler has let the request go, so time spent waiting behind other
+        # requests doesn't count against the API, or hold on to a half open probe
+        probe = breaker.before_request()
+        started = time.monotonic()
+        try:
+            result = transport.get(endpoint_url, request_params, **kwargs)
+        except Exception:
+            breaker.record(False, time.monotonic() - started, probe)
+            raise
+        breaker.record(result.status_code < 500, time.monotonic() - started, probe)
         return result
 
     def generate_endpoint_url(self, endpoint):
         """
         Generate an absolute URL for a given endpoint.
 
-        Uses the BASE_URL constant.
+        Uses the BASE_URL attribute, which can be overridden on an instance to use another server.
 
         Args:
             endpoint: The endpoint to use, as defined in the specs. For example: '/v2/contacts'.
@@ -548,7 +701,7 @@ class CofeCMS(object):
         Returns:
             The absolute URL for the given endpoint.
         """
-        endpoint_url = '{base_url}{endpoint}'.format(base_url=CofeCMS.BASE_URL, endpoint=endpoint)
+        endpoint_url = '{base_url}{endpoint}'.format(base_url=self.BASE_URL, endpoint=endpoint)
         return endpoint_url
 
     def generate_request_params(self, diocese_id, search_params, **basic_params):
@@ -651,12 +804,27 @@ class CofeCMS(object):
         """
         Returns a the current requests session.
 
-        If one does not currently exist, then will create one.
+        If one does not currently exist, then will create one, which asks for responses to be
+        compressed with the best encoding which can be decoded.
         """
         if self.session is None:
+            # Imported here rather than at the top, as it takes longer to import than the rest of
+            # the package, and isn't needed until the first request
+            import requests
             self.session = requests.Session()
+            self.session.headers['Accept-Encoding'] = accept_encoding()
         return self.session
 
+    def _get_transport(self):
+        """
+        Returns the transport used to make requests.
+
+        If one was not given, then will use the requests session.
+        """
+        if self.transport is None:
+            self.transport = transports.RequestsTransport(self._get_session())
+        return self.transport
+
     def _prepare_basic_params(self, basic_params):
         # Filter out any None values
         basic_params_filtered = dict((k, v) for k, v in basic_params.items() if v is not None)
@@ -687,42 +855,95 @@ class CofeCMSResult(list):
             list.__init__(self, args)
         self.__dict__.update(kwargs)
 
-    def all(self):
+    def all(self, workers=None, deadline=None):
         """
         Retrieve the data for all pages of results from the inital query.
 
         Warning: Can be quite slow to run as a request will be made for each page. Suggest reducing
-        the number of pages by increasing the "limit" when performing the initial query.
+        the number of pages by increasing the "limit" when performing the initial query, or by
+        fetching pages concurrently with "workers".
+
+        Args:
+            workers: Optional number of pages to fetch concurrently. See 'pages_generator'.
+            deadline: Optionally a number of seconds, or a Deadline, by which every page must have
+                been fetched.
 
         Returns:
             A list of result data (which are usually dicts).
+
+        Raises:
+            DeadlineExceededError: If the deadline passes first. Its 'partial' attribute holds the
+                data from the pages fetched before then.
         """
         data = []
-        for page in self.pages_generator():
-            data = data + page
+        try:
+            for page in self.pages_generator(workers=workers, deadline=deadline):
+                data.extend(page)
+        except DeadlineExceededError as e:
+            e.partial = data
+            raise
         return data
 
-    def pages_generator(self):
+    def pages_generator(self, workers=None, deadline=None):
         """
         A generator to iterate through all the pages in the initial query.
 
         Warning: Can be quite slow to run as a request will be made for each page. Suggest reducing
         the number of pages by increasing the "limit" when performing the initial query.
-        """
-        for current_page_num in range(0, self.total_pages):
-            if current_page_num == 0:
-                # No need to get current results again
-                current_page_data = self
-            else:
-                current_page_data = self.get_data_for_page(current_page_num)
-            yield current_page_data
 
-    def get_data_for_page(self, page_num):
+        Args:
+            workers: Optional number of pages to fetch concurrently. Pages are still yielded in
+                order, and at most twice this many pages are held in memory at once.
+            deadline: Optionally a number of seconds, or a Deadline, by which every page must have
+                been fetched. If it passes, DeadlineExceededError is raised after the pages which
+                were fetched in time have been yielded.
+        """
+        deadline = Deadline.coerce(deadline)
+        if not workers or workers < 2:
+            for current_page_num in range(0, self.total_pages):
+                if current_page_num == 0:
+                    # No need to get current results again
+                    current_page_data = self
+                else:
+                    current_page_data = self.get_data_for_page(current_page_num, deadline)
+                yield current_page_data
+            return
+
+        yield self
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Pages are fetched with the scheduler priority of the thread consuming them
+        get_data_for_page = with_current_priority(self.get_data_for_page)
+        page_nums = iter(range(1, self.total_pages))
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                # Keep a bounded window of requests in flight, so memory use doesn't grow with the
+                # size of the result set when the consumer is slower than the API.
+                for page_num in page_nums:
+                    pending.append(executor.submit(get_data_for_page, page_num, deadline))
+                    if len(pending) >= workers * 2:
+                        break
+
+                while pending:
+                    current_page_data = pending.popleft().result()
+                    page_num = next(page_nums, None)
+                    if page_num is not None:
+                        pending.append(executor.submit(get_data_for_page, page_num, deadline))
+                    yield current_page_data
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def get_data_for_page(self, page_num, deadline=None):
         """
         Retrieve the data for a specific page in the initial query.
 
         Args:
             page_num: The number of the page to get. Zero indexed.
+            deadline: Optionally a number of seconds, or a Deadline, by which the page must have
+                been fetched.
 
         Returns:
             A CofeCMSResult object, populated with data for the requested page.
@@ -732,6 +953,7 @@ class CofeCMSResult(list):
             endpoint_url=self.endpoint_url,
             diocese_id=self.diocese_id,
             search_params=self.search_params,
+            deadline=deadline,
             offset=offset,
             limit=self.limit,
             **self.basic_params
@@ -0,0 +1,448 @@
+import hashlib
+import json
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cofecms.scheduler import with_current_priority
+
+# Params which change with every request, rather than with the query being made
+UNCACHED_PARAMS = ('sig', )
+
+# Headers describing the body on the wire, which don't apply to a cached, decoded body
+UNCACHED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+SERIALIZER_MSGPACK = 'msgpack'
+SERIALIZER_JSON = 'json'
+SERIALIZER_PICKLE = 'pickle'
+SERIALIZERS = (SERIALIZER_MSGPACK, SERIALIZER_JSON, SERIALIZER_PICKLE)
+
+
+def _headers(headers):
+    # requests is imported here rather than at the top, so importing this module stays fast
+    from requests.structures import CaseInsensitiveDict
+    return CaseInsensitiveDict(headers)
+
+
+def cache_key(endpoint_url, request_params):
+    """
+    Generate the key a response is cached under, from the URL and request params.
+    """
+    params = sorted(
+        (key, str(value)) for key, value in request_params.items() if key not in UNCACHED_PARAMS
+    )
+    return json.dumps([endpoint_url, params], separators=(',', ':'))
+
+
+class CacheEntry(object):
+    """
+    A cached, decoded response body, with the validators needed to check it's still current.
+    """
+    __slots__ = ('data', 'headers', 'etag', 'last_modified', 'content_hash', 'stored_at')
+
+    def __init__(self, data, headers, etag, last_modified, content_hash, stored_at):
+        self.data = data
+        self.headers = headers
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.stored_at = stored_at
+
+    def validators(self):
+        """
+        Returns the conditional request headers for revalidating the entry, if it has validators.
+        """
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class MemoryBackend(object):
+    """
+    Keeps cache entries in memory, in this process only. This is the default backend.
+
+    A cache backend needs 'get(key)', 'set(key, entry)', 'delete(key)' and 'clear()' methods,
+    where 'entry' is a CacheEntry.
+
+    Args:
+        max_entries: The number of entries to keep, with the least recently used dropped first.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend(object):
+    """
+    Keeps cache entries in Redis, or any server speaking the Redis protocol, so they are shared by
+    every process using the same server.
+
+    Entries are serialised with msgpack if it's installed, or JSON otherwise. Pickle can be chosen
+    too, but should only be used with a Redis server which nothing untrusted can write to.
+
+        >>> cache = ResponseCache(backend=RedisBackend(url='redis://localhost:6379/0', ttl=3600))
+
+    Args:
+        client: Optionally supply the redis client to use. Otherwise, redis must be installed.
+        url: The URL of the Redis server, if a client isn't supplied.
+        prefix: Added to the start of every key, so several caches can share a server.
+        ttl: Optionally the number of seconds before entries are removed from Redis.
+        serializer: One of SERIALIZERS. Defaults to msgpack if it's installed, or JSON otherwise.
+    """
+
+    def __init__(
+            self,
+            client=None,
+            url='redis://localhost:6379/0',
+            prefix='cofecms:',
+            ttl=None,
+            serializer=None,
+    ):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError('redis must be installed to use RedisBackend')
+            client = redis.Redis.from_url(url)
+
+        try:
+            import msgpack
+        except ImportError:
+            msgpack = None
+        if serializer is None:
+            serializer = SERIALIZER_MSGPACK if msgpack is not None else SERIALIZER_JSON
+        if serializer not in SERIALIZERS:
+            raise ValueError('Unknown serializer: {}'.format(serializer))
+        if serializer == SERIALIZER_MSGPACK and msgpack is None:
+            raise ImportError('msgpack must be installed to use the msgpack serializer')
+
+        self._msgpack = msgpack
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.serializer = serializer
+
+    def get(self, key):
+        value = self.client.get(self._redis_key(key))
+        if value is None:
+            return None
+        try:
+            return self.loads(value)
+        except Exception:
+            # Written by another serializer, or corrupted, so treat it as missing
+            return None
+
+    def set(self, key, entry):
+        self.client.set(self._redis_key(key), self.dumps(entry), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self._redis_key(key))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def dumps(self, entry):
+        """
+        Serialise a CacheEntry to bytes, tagged with the serializer used.
+        """
+        fields = [getattr(entry, name) for name in CacheEntry.__slots__]
+        if self.serializer == SERIALIZER_MSGPACK:
+            return b'm' + self._msgpack.packb(fields, use_bin_type=True)
+        if self.serializer == SERIALIZER_PICKLE:
+            return b'p' + pickle.dumps(fields, protocol=pickle.HIGHEST_PROTOCOL)
+        return b'j' + json.dumps(fields, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, value):
+        """
+        Deserialise bytes from dumps() back into a CacheEntry.
+        """
+        tag, payload = value[:1], value[1:]
+        if tag == b'm' and self.serializer == SERIALIZER_MSGPACK:
+            fields = self._msgpack.unpackb(payload, raw=False)
+        elif tag == b'p' and self.serializer == SERIALIZER_PICKLE:
+            fields = pickle.loads(payload)
+        elif tag == b'j':
+            fields = json.loads(payload.decode('utf-8'))
+        else:
+            raise ValueError('Unsupported cache entry format: {!r}'.format(tag))
+        return CacheEntry(*fields)
+
+    def _redis_key(self, key):
+        # Cache keys include the whole query, so are hashed to keep Redis keys short
+        return self.prefix + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    Caches decoded responses, and revalidates them with conditional requests.
+
+    Each request sends 'If-None-Match' and 'If-Modified-Since' headers from the cached response's
+    'ETag' and 'Last-Modified' headers, and a '304 Not Modified' response is answered from the
+    cache without downloading or decoding the body again. For responses without validators, a hash
+    of the body is compared with the cached one, so an unchanged body isn't decoded again.
+
+        >>> cofe = CofeCMS(API_ID, API_KEY, diocese_id, cache=ResponseCache())
+        >>> cofe.get_roles()  # Downloaded and decoded
+        >>> cofe.get_roles()  # 304 Not Modified, served from the cache
+
+    With 'max_age' set, responses are served from the cache without any request until they are
+    that many seconds old. Adding 'stale_while_revalidate' serves responses which have been stale
+    for up to that many more seconds straight away too, while they are revalidated in the
+    background, so slow API calls are kept out of the way of latency critical reads:
+
+        >>> cache = ResponseCache(max_age=60, stale_while_revalidate=600)
+
+    Only one request per cached response is ever in flight. Any other requests for the same
+    response wait for it, rather than all going to the API at once.
+
+    Entries are kept in memory by default. To share them between processes, such as the workers
+    of a web server, use a RedisBackend. Requests in flight are only shared within a process. If
+    the backend fails, such as while Redis is down, requests go to the API as if nothing was
+    cached, and the errors are counted in 'stats'.
+
+    Records from the cache are shared between results, so they should be treated as read only.
+    Results served without any request have a 'response' of None.
+
+    Args:
+        max_entries: The number of responses to keep in memory, if a backend isn't supplied.
+        max_age: Optionally the number of seconds a response is served without revalidating it.
+            Defaults to always revalidating.
+        stale_while_revalidate: Optionally the number of seconds after 'max_age' that a stale
+            response is still served, while it's revalidated in the background.
+        workers: The number of threads used for background revalidation.
+        backend: Optionally where to keep entries, such as a RedisBackend. Defaults to a
+            MemoryBackend.
+
+    Attributes:
+        stats: A Counter of how requests were answered, such as 'fresh', 'not_modified' and
+            'miss', along with 'backend_errors' and 'revalidation_errors'.
+    """
+
+    def __init__(
+            self,
+            max_entries=1024,
+            max_age=None,
+            stale_while_revalidate=None,
+            workers=4,
+            backend=None,
+    ):
+        self.backend = backend if backend is not None else MemoryBackend(max_entries)
+        self.max_age = max_age
+        self.stale_while_revalidate = stale_while_revalidate
+        self.workers = workers
+        self.stats = Counter()
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._executor = None
+
+    def get(self, key):
+        """
+        Returns the CacheEntry for a key, or None, including if the backend fails.
+        """
+        try:
+            return self.backend.get(key)
+        except Exception:
+            self._count('backend_errors')
+            return None
+
+    def set(self, key, entry):
+        """
+        Store the CacheEntry for a key. If the backend fails, the entry isn't stored.
+        """
+        try:
+            self.backend.set(key, entry)
+        except Exception:
+            self._count('backend_errors')
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def close(self):
+        """
+        Wait for any background revalidation to finish, and stop its threads.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def request(self, api, endpoint_url, request_params, timeout=None, deadline=None):
+        """
+        Perform a request for a client, using the cache where possible.
+
+        Args:
+            api: The CofeCMS instance making the request.
+            endpoint_url: The absolute URL for the endpoint.
+            request_params: The signed request params.
+            timeout: Optionally the timeout for the request, if one is made. See 'do_request'.
+            deadline: Optionally a Deadline for the request, if one is made. See 'do_request'.
+
+        Returns:
+            A tuple of (response, headers, data), where 'data' is the decoded JSON body and
+            'headers' includes any headers only sent with the cached response. 'response' is None
+            if no request was needed.
+        """
+        key = cache_key(endpoint_url, request_params)
+        entry = self.get(key)
+
+        if entry is not None and self.max_age is not None:
+            age = time.time() - entry.stored_at
+            if age <= self.max_age:
+                self._count('fresh')
+                return None, _headers(entry.headers), entry.data
+
+            if (
+                self.stale_while_revalidate is not None and
+                age <= self.max_age + self.stale_while_revalidate
+            ):
+                self._count('stale')
+                self._revalidate_in_background(api, endpoint_url, request_params, key)
+                return None, _headers(entry.headers), entry.data
+
+        future, is_owner = self._claim(key)
+        if not is_owner:
+            # Another thread is already requesting this, so wait for its response
+            self._count('coalesced')
+            return future.result(deadline.remaining() if deadline is not None else None)
+        return self._complete(key, future, api, endpoint_url, request_params, timeout, deadline)
+
+    def lookup(self, endpoint_url, request_params):
+        """
+        Returns the cached response for a request however old it is, in the same form as
+        'request', or None if there isn't one. Used to answer requests which can't be sent.
+        """
+        entry = self.get(cache_key(endpoint_url, request_params))
+        if entry is None:
+            return None
+        return None, _headers(entry.headers), entry.data
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _claim(self, key):
+        # Returns the Future for the request in flight for a key, and whether it was created now,
+        # in which case the caller must complete it
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, False
+            future = self._in_flight[key] = Future()
+            return future, True
+
+    def _complete(
+            self, key, future, api, endpoint_url, request_params, timeout=None, deadline=None
+    ):
+        try:
+            result = self._revalidate(key, api, endpoint_url, request_params, timeout, deadline)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _revalidate_in_background(self, api, endpoint_url, request_params, key):
+        future, is_owner = self._claim(key)
+        if not is_owner:
+            return
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            executor = self._executor
+        executor.submit(
+            with_current_priority(self._background), key, future, api, endpoint_url, request_params
+        )
+
+    def _background(self, key, future, api, endpoint_url, request_params):
+        try:
+            self._complete(key, future, api, endpoint_url, request_params)
+        except Exception:
+            # The stale response carries on being served, and the next request tries again
+            self._count('revalidation_errors')
+
+    def _revalidate(self, key, api, endpoint_url, request_params, timeout=None, deadline=None):
+        entry = self.get(key)
+        validators = entry.validators() if entry is not None else None
+
+        response = api.do_request(
+            endpoint_url,
+            request_params,
+            headers=validators or None,
+            timeout=timeout,
+            deadline=deadline,
+        )
+
+        if response.status_code == 304 and entry is not None:
+            self._count('not_modified')
+            headers = _headers(entry.headers)
+            headers.update(response.headers)
+            self.set(key, CacheEntry(
+                data=entry.data,
+                headers=entry.headers,
+                etag=entry.etag,
+                last_modified=entry.last_modified,
+                content_hash=entry.content_hash,
+                stored_at=time.time(),
+            ))
+            return response, headers, entry.data
+
+        content_hash = hashlib.sha1(response.content).hexdigest()
+        if entry is not None and entry.content_hash == content_hash:
+            self._count('unchanged')
+            data = entry.data
+        else:
+            self._count('changed' if entry is not None else 'miss')
+            data = response.json()
+
+        self.set(key, CacheEntry(
+            data=data,
+            headers=dict(
+                (name, value) for name, value in response.headers.items()
+                if name.lower() not in UNCACHED_HEADERS
+            ),
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            content_hash=content_hash,
+            stored_at=time.time(),
+        ))
+        return response, response.headers, data
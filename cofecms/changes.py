@@ -0,0 +1,177 @@
+import datetime
+import hashlib
+import json
+from collections import Counter, OrderedDict, namedtuple
+
+from cofecms.sync import fetch_changes
+
+EVENT_CREATED = 'created'
+EVENT_UPDATED = 'updated'
+EVENT_DELETED = 'deleted'
+EVENT_TYPES = (EVENT_CREATED, EVENT_UPDATED, EVENT_DELETED)
+
+# The field holding the ID of each resource's records
+DEFAULT_ID_FIELDS = OrderedDict([
+    ('contacts', 'id'),
+    ('posts', 'post_id'),
+    ('places', 'id'),
+])
+
+# A single change to a record. 'record' is the new record. For deletions it's the record from the
+# deleted endpoint, or None if the deletion was found by a full sync.
+ChangeEvent = namedtuple('ChangeEvent', ('event_type', 'resource', 'record_id', 'record'))
+
+
+def content_hash(record):
+    """
+    Returns a hash of a record's content, which is the same however its keys are ordered.
+    """
+    # 'default=dict' allows CompactRecords to be hashed
+    canonical = json.dumps(record, sort_keys=True, separators=(',', ':'), default=dict)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class ChangeTracker(object):
+    """
+    Works out which records have been created, updated or deleted since the last sync, and sends a
+    ChangeEvent for each to any subscribers.
+
+    A hash of each record's content is kept, so records which are returned again without any
+    changes don't cause events. Downstream caches can then invalidate only the keys which changed:
+
+        >>> tracker = ChangeTracker(cofe)
+        >>> tracker.subscribe(lambda event: cache.delete(event.record_id), resource='contacts')
+        >>> tracker.sync()
+
+    The first sync fetches everything, so every record causes a created event. Later syncs only
+    fetch records updated or deleted since the previous sync. To carry on from a previous process,
+    save 'hashes' and 'updated_at' and pass them back in.
+
+    Args:
+        api: The CofeCMS instance to use.
+        resources: The resources to track, any of 'contacts', 'posts' and 'places'.
+        id_fields: Optionally a dict of resource to the field holding each record's ID.
+        hashes: Optionally a dict of resource to a dict of record ID to content hash, from a
+            previous tracker.
+        updated_at: Optionally the datetime of the previous sync.
+    """
+
+    def __init__(
+            self,
+            api,
+            resources=tuple(DEFAULT_ID_FIELDS),
+            id_fields=None,
+            hashes=None,
+            updated_at=None,
+    ):
+        self.api = api
+        self.resources = tuple(resources)
+        self.id_fields = dict(DEFAULT_ID_FIELDS)
+        if id_fields:
+            self.id_fields.update(id_fields)
+        self.hashes = hashes if hashes is not None else {}
+        for resource in self.resources:
+            self.hashes.setdefault(resource, {})
+        self.updated_at = updated_at
+
+        self._subscribers = []
+
+    def subscribe(self, callback, resource=None, event_types=None):
+        """
+        Register a callback to be called with each matching ChangeEvent.
+
+        Args:
+            callback: A callable taking a ChangeEvent.
+            resource: Optionally only send events for this resource.
+            event_types: Optionally only send these event types, a list of EVENT_TYPES.
+
+        Returns:
+            The callback, so this can be used as a decorator.
+        """
+        event_types = frozenset(event_types) if event_types is not None else None
+        self._subscribers.append((callback, resource, event_types))
+        return callback
+
+    def unsubscribe(self, callback):
+        """
+        Stop sending events to a callback.
+        """
+        self._subscribers = [
+            subscriber for subscriber in self._subscribers if subscriber[0] != callback
+        ]
+
+    def sync(self, since=None, diocese_id=None, limit=1000, workers=None):
+        """
+        Fetch updated and deleted records, and send events for any which changed.
+
+        If a subscriber raises an exception, the sync stops and the record's stored hash isn't
+        updated, so the event is sent again on the next sync.
+
+        Args:
+            since: Only fetch records updated on or after this datetime. Defaults to when the last
+                sync started, or every record if there hasn't been one.
+            diocese_id: Optionally supply the diocese_id.
+            limit: The number of records to request per page.
+            workers: Optional number of pages to fetch concurrently.
+
+        Returns:
+            A Counter of the number of events of each type.
+        """
+        if since is None:
+            since = self.updated_at
+        started_at = datetime.datetime.now()
+
+        counts = Counter()
+        for resource in self.resources:
+            counts.update(self._sync_resource(resource, since, diocese_id, limit, workers))
+
+        self.updated_at = started_at
+        return counts
+
+    def _sync_resource(self, resource, since, diocese_id, limit, workers):
+        id_field = self.id_fields[resource]
+        hashes = self.hashes[resource]
+        counts = Counter()
+        seen = set()
+
+        def updated(record):
+            record_id = record[id_field]
+            seen.add(record_id)
+            record_hash = content_hash(record)
+            previous_hash = hashes.get(record_id)
+            if previous_hash == record_hash:
+                return
+
+            event_type = EVENT_CREATED if previous_hash is None else EVENT_UPDATED
+            self._publish(ChangeEvent(event_type, resource, record_id, record))
+            hashes[record_id] = record_hash
+            counts[event_type] += 1
+
+        def deleted(record):
+            record_id = record[id_field]
+            if record_id in hashes:
+                self._publish(ChangeEvent(EVENT_DELETED, resource, record_id, record))
+                del hashes[record_id]
+                counts[EVENT_DELETED] += 1
+
+        fetch_changes(
+            self.api, resource, since, updated, deleted, diocese_id=diocese_id, limit=limit,
+            workers=workers
+        )
+
+        if since is None:
+            # Everything was fetched, so any records which weren't returned have been deleted
+            for record_id in [record_id for record_id in hashes if record_id not in seen]:
+                self._publish(ChangeEvent(EVENT_DELETED, resource, record_id, None))
+                del hashes[record_id]
+                counts[EVENT_DELETED] += 1
+
+        return counts
+
+    def _publish(self, event):
+        for callback, resource, event_types in self._subscribers:
+            if resource is not None and resource != event.resource:
+                continue
+            if event_types is not None and event.event_type not in event_types:
+                continue
+            callback(event)
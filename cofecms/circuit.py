@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import Counter
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    Raised instead of making a request while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Stops a client making requests while the API is failing, so callers fail fast rather than
+    each waiting on a request which is likely to fail.
+
+    The breaker starts closed, letting every request through. After 'failure_threshold' failures
+    in a row it opens, and requests raise CircuitOpenError without being sent. A failure is an
+    exception from the transport, a 5xx response, or a response which took longer than
+    'slow_call_duration'. After 'reset_timeout' seconds the breaker is half open, and lets up to
+    'half_open_max_calls' requests through as probes. If they succeed it closes, otherwise it
+    opens again for another 'reset_timeout':
+
+        >>> breaker = CircuitBreaker(failure_threshold=5, slow_call_duration=2, reset_timeout=30)
+        >>> cofe = CofeCMS(API_ID, API_KEY, diocese_id, circuit_breaker=breaker, cache=cache)
+        >>> breaker.status()
+        {'state': 'closed', 'consecutive_failures': 0, 'retry_in': None, ...}
+
+    If the client has a ResponseCache and 'serve_from_cache' is True, requests made while the
+    breaker is open are answered with the cached response when there is one, however old.
+
+    Args:
+        failure_threshold: The number of failures in a row which opens the breaker.
+        slow_call_duration: Optionally the number of seconds after which a response counts as a
+            failure, even though it's still returned.
+        reset_timeout: The number of seconds to stay open before letting probe requests through.
+        half_open_max_calls: The most probe requests in flight at once while half open.
+        serve_from_cache: Whether to answer requests from the client's cache while open.
+        on_state_change: Optionally a callable taking the old and new state, such as for logging
+            or metrics.
+
+    Attributes:
+        stats: A Counter of 'successes', 'failures', 'slow_calls', 'rejected', 'opened' and
+            'served_from_cache'.
+    """
+
+    def __init__(
+            self,
+            failure_threshold=5,
+            slow_call_duration=None,
+            reset_timeout=30.0,
+            half_open_max_calls=1,
+            serve_from_cache=True,
+            on_state_change=None,
+    ):
+        self.failure_threshold = failure_threshold
+        self.slow_call_duration = slow_call_duration
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.serve_from_cache = serve_from_cache
+        self.on_state_change = on_state_change
+
+        self.stats = Counter()
+        self.consecutive_failures = 0
+
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._opened_at = None
+        self._probes = 0
+        # State changes waiting to be passed to on_state_change, once the lock is released
+        self._transitions = []
+
+    @property
+    def state(self):
+        """
+        The current state, one of STATE_CLOSED, STATE_OPEN or STATE_HALF_OPEN.
+        """
+        with self._lock:
+            state = self._current_state()
+        self._notify()
+        return state
+
+    def status(self):
+        """
+        Returns a dict describing the breaker, for monitoring.
+        """
+        with self._lock:
+            state = self._current_state()
+            retry_in = None
+            if state == STATE_OPEN:
+                retry_in = max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+            status = {
+                'state': state,
+                'consecutive_failures': self.consecutive_failures,
+                'retry_in': retry_in,
+            }
+            status.update(self.stats)
+        self._notify()
+        return status
+
+    def before_request(self):
+        """
+        Check whether a request may be sent, which must then be followed by a call to 'record'.
+
+        Returns:
+            Whether the request is a half open probe, to be passed to 'record'.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or half open with enough probes in flight.
+        """
+        with self._lock:
+            state = self._current_state()
+            probe = state == STATE_HALF_OPEN and self._probes < self.half_open_max_calls
+            if probe:
+                self._probes += 1
+            elif state != STATE_CLOSED:
+                self.stats['rejected'] += 1
+        self._notify()
+        if state == STATE_CLOSED or probe:
+            return probe
+        raise CircuitOpenError('The circuit breaker is open, so the request was not sent')
+
+    def record(self, success, duration, probe=False):
+        """
+        Record the outcome of a request.
+
+        Args:
+            success: Whether a response was received without a server error.
+            duration: How long the request took, in seconds.
+            probe: Whether the request was a half open probe, as returned by 'before_request'.
+        """
+        if success and self.slow_call_duration is not None and duration > self.slow_call_duration:
+            success = False
+            slow = True
+        else:
+            slow = False
+
+        with self._lock:
+            if probe:
+                self._probes = max(self._probes - 1, 0)
+            if slow:
+                self.stats['slow_calls'] += 1
+
+            if success:
+                self.stats['successes'] += 1
+                self.consecutive_failures = 0
+                if probe and self._state == STATE_HALF_OPEN:
+                    self._set_state(STATE_CLOSED)
+            else:
+                self.stats['failures'] += 1
+                self.consecutive_failures += 1
+                if probe or (
+                    self._state == STATE_CLOSED and
+                    self.consecutive_failures >= self.failure_threshold
+                ):
+                    self._open()
+        self._notify()
+
+    def reset(self):
+        """
+        Close the breaker and forget any failures.
+        """
+        with self._lock:
+            self.consecutive_failures = 0
+            self._set_state(STATE_CLOSED)
+        self._notify()
+
+    def _current_state(self):
+        if (
+            self._state == STATE_OPEN and
+            time.monotonic() >= self._opened_at + self.reset_timeout
+        ):
+            self._set_state(STATE_HALF_OPEN)
+        return self._state
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self.stats['opened'] += 1
+        self._set_state(STATE_OPEN)
+
+    def _set_state(self, state):
+        previous, self._state = self._state, state
+        if state != STATE_HALF_OPEN:
+            self._probes = 0
+        if previous != state and self.on_state_change is not None:
+            self._transitions.append((previous, state))
+
+    def _notify(self):
+        # Called without the lock held, so on_state_change can use the breaker
+        with self._lock:
+            transitions, self._transitions = self._transitions, []
+        for previous, state in transitions:
+            self.on_state_change(previous, state)
@@ -0,0 +1,157 @@
+import argparse
+import datetime
+import os
+import sys
+from collections import OrderedDict
+
+from cofecms import export
+from cofecms.api import CofeCMS
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+
+def parse_date(value):
+    """
+    Parse a date given on the command line, such as '2017-03-20' or '2017-03-20 14:30'.
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('Invalid date: {}'.format(value))
+
+
+def parse_fields(value):
+    """
+    Parse a comma separated list of 'section.field' names into the dict used for 'fields'.
+
+    For example 'contact.forenames,contact.surname' becomes {'contact': ['forenames', 'surname']}.
+    """
+    fields = OrderedDict()
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        section, sep, field = item.partition('.')
+        if not sep or not section or not field:
+            raise argparse.ArgumentTypeError(
+                'Invalid field "{}", fields should be given as section.field'.format(item)
+            )
+        fields.setdefault(section, []).append(field)
+    return fields
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='cofecms', description='Church of England CMS API client'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    export_parser = subparsers.add_parser(
+        'export',
+        help='Stream all records for a resource to a file.',
+        description='Stream all records for a resource to NDJSON, CSV or Parquet.',
+    )
+    export_parser.add_argument('resource', choices=list(export.RESOURCES.keys()))
+    export_parser.add_argument(
+        '-o',
+        '--output',
+        default='-',
+        help='File to write to, or "-" for stdout. The format and compression are guessed from '
+        'the file name if not given.',
+    )
+    export_parser.add_argument('-f', '--format', choices=export.FORMATS)
+    export_parser.add_argument(
+        '--compress', choices=export.COMPRESSIONS, help='Compress NDJSON or CSV output.'
+    )
+    export_parser.add_argument(
+        '--fields',
+        type=parse_fields,
+        help='Comma separated list of fields to include, for example "contact.surname".',
+    )
+    export_parser.add_argument(
+        '--since', type=parse_date, help='Only export records updated on or after this date.'
+    )
+    export_parser.add_argument(
+        '--until', type=parse_date, help='Only export records updated on or before this date.'
+    )
+    export_parser.add_argument(
+        '--limit', type=int, default=1000, help='Records per page. Maximum of 1000.'
+    )
+    export_parser.add_argument(
+        '--workers', type=int, default=4, help='Number of pages to fetch concurrently.'
+    )
+    export_parser.add_argument(
+        '--processes',
+        type=int,
+        help='Fetch and decode pages in this many worker processes, instead of using --workers.',
+    )
+    export_parser.add_argument(
+        '--timeout',
+        type=float,
+        help='Seconds to wait for the API to respond before giving up on a request.',
+    )
+    export_parser.add_argument(
+        '--api-id', default=os.environ.get('COFECMS_API_ID'), help='Defaults to $COFECMS_API_ID.'
+    )
+    export_parser.add_argument(
+        '--api-key',
+        default=os.environ.get('COFECMS_API_KEY'),
+        help='Defaults to $COFECMS_API_KEY.',
+    )
+    export_parser.add_argument(
+        '--diocese-id',
+        default=os.environ.get('COFECMS_DIOCESE_ID'),
+        help='Defaults to $COFECMS_DIOCESE_ID.',
+    )
+    export_parser.set_defaults(handler=handle_export)
+    return parser
+
+
+def handle_export(parser, args):
+    if not args.api_id or not args.api_key or not args.diocese_id:
+        parser.error('--api-id, --api-key and --diocese-id are required')
+
+    guessed_format, guessed_compression = export.guess_format(args.output)
+    output_format = args.format or guessed_format or export.FORMAT_NDJSON
+    compression = args.compress or guessed_compression
+
+    if output_format == export.FORMAT_PARQUET:
+        if args.output == '-':
+            parser.error('Parquet output must be written to a file')
+        if compression is not None:
+            parser.error('--compress can only be used for NDJSON or CSV output')
+        sink = export.ParquetSink(args.output)
+    else:
+        fileobj = export.open_output(args.output, compression)
+        if output_format == export.FORMAT_CSV:
+            sink = export.CSVSink(fileobj)
+        else:
+            sink = export.NDJSONSink(fileobj)
+
+    api = CofeCMS(args.api_id, args.api_key, args.diocese_id, timeout=args.timeout)
+    try:
+        count = export.export(
+            api,
+            args.resource,
+            sink,
+            fields=args.fields,
+            start_date=args.since,
+            end_date=args.until,
+            limit=args.limit,
+            workers=args.workers,
+            processes=args.processes,
+        )
+    finally:
+        sink.close()
+
+    sys.stderr.write('Exported {} {}\n'.format(count, args.resource))
+    return 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    return args.handler(parser, args)
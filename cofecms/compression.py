@@ -0,0 +1,135 @@
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+# Most preferred first. zstd and br compress repetitive JSON better than gzip, but need the
+# zstandard or brotli packages installed to be decoded.
+PREFERRED_ENCODINGS = ('zstd', 'br', 'gzip', 'deflate')
+
+ID_RE = re.compile(r'/\d+(?=/|$)')
+
+# What every version of urllib3 can decode, for when it can't be asked
+DEFAULT_ACCEPT_ENCODING = 'gzip, deflate'
+
+
+def supported_encodings():
+    """
+    Returns the content encodings which urllib3 (and so requests) is able to decode.
+    """
+    try:
+        from urllib3.util.request import ACCEPT_ENCODING
+    except ImportError:
+        # Older versions of requests bundle their own copy of urllib3, which may be too old to
+        # say what it supports
+        try:
+            from requests.packages.urllib3.util.request import ACCEPT_ENCODING
+        except ImportError:
+            ACCEPT_ENCODING = DEFAULT_ACCEPT_ENCODING
+    return set(encoding.strip() for encoding in ACCEPT_ENCODING.split(','))
+
+
+def accept_encoding():
+    """
+    Generate the value for the 'Accept-Encoding' header, listing every supported encoding in
+    order of preference.
+    """
+    supported = supported_encodings()
+    return ', '.join(encoding for encoding in PREFERRED_ENCODINGS if encoding in supported)
+
+
+def wire_size(response):
+    """
+    Find the number of bytes a response body took on the wire, before being decompressed.
+
+    Returns:
+        The number of bytes, or None if it can't be worked out.
+    """
+    wire_bytes = getattr(response, 'wire_bytes', None)
+    if wire_bytes is not None:
+        return wire_bytes
+
+    # requests keeps the urllib3 response, which counts the bytes read from the socket
+    raw = getattr(response, 'raw', None)
+    if raw is not None and hasattr(raw, 'tell'):
+        try:
+            return raw.tell()
+        except (AttributeError, OSError, ValueError):
+            pass
+
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None:
+        return int(content_length)
+    return None
+
+
+class CompressionStats(object):
+    """
+    Collects the compressed (on the wire) and decompressed size of responses, for each endpoint.
+
+    Pass an instance to CofeCMS to have it record every response:
+
+        >>> stats = CompressionStats()
+        >>> cofe = CofeCMS(API_ID, API_KEY, diocese_id, compression_stats=stats)
+        >>> cofe.get_contacts().all()
+        >>> stats.summary()
+
+    IDs in endpoint URLs are grouped together, so '/v2/contacts/123' is recorded as
+    '/v2/contacts/{id}'.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint_url, response):
+        endpoint = ID_RE.sub('/{id}', urlsplit(endpoint_url).path)
+        encoding = response.headers.get('Content-Encoding') or 'identity'
+        decoded_bytes = len(response.content)
+        wire_bytes = wire_size(response)
+        if wire_bytes is None:
+            wire_bytes = decoded_bytes
+
+        with self._lock:
+            stats = self._endpoints.setdefault(
+                endpoint, {'requests': 0, 'wire_bytes': 0, 'decoded_bytes': 0, 'encodings': {}}
+            )
+            stats['requests'] += 1
+            stats['wire_bytes'] += wire_bytes
+            stats['decoded_bytes'] += decoded_bytes
+            stats['encodings'][encoding] = stats['encodings'].get(encoding, 0) + 1
+
+    def summary(self):
+        """
+        Returns an OrderedDict of endpoint to a dict of 'requests', 'wire_bytes', 'decoded_bytes',
+        'ratio' (wire bytes as a fraction of decoded bytes) and a count of each 'encodings' used.
+        """
+        summary = OrderedDict()
+        with self._lock:
+            for endpoint in sorted(self._endpoints):
+                stats = dict(self._endpoints[endpoint])
+                stats['encodings'] = dict(stats['encodings'])
+                stats['ratio'] = _ratio(stats['wire_bytes'], stats['decoded_bytes'])
+                summary[endpoint] = stats
+        return summary
+
+    def totals(self):
+        """
+        Returns a dict of 'requests', 'wire_bytes', 'decoded_bytes' and 'ratio' for all endpoints.
+        """
+        totals = {'requests': 0, 'wire_bytes': 0, 'decoded_bytes': 0}
+        for stats in self.summary().values():
+            for key in totals:
+                totals[key] += stats[key]
+        totals['ratio'] = _ratio(totals['wire_bytes'], totals['decoded_bytes'])
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+def _ratio(wire_bytes, decoded_bytes):
+    if not decoded_bytes:
+        return None
+    return wire_bytes / decoded_bytes
@@ -0,0 +1,72 @@
+import time
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    Raised when a deadline passes before a call has finished.
+
+    Attributes:
+        partial: The results fetched before the deadline passed, if the call collects them, such
+            as the records from every complete page for CofeCMSResult.all(). Otherwise None.
+    """
+
+    def __init__(self, message='The deadline was exceeded', partial=None):
+        super().__init__(message)
+        self.partial = partial
+
+
+class Deadline(object):
+    """
+    A point in time by which a call, including every request it makes, must finish.
+
+    Args:
+        seconds: The number of seconds from now until the deadline.
+    """
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def coerce(cls, deadline):
+        """
+        Returns a Deadline for a 'deadline' argument, which can be None, a number of seconds from
+        now, or a Deadline which is returned as it is, so it can be passed on to other calls.
+        """
+        if deadline is None or isinstance(deadline, Deadline):
+            return deadline
+        return cls(deadline)
+
+    def remaining(self):
+        """
+        Returns the number of seconds until the deadline, which is negative once it has passed.
+        """
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, partial=None):
+        """
+        Raises DeadlineExceededError if the deadline has passed.
+        """
+        if self.expired:
+            raise DeadlineExceededError(partial=partial)
+
+    def timeout(self, timeout=None):
+        """
+        Limit a request timeout so it can't run past the deadline.
+
+        Args:
+            timeout: A timeout in seconds, a tuple of (connect timeout, read timeout), or None.
+
+        Returns:
+            The timeout, with each part no longer than the time until the deadline.
+        """
+        remaining = max(self.remaining(), 0.001)
+        if timeout is None:
+            return remaining
+        if isinstance(timeout, tuple):
+            return tuple(min(part, remaining) if part is not None else remaining
+                         for part in timeout)
+        return min(timeout, remaining)
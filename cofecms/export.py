@@ -0,0 +1,440 @@
+import bz2
+import csv
+import gzip
+import io
+import json
+import lzma
+import sys
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+
+from cofecms.api import RESOURCES, CofeCMS
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+FORMATS = (FORMAT_NDJSON, FORMAT_CSV, FORMAT_PARQUET)
+
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_BZ2 = 'bz2'
+COMPRESSION_XZ = 'xz'
+COMPRESSIONS = (COMPRESSION_GZIP, COMPRESSION_BZ2, COMPRESSION_XZ)
+
+COMPRESSION_SUFFIXES = {
+    '.gz': COMPRESSION_GZIP,
+    '.bz2': COMPRESSION_BZ2,
+    '.xz': COMPRESSION_XZ,
+}
+
+FORMAT_SUFFIXES = {
+    '.ndjson': FORMAT_NDJSON,
+    '.jsonl': FORMAT_NDJSON,
+    '.json': FORMAT_NDJSON,
+    '.csv': FORMAT_CSV,
+    '.parquet': FORMAT_PARQUET,
+}
+
+
+def export(
+        api,
+        resource,
+        sink,
+        diocese_id=None,
+        search_params=None,
+        fields=None,
+        start_date=None,
+        end_date=None,
+        limit=1000,
+        workers=None,
+        processes=None,
+        transform=None,
+):
+    """
+    Stream every record for a resource into a sink, one page at a time.
+
+    Only the pages currently being fetched or written are held in memory, so memory use stays
+    constant regardless of how many records the query returns.
+
+    With 'processes', pages are fetched, decoded and transformed in a pool of worker processes,
+    each with its own client, so CPU heavy transforms aren't limited by the GIL. Each page is sent
+    back to this process as a single batch, and pages are still written in order.
+
+    Args:
+        api: A CofeCMS instance.
+        resource: One of the keys in RESOURCES, for example 'contacts' or 'deleted-places'.
+        sink: A sink object (see NDJSONSink, CSVSink and ParquetSink) to write the records to.
+        diocese_id: Optionally supply the diocese_id.
+        search_params: Optionally provide a dict of search params.
+        fields: Optional dict of fields to be included in the response.
+        start_date: Optional datetime to only export records updated on or after this date.
+        end_date: Optional datetime to only export records updated on or before this date.
+        limit: The number of records to request per page. Maximum of 1000.
+        workers: Optional number of pages to fetch concurrently.
+        processes: Optional number of worker processes to fetch pages in, instead of threads. Each
+            worker uses its own client with the default transport and the same credentials.
+        transform: Optional function called with each record, which returns the record to write,
+            or None to leave it out. With 'processes' it's called in the worker processes, so it
+            must be picklable, such as a function defined at the top level of a module.
+
+    Returns:
+        The number of records written to the sink.
+    """
+    try:
+        method = getattr(api, RESOURCES[resource])
+    except KeyError:
+        raise ValueError('Unknown resource: {}'.format(resource))
+
+    result = method(
+        diocese_id=diocese_id,
+        search_params=search_params,
+        end_date=end_date,
+        fields=fields,
+        limit=limit,
+        start_date=start_date,
+    )
+
+    if processes:
+        pages = _process_pages(api, result, processes, transform)
+    else:
+        pages = result.pages_generator(workers=workers)
+        if transform is not None:
+            pages = (_transform_page(transform, page) for page in pages)
+
+    count = 0
+    for page in pages:
+        if page:
+            sink.write_batch(page)
+            count += len(page)
+    return count
+
+
+def _process_pages(api, result, processes, transform):
+    # Like pages_generator, but fetches pages in worker processes. At most twice as many pages as
+    # there are processes are in flight at once, to keep memory use bounded.
+    config = (api.api_id, api.api_key, api._diocese_id, api.compact_records, api.timeout)
+    query = (
+        result.endpoint_url, result.diocese_id, result.search_params, result.limit,
+        result.basic_params
+    )
+    page_nums = iter(range(1, result.total_pages))
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        try:
+            # The first page has already been fetched, so only needs transforming
+            if transform is not None:
+                first_page = executor.submit(_transform_page, transform, list(result))
+
+            for page_num in page_nums:
+                pending.append(executor.submit(_fetch_page, config, query, page_num, transform))
+                if len(pending) >= processes * 2:
+                    break
+
+            yield result if transform is None else first_page.result()
+
+            while pending:
+                page = pending.popleft().result()
+                page_num = next(page_nums, None)
+                if page_num is not None:
+                    pending.append(
+                        executor.submit(_fetch_page, config, query, page_num, transform)
+                    )
+                yield page
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+# The client used by each worker process, keyed by its config
+_worker_clients = {}
+
+
+def _fetch_page(config, query, page_num, transform):
+    api = _worker_clients.get(config)
+    if api is None:
+        api_id, api_key, diocese_id, compact_records, timeout = config
+        api = _worker_clients[config] = CofeCMS(
+            api_id, api_key, diocese_id, compact_records=compact_records, timeout=timeout
+        )
+
+    endpoint_url, diocese_id, search_params, limit, basic_params = query
+    page = api.paged_get(
+        endpoint_url, diocese_id, search_params, offset=page_num * limit, limit=limit,
+        **basic_params
+    )
+    return _transform_page(transform, page)
+
+
+def _transform_page(transform, page):
+    # Returns a plain list, as a CofeCMSResult holds a reference to its client
+    if transform is None:
+        return list(page)
+    return [record for record in map(transform, page) if record is not None]
+
+
+def open_output(path, compression=None):
+    """
+    Open a text file for writing an export to, optionally compressing it.
+
+    Args:
+        path: The path to write to. Use '-' to write to stdout.
+        compression: Optionally one of COMPRESSIONS.
+
+    Returns:
+        A writable text file object. Closing it for stdout only flushes stdout.
+    """
+    if path == '-':
+        fileobj = _StdoutBuffer(sys.stdout.buffer)
+        if compression is None:
+            return io.TextIOWrapper(fileobj, encoding='utf-8', newline='')
+    else:
+        fileobj = path
+
+    if compression is None:
+        return open(fileobj, 'w', encoding='utf-8', newline='')
+    if compression == COMPRESSION_GZIP:
+        return gzip.open(fileobj, 'wt', encoding='utf-8', newline='')
+    if compression == COMPRESSION_BZ2:
+        return bz2.open(fileobj, 'wt', encoding='utf-8', newline='')
+    if compression == COMPRESSION_XZ:
+        return lzma.open(fileobj, 'wt', encoding='utf-8', newline='')
+    raise ValueError('Unknown compression: {}'.format(compression))
+
+
+class _StdoutBuffer(io.BufferedIOBase):
+    # Writes to stdout's buffer, which is flushed rather than closed when this is closed
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def flush(self):
+        self.buffer.flush()
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+        super().close()
+
+
+def guess_format(path):
+    """
+    Guess the output format and compression from a file name, such as 'contacts.csv.gz'.
+
+    Returns:
+        A tuple of (format, compression), either of which may be None if it can't be guessed.
+    """
+    compression = None
+    for suffix, suffix_compression in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            compression = suffix_compression
+            path = path[:-len(suffix)]
+            break
+
+    output_format = None
+    for suffix, suffix_format in FORMAT_SUFFIXES.items():
+        if path.endswith(suffix):
+            output_format = suffix_format
+            break
+
+    return output_format, compression
+
+
+class NDJSONSink(object):
+    """
+    Writes records as newline delimited JSON, one record per line.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write_batch(self, records):
+        self.fileobj.writelines(
+            json.dumps(record, separators=(',', ':'), default=_json_default) + '\n'
+            for record in records
+        )
+
+    def close(self):
+        self.fileobj.close()
+
+
+class CSVSink(object):
+    """
+    Writes records as CSV.
+
+    As records are streamed, the columns are taken from the supplied fieldnames or the keys of the
+    first record written. Keys not present in the first record are ignored. Any nested values are
+    written as JSON.
+    """
+
+    def __init__(self, fileobj, fieldnames=None):
+        self.fileobj = fileobj
+        self.fieldnames = fieldnames
+        self.writer = None
+
+    def write_batch(self, records):
+        if self.writer is None:
+            if self.fieldnames is None:
+                self.fieldnames = list(records[0].keys())
+            self.writer = csv.DictWriter(
+                self.fileobj, fieldnames=self.fieldnames, extrasaction='ignore'
+            )
+            self.writer.writeheader()
+
+        self.writer.writerows(self._flatten(record) for record in records)
+
+    def close(self):
+        self.fileobj.close()
+
+    def _flatten(self, record):
+        return dict(
+            (key, json.dumps(value) if isinstance(value, (dict, list)) else value)
+            for key, value in record.items()
+        )
+
+
+class SchemaMismatchError(ValueError):
+    """
+    Raised when records don't fit the schema of a Parquet file which is already being written.
+
+    Attributes:
+        columns: The names of the columns which don't fit.
+    """
+
+    def __init__(self, message, columns):
+        super().__init__(message)
+        self.columns = columns
+
+
+class ParquetSink(object):
+    """
+    Writes records to a Parquet file, with one row group per page of records.
+
+    Requires pyarrow to be installed. Unless a 'schema' is given, it's inferred from the records.
+    A column which is null in every record so far has no type yet, so pages are held back until
+    every column has one, or 'infer_pages' pages have been collected. Any columns still without a
+    type are then written as text, with other values encoded as JSON.
+
+    Once the schema has been inferred it can't change, so a column first seen in a later page, or
+    a value of another type, raises SchemaMismatchError rather than being dropped. Pass 'schema'
+    for resources where that happens. Keys which aren't in a given schema are left out.
+
+    Args:
+        path: The file to write to.
+        compression: The Parquet compression codec.
+        schema: Optionally the pyarrow.Schema to write.
+        infer_pages: The most pages to hold back while inferring the schema.
+    """
+
+    def __init__(self, path, compression='snappy', schema=None, infer_pages=10):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('pyarrow must be installed to export to Parquet')
+
+        self.pyarrow = pyarrow
+        self.path = path
+        self.compression = compression
+        self.schema = schema
+        self.infer_pages = infer_pages
+        self.writer = None
+        self._pending = []
+        self._text_columns = set()
+
+    def write_batch(self, records):
+        records = [record if isinstance(record, dict) else dict(record) for record in records]
+        if self.writer is not None:
+            self._write(records)
+            return
+
+        self._pending.append(records)
+        schema = self.schema or self._infer_schema()
+        if schema is not None:
+            self._open(schema)
+
+    def close(self):
+        if self.writer is None and self._pending:
+            self._open(self.schema or self._infer_schema(final=True))
+        if self.writer is not None:
+            self.writer.close()
+
+    def _infer_schema(self, final=False):
+        # Use the first type found for each column, across every page held back
+        types = OrderedDict()
+        for records in self._pending:
+            for field in self.pyarrow.Table.from_pylist(records).schema:
+                if field.name not in types or self.pyarrow.types.is_null(types[field.name]):
+                    types[field.name] = field.type
+
+        null_columns = [name for name, type in types.items() if self.pyarrow.types.is_null(type)]
+        if null_columns and not final and len(self._pending) < self.infer_pages:
+            return None
+        for name in null_columns:
+            types[name] = self.pyarrow.string()
+            self._text_columns.add(name)
+        return self.pyarrow.schema(list(types.items()))
+
+    def _open(self, schema):
+        self.writer = self.pyarrow.parquet.ParquetWriter(
+            self.path, schema, compression=self.compression
+        )
+        pending, self._pending = self._pending, []
+        for records in pending:
+            self._write(records)
+
+    def _write(self, records):
+        schema = self.writer.schema
+        if self.schema is None:
+            new_columns = sorted(set(key for record in records for key in record) -
+                                 set(schema.names))
+            if new_columns:
+                raise SchemaMismatchError(
+                    'New columns {} found after the Parquet schema was inferred, pass a schema '
+                    'to ParquetSink to include them'.format(', '.join(new_columns)),
+                    new_columns,
+                )
+        if self._text_columns:
+            records = [self._encode_text_columns(record) for record in records]
+
+        try:
+            table = self.pyarrow.Table.from_pylist(records, schema=schema)
+        except (self.pyarrow.ArrowInvalid, self.pyarrow.ArrowTypeError):
+            columns = self._mismatched_columns(records)
+            if not columns:
+                raise
+            raise SchemaMismatchError(
+                'Values in columns {} do not fit the Parquet schema, pass a schema to '
+                'ParquetSink with types which fit them'.format(', '.join(columns)),
+                columns,
+            )
+        self.writer.write_table(table)
+
+    def _mismatched_columns(self, records):
+        columns = []
+        for field in self.writer.schema:
+            try:
+                self.pyarrow.array([record.get(field.name) for record in records], field.type)
+            except (self.pyarrow.ArrowInvalid, self.pyarrow.ArrowTypeError):
+                columns.append(field.name)
+        return columns
+
+    def _encode_text_columns(self, record):
+        record = dict(record)
+        for name in self._text_columns:
+            value = record.get(name)
+            if value is not None and not isinstance(value, str):
+                record[name] = json.dumps(value, default=_json_default)
+        return record
+
+
+def _json_default(value):
+    # Allows CompactRecords, and any other read only mappings, to be encoded
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
@@ -0,0 +1,336 @@
+import datetime
+import heapq
+import math
+from collections import namedtuple
+
+from cofecms.sync import fetch_changes
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# A place found by a spatial query, with its distance from the query point in kilometres
+Nearby = namedtuple('Nearby', ('distance', 'place'))
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """
+    Returns the great circle distance between two points, in kilometres.
+    """
+    latitude1, longitude1, latitude2, longitude2 = map(
+        math.radians, (latitude1, longitude1, latitude2, longitude2)
+    )
+    a = (
+        math.sin((latitude2 - latitude1) / 2) ** 2 +
+        math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex(object):
+    """
+    A grid index of places by latitude and longitude, for nearest place and radius queries.
+
+    Places are bucketed into cells of 'cell_size' degrees, with a separate grid for each place
+    type, so a query only measures the distance to places in nearby cells of the wanted types:
+
+        >>> index = SpatialIndex.from_api(cofe)
+        >>> index.nearest(52.4068, -1.5197, k=5, place_type=cofecms.PLACE_TYPE_CHURCH)
+        [Nearby(distance=0.31, place={...}), ...]
+        >>> index.within(52.4068, -1.5197, 10, place_type=cofecms.PLACE_TYPE_CHURCH)
+        >>> index.refresh(cofe)
+
+    Places without both coordinates are ignored.
+
+    Args:
+        cell_size: The size of each grid cell, in degrees. Defaults to 0.1, roughly 11km.
+        id_field: The field holding each place's ID. Defaults to 'id'.
+        latitude_field: The field holding each place's latitude. Defaults to 'latitude'.
+        longitude_field: The field holding each place's longitude. Defaults to 'longitude'.
+        type_field: The field holding each place's PLACE_TYPE_*. Defaults to 'place_type_id'.
+    """
+
+    def __init__(
+            self,
+            cell_size=0.1,
+            id_field='id',
+            latitude_field='latitude',
+            longitude_field='longitude',
+            type_field='place_type_id',
+    ):
+        self.cell_size = cell_size
+        self.id_field = id_field
+        self.latitude_field = latitude_field
+        self.longitude_field = longitude_field
+        self.type_field = type_field
+
+        self.places = {}
+        self.updated_at = None
+
+        self._columns = int(round(360 / cell_size))
+        self._grids = {}
+        self._counts = {}
+        self._locations = {}
+
+    @classmethod
+    def from_api(
+            cls, api, diocese_id=None, search_params=None, limit=1000, workers=None, **kwargs
+    ):
+        """
+        Build an index from every place returned by get_places().
+
+        Args:
+            api: The CofeCMS instance to use.
+            diocese_id: Optionally supply the diocese_id.
+            search_params: Optionally provide a dict of search params.
+            limit: The number of places to request per page.
+            workers: Optional number of pages to fetch concurrently.
+            **kwargs: Passed on to SpatialIndex.
+        """
+        index = cls(**kwargs)
+        index.refresh(
+            api, diocese_id=diocese_id, search_params=search_params, limit=limit, workers=workers
+        )
+        return index
+
+    def __len__(self):
+        return len(self.places)
+
+    def __contains__(self, place_id):
+        return place_id in self.places
+
+    def add(self, place):
+        """
+        Add or update a place. A place without coordinates is removed from the index.
+        """
+        place_id = place[self.id_field]
+        self.remove(place_id)
+
+        latitude = place.get(self.latitude_field)
+        longitude = place.get(self.longitude_field)
+        if latitude is None or longitude is None:
+            return
+        latitude = float(latitude)
+        longitude = float(longitude)
+
+        place_type = place.get(self.type_field)
+        cell = self._cell(latitude, longitude)
+        grid = self._grids.setdefault(place_type, {})
+        grid.setdefault(cell, {})[place_id] = (latitude, longitude)
+        self._counts[place_type] = self._counts.get(place_type, 0) + 1
+        self.places[place_id] = place
+        self._locations[place_id] = (place_type, cell)
+
+    def remove(self, place_id):
+        """
+        Remove a place, if it's in the index.
+        """
+        location = self._locations.pop(place_id, None)
+        if location is None:
+            return
+        del self.places[place_id]
+
+        place_type, cell = location
+        grid = self._grids[place_type]
+        del grid[cell][place_id]
+        self._counts[place_type] -= 1
+        if not grid[cell]:
+            del grid[cell]
+            if not grid:
+                del self._grids[place_type]
+                del self._counts[place_type]
+
+    def refresh(
+            self, api, since=None, diocese_id=None, search_params=None, limit=1000, workers=None
+    ):
+        """
+        Update the index with places which have been updated or deleted.
+
+        Args:
+            api: The CofeCMS instance to use.
+            since: Only fetch places updated on or after this datetime. Defaults to when the index
+                was last refreshed, or every place if it never has been.
+            diocese_id: Optionally supply the diocese_id.
+            search_params: Optionally provide a dict of search params.
+            limit: The number of places to request per page.
+            workers: Optional number of pages to fetch concurrently.
+        """
+        if since is None:
+            since = self.updated_at
+        started_at = datetime.datetime.now()
+
+        fetch_changes(
+            api,
+            'places',
+            since,
+            self.add,
+            lambda place: self.remove(place[self.id_field]),
+            diocese_id=diocese_id,
+            search_params=search_params,
+            limit=limit,
+            workers=workers,
+        )
+
+        self.updated_at = started_at
+
+    def nearest(self, latitude, longitude, k=1, place_type=None, max_distance=None):
+        """
+        Find the places closest to a point.
+
+        Args:
+            latitude: The latitude of the point.
+            longitude: The longitude of the point.
+            k: The number of places to return.
+            place_type: Optionally a PLACE_TYPE_*, or a list of them, to only include those types.
+            max_distance: Optionally the furthest away a place can be, in kilometres.
+
+        Returns:
+            A list of up to k Nearby tuples of (distance, place), closest first.
+        """
+        place_types = self._place_types(place_type)
+        grids = [self._grids[each] for each in place_types]
+        # There's no point searching further once every place has been found
+        k = min(k, sum(self._counts[each] for each in place_types))
+        if k < 1:
+            return []
+
+        row, column = self._cell(latitude, longitude)
+        occupied = sum(len(grid) for grid in grids)
+        # A heap of the k closest places so far, as (-distance, place_id)
+        closest = []
+        ring = 0
+        while True:
+            if 8 * ring >= occupied:
+                # The rings are now bigger than the number of cells with places in, so check every
+                # remaining cell directly rather than searching mostly empty rings
+                cells = self._occupied_cells(grids, row, column, min_ring=ring)
+            else:
+                cells = self._ring(row, column, ring)
+
+            for distance, place_id in self._distances(latitude, longitude, grids, cells):
+                if max_distance is not None and distance > max_distance:
+                    continue
+                if len(closest) < k:
+                    heapq.heappush(closest, (-distance, place_id))
+                elif distance < -closest[0][0]:
+                    heapq.heapreplace(closest, (-distance, place_id))
+
+            if 8 * ring >= occupied:
+                break
+            # Anything outside the cells searched so far is at least this far away
+            bound = self._ring_distance(latitude, ring, -closest[0][0] if closest else 0)
+            if len(closest) == k and -closest[0][0] <= bound:
+                break
+            if max_distance is not None and bound > max_distance:
+                break
+            ring += 1
+
+        return [
+            Nearby(-distance, self.places[place_id])
+            for distance, place_id in sorted(closest, key=lambda item: (-item[0], item[1]))
+        ]
+
+    def within(self, latitude, longitude, radius, place_type=None):
+        """
+        Find every place within a distance of a point.
+
+        Args:
+            latitude: The latitude of the point.
+            longitude: The longitude of the point.
+            radius: The distance, in kilometres.
+            place_type: Optionally a PLACE_TYPE_*, or a list of them, to only include those types.
+
+        Returns:
+            A list of Nearby tuples of (distance, place), closest first.
+        """
+        grids = [self._grids[each] for each in self._place_types(place_type)]
+        latitude_cells = int(math.ceil(radius / KM_PER_DEGREE / self.cell_size))
+        longitude_scale = math.cos(
+            math.radians(min(90.0, abs(latitude) + latitude_cells * self.cell_size))
+        )
+        if longitude_scale * self._columns * self.cell_size * KM_PER_DEGREE <= 2 * radius:
+            longitude_cells = self._columns // 2
+        else:
+            longitude_cells = min(
+                self._columns // 2,
+                int(math.ceil(radius / (KM_PER_DEGREE * longitude_scale) / self.cell_size)),
+            )
+
+        row, column = self._cell(latitude, longitude)
+        if (2 * latitude_cells + 1) * (2 * longitude_cells + 1) > sum(len(grid) for grid in grids):
+            cells = (
+                cell for cell in self._occupied_cells(grids, row, column)
+                if abs(cell[0] - row) <= latitude_cells and
+                self._column_offset(cell[1], column) <= longitude_cells
+            )
+        else:
+            cells = (
+                (cell_row, cell_column % self._columns)
+                for cell_row in range(row - latitude_cells, row + latitude_cells + 1)
+                for cell_column in range(column - longitude_cells, column + longitude_cells + 1)
+            )
+
+        found = [
+            (distance, place_id)
+            for distance, place_id in self._distances(latitude, longitude, grids, cells)
+            if distance <= radius
+        ]
+        found.sort()
+        return [Nearby(distance, self.places[place_id]) for distance, place_id in found]
+
+    def _place_types(self, place_type):
+        if place_type is None:
+            return list(self._grids)
+        if not isinstance(place_type, (list, tuple, set, frozenset)):
+            place_type = [place_type]
+        return [each for each in place_type if each in self._grids]
+
+    def _cell(self, latitude, longitude):
+        return (
+            int(math.floor(latitude / self.cell_size)),
+            int(math.floor(longitude / self.cell_size)) % self._columns,
+        )
+
+    def _distances(self, latitude, longitude, grids, cells):
+        for cell in cells:
+            for grid in grids:
+                for place_id, (place_latitude, place_longitude) in grid.get(cell, {}).items():
+                    yield haversine(latitude, longitude, place_latitude, place_longitude), place_id
+
+    def _occupied_cells(self, grids, row, column, min_ring=0):
+        # Every cell with places in, which is at least 'min_ring' rings out from the centre cell
+        cells = set()
+        for grid in grids:
+            cells.update(grid)
+        return [
+            cell for cell in cells
+            if max(abs(cell[0] - row), self._column_offset(cell[1], column)) >= min_ring
+        ]
+
+    def _column_offset(self, column1, column2):
+        # The number of columns between two columns, allowing for wrapping around at 180 degrees
+        return min((column1 - column2) % self._columns, (column2 - column1) % self._columns)
+
+    def _ring(self, row, column, ring):
+        # The cells on the edge of the square 'ring' cells out from the centre cell
+        if ring == 0:
+            yield (row, column)
+            return
+        columns = set()
+        for offset in range(-ring, ring + 1):
+            columns.add((column + offset) % self._columns)
+        for cell_column in columns:
+            yield (row - ring, cell_column)
+            yield (row + ring, cell_column)
+        edge_columns = set(((column - ring) % self._columns, (column + ring) % self._columns))
+        for cell_row in range(row - ring + 1, row + ring):
+            for cell_column in edge_columns:
+                yield (cell_row, cell_column)
+
+    def _ring_distance(self, latitude, ring, distance):
+        # A lower bound on the distance to any point outside the first 'ring' rings of cells. A
+        # degree of longitude is shortest at the highest latitude a point 'distance' away could be.
+        if ring == 0:
+            return 0.0
+        highest_latitude = min(90.0, abs(latitude) + distance / KM_PER_DEGREE)
+        longitude_scale = math.cos(math.radians(highest_latitude))
+        return ring * self.cell_size * KM_PER_DEGREE * longitude_scale
@@ -0,0 +1,178 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+from cofecms.scheduler import with_current_priority
+
+# The paths of the endpoints for a single record, such as /v2/contacts/123
+SINGLE_RECORD_RE = re.compile(r'/v2/(contacts|posts|places)/\d+/?$')
+
+
+def is_single_record(endpoint_url, request_params):
+    """
+    The default way of choosing which requests to hedge, which is those for a single contact, post
+    or place.
+    """
+    return SINGLE_RECORD_RE.search(urlsplit(endpoint_url).path) is not None
+
+
+class RequestHedger(object):
+    """
+    Cuts the tail latency of single record requests by sending a second, duplicate request when
+    the first is slow, and using whichever response arrives first.
+
+    A request is slow once it has taken longer than 'percentile' of recent requests, so with the
+    default of 95 around one in twenty requests is hedged. Until 'min_samples' requests have been
+    timed, 'initial_delay' is used instead:
+
+        >>> hedger = RequestHedger(percentile=95, budget=0.05)
+        >>> cofe = CofeCMS(API_ID, API_KEY, diocese_id, hedger=hedger)
+        >>> cofe.get_contact(123)
+        >>> hedger.stats
+        Counter({'requests': 1})
+
+    Hedging uses up more of the rate limit, so the number of hedged requests in any 'window'
+    seconds is capped at 'budget' of the rate limit reported by the API. Before the rate limit is
+    known, it's capped at 'budget' of the requests made in the window.
+
+    Args:
+        percentile: The percentile of recent latencies to wait before hedging, from 0 to 100.
+        initial_delay: The seconds to wait before hedging until enough requests have been timed.
+        min_delay: The fewest seconds to wait before hedging.
+        budget: The most hedged requests, as a fraction of the rate limit.
+        window: The period the rate limit applies to, in seconds.
+        max_samples: The number of recent latencies to keep.
+        min_samples: The number of latencies needed before using 'percentile'.
+        workers: The number of threads to make requests in.
+        should_hedge: Optionally a callable taking the endpoint URL and request params, which
+            returns whether a request can be hedged. Defaults to is_single_record. Only
+            idempotent requests should be hedged.
+
+    Attributes:
+        stats: A Counter of 'requests', 'hedged', 'hedge_wins' and 'over_budget', which is the
+            number of slow requests which weren't hedged because of the budget.
+    """
+
+    def __init__(
+            self,
+            percentile=95,
+            initial_delay=0.5,
+            min_delay=0.01,
+            budget=0.05,
+            window=60,
+            max_samples=1000,
+            min_samples=20,
+            workers=8,
+            should_hedge=is_single_record,
+    ):
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.budget = budget
+        self.window = window
+        self.min_samples = min_samples
+        self.workers = workers
+        self.should_hedge = should_hedge
+
+        self.rate_limit = None
+        self.stats = Counter()
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=max_samples)
+        self._requests = deque()
+        self._hedges = deque()
+        self._executor = None
+
+    def delay(self):
+        """
+        Returns how many seconds to wait for a response before sending a hedged request.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return max(self.initial_delay, self.min_delay)
+            latencies = sorted(self._latencies)
+        index = min(int(len(latencies) * self.percentile / 100.0), len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
+
+    def request(self, function, *args, **kwargs):
+        """
+        Call 'function', which makes a request and returns the response, and call it again if
+        it's slow. Returns the first response, or raises the first exception if both fail.
+        """
+        executor = self._get_executor()
+        function = with_current_priority(function)
+        with self._lock:
+            self.stats['requests'] += 1
+            self._requests.append(time.monotonic())
+
+        first = executor.submit(self._timed, function, *args, **kwargs)
+        done, _ = wait([first], timeout=self.delay())
+        if done or not self._take_budget():
+            return first.result()
+
+        second = executor.submit(self._timed, function, *args, **kwargs)
+        futures = [first, second]
+        while True:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            # Prefer the first request if both have finished
+            future = first if first in done else second
+            if future.exception() is None or len(futures) == 1:
+                break
+            futures.remove(future)
+
+        if future is second and future.exception() is None:
+            with self._lock:
+                self.stats['hedge_wins'] += 1
+        elif future is second:
+            # Both failed, so raise the original request's error
+            future = first
+        return future.result()
+
+    def close(self):
+        """
+        Stop the request threads, once any requests in flight have finished.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _timed(self, function, *args, **kwargs):
+        started = time.monotonic()
+        response = function(*args, **kwargs)
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+            try:
+                self.rate_limit = int(response.headers.get('X-RateLimit-Limit'))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return response
+
+    def _take_budget(self):
+        # Whether another hedged request is allowed, in which case it's counted against the budget
+        with self._lock:
+            now = time.monotonic()
+            for timestamps in (self._requests, self._hedges):
+                while timestamps and timestamps[0] <= now - self.window:
+                    timestamps.popleft()
+
+            if self.rate_limit is not None:
+                allowed = self.budget * self.rate_limit
+            else:
+                allowed = self.budget * len(self._requests)
+            if len(self._hedges) + 1 > allowed:
+                self.stats['over_budget'] += 1
+                return False
+
+            self._hedges.append(now)
+            self.stats['hedged'] += 1
+            return True
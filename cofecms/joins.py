@@ -0,0 +1,213 @@
+import datetime
+from collections import namedtuple
+
+from cofecms.sync import fetch_changes
+
+# A post joined to the contact, place and role it links, any of which may be None if it isn't in
+# the index
+Assignment = namedtuple('Assignment', ('post', 'contact', 'place', 'role'))
+
+
+class JoinIndex(object):
+    """
+    An in-memory index of posts, joined to their contacts, places and roles.
+
+    Posts are indexed by contact, place and role, so questions like "who holds which role at this
+    church" are answered with hash lookups rather than loops over every post:
+
+        >>> index = JoinIndex.from_api(cofe)
+        >>> for assignment in index.assignments(place_id=church_id):
+                print(assignment.role['name'], assignment.contact['surname'])
+        >>> index.refresh(cofe)
+
+    Args:
+        id_field: The field holding the ID of each contact, place and role. Defaults to 'id'.
+        post_id_field: The field holding each post's ID. Defaults to 'post_id'.
+        contact_id_field: The field on posts holding the contact ID. Defaults to 'contact_id'.
+        place_id_field: The field on posts holding the place ID. Defaults to 'place_id'.
+        role_id_field: The field on posts holding the role ID. Defaults to 'role_id'.
+    """
+
+    def __init__(
+            self,
+            id_field='id',
+            post_id_field='post_id',
+            contact_id_field='contact_id',
+            place_id_field='place_id',
+            role_id_field='role_id',
+    ):
+        self.id_field = id_field
+        self.post_id_field = post_id_field
+        self.contact_id_field = contact_id_field
+        self.place_id_field = place_id_field
+        self.role_id_field = role_id_field
+
+        self.posts = {}
+        self.contacts = {}
+        self.places = {}
+        self.roles = {}
+        self.updated_at = None
+
+        self._by_contact = {}
+        self._by_place = {}
+        self._by_role = {}
+        self._links = (
+            (contact_id_field, self._by_contact),
+            (place_id_field, self._by_place),
+            (role_id_field, self._by_role),
+        )
+
+    @classmethod
+    def from_api(cls, api, diocese_id=None, limit=1000, workers=None, **kwargs):
+        """
+        Build an index from every post, contact, place and role.
+
+        Args:
+            api: The CofeCMS instance to use.
+            diocese_id: Optionally supply the diocese_id.
+            limit: The number of records to request per page.
+            workers: Optional number of pages to fetch concurrently.
+            **kwargs: Passed on to JoinIndex.
+        """
+        index = cls(**kwargs)
+        index.refresh(api, diocese_id=diocese_id, limit=limit, workers=workers)
+        return index
+
+    def __len__(self):
+        return len(self.posts)
+
+    def add_post(self, post):
+        """
+        Add or update a post.
+        """
+        post_id = post[self.post_id_field]
+        self.remove_post(post_id)
+        self.posts[post_id] = post
+        for field, posts_by_id in self._links:
+            linked_id = post.get(field)
+            if linked_id is not None:
+                posts_by_id.setdefault(linked_id, set()).add(post_id)
+
+    def remove_post(self, post_id):
+        """
+        Remove a post, if it's in the index.
+        """
+        post = self.posts.pop(post_id, None)
+        if post is None:
+            return
+        for field, posts_by_id in self._links:
+            linked_id = post.get(field)
+            post_ids = posts_by_id.get(linked_id)
+            if post_ids is not None:
+                post_ids.discard(post_id)
+                if not post_ids:
+                    del posts_by_id[linked_id]
+
+    def add_contact(self, contact):
+        self.contacts[contact[self.id_field]] = contact
+
+    def remove_contact(self, contact_id):
+        self.contacts.pop(contact_id, None)
+
+    def add_place(self, place):
+        self.places[place[self.id_field]] = place
+
+    def remove_place(self, place_id):
+        self.places.pop(place_id, None)
+
+    def add_role(self, role):
+        self.roles[role[self.id_field]] = role
+
+    def refresh(self, api, since=None, diocese_id=None, limit=1000, workers=None):
+        """
+        Update the index with records which have been updated or deleted.
+
+        Each resource is streamed a page at a time, in a single pass. Roles are always fetched in
+        full, as there are only a few of them.
+
+        Args:
+            api: The CofeCMS instance to use.
+            since: Only fetch records updated on or after this datetime. Defaults to when the index
+                was last refreshed, or every record if it never has been.
+            diocese_id: Optionally supply the diocese_id.
+            limit: The number of records to request per page.
+            workers: Optional number of pages to fetch concurrently.
+        """
+        if since is None:
+            since = self.updated_at
+        started_at = datetime.datetime.now()
+
+        resources = (
+            ('posts', self.add_post, lambda post: self.remove_post(post[self.post_id_field])),
+            ('contacts', self.add_contact,
+             lambda contact: self.remove_contact(contact[self.id_field])),
+            ('places', self.add_place, lambda place: self.remove_place(place[self.id_field])),
+        )
+        for resource, add, remove in resources:
+            fetch_changes(
+                api, resource, since, add, remove, diocese_id=diocese_id, limit=limit,
+                workers=workers
+            )
+
+        for role in api.get_roles(diocese_id=diocese_id):
+            self.add_role(role)
+
+        self.updated_at = started_at
+
+    def posts_for_contact(self, contact_id):
+        """
+        Returns a list of the posts held by a contact.
+        """
+        return self._posts(self._by_contact, contact_id)
+
+    def posts_for_place(self, place_id):
+        """
+        Returns a list of the posts at a place.
+        """
+        return self._posts(self._by_place, place_id)
+
+    def posts_for_role(self, role_id):
+        """
+        Returns a list of the posts with a role.
+        """
+        return self._posts(self._by_role, role_id)
+
+    def assignments(self, contact_id=None, place_id=None, role_id=None):
+        """
+        Find posts matching every filter given, joined to their contact, place and role.
+
+        Args:
+            contact_id: Optionally only include posts held by this contact.
+            place_id: Optionally only include posts at this place.
+            role_id: Optionally only include posts with this role.
+
+        Returns:
+            A list of Assignment tuples of (post, contact, place, role).
+        """
+        filters = [
+            posts_by_id.get(value, set())
+            for (field, posts_by_id), value in zip(self._links, (contact_id, place_id, role_id))
+            if value is not None
+        ]
+        if filters:
+            # Start from the smallest set, so the intersection is as cheap as possible
+            filters.sort(key=len)
+            post_ids = filters[0].intersection(*filters[1:])
+        else:
+            post_ids = self.posts
+
+        return [self.join(self.posts[post_id]) for post_id in post_ids]
+
+    def join(self, post):
+        """
+        Returns an Assignment for a post.
+        """
+        return Assignment(
+            post=post,
+            contact=self.contacts.get(post.get(self.contact_id_field)),
+            place=self.places.get(post.get(self.place_id_field)),
+            role=self.roles.get(post.get(self.role_id_field)),
+        )
+
+    def _posts(self, posts_by_id, linked_id):
+        return [self.posts[post_id] for post_id in posts_by_id.get(linked_id, ())]
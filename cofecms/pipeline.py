@@ -0,0 +1,255 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cofecms.scheduler import with_current_priority
+
+
+class StageStats(object):
+    """
+    Counts and timings for one stage of a Pipeline.
+
+    Attributes:
+        name: The name of the stage.
+        items_in: The number of items passed into the stage.
+        items_out: The number of items the stage passed on.
+        seconds: The total time spent in the stage's function. For concurrent stages this is
+            summed across workers, so can be more than the wall clock time.
+    """
+    __slots__ = ('name', 'items_in', 'items_out', 'seconds')
+
+    def __init__(self, name):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return 'StageStats(name={!r}, items_in={}, items_out={}, seconds={:.3f})'.format(
+            self.name, self.items_in, self.items_out, self.seconds
+        )
+
+
+class Pipeline(object):
+    """
+    A lazily evaluated stream of records, passed through a chain of map, filter and batch stages
+    and into a sink.
+
+    Records are pulled through the stages one at a time, so no stage builds an intermediate list
+    and a slow sink holds back the stages before it. A stage can run its function in several
+    threads, with at most 'buffer' records in flight, and still passes records on in order:
+
+        >>> pipeline = Pipeline.from_result(cofe.get_contacts(limit=1000), workers=4)
+        >>> pipeline.filter(has_email).map(geocode, workers=8).batch(500)
+        >>> pipeline.run(export.NDJSONSink(open('contacts.ndjson', 'w')))
+        >>> pipeline.stats
+        [StageStats(name='source', ...), StageStats(name='has_email', ...), ...]
+
+    A pipeline can only be run once, as its source is consumed.
+
+    Args:
+        source: An iterable of records.
+        name: The name to report stats for the source under.
+    """
+
+    def __init__(self, source, name='source'):
+        self.source = source
+        self.stats = [StageStats(name)]
+
+        self._stages = []
+        self._started = False
+
+    @classmethod
+    def from_result(cls, result, workers=None, name='source'):
+        """
+        Create a pipeline of every record in a paged query.
+
+        Args:
+            result: A CofeCMSResult from a paged query, such as get_contacts().
+            workers: Optional number of pages to fetch concurrently. See 'pages_generator'.
+            name: The name to report stats for the source under.
+        """
+        return cls(
+            (record for page in result.pages_generator(workers=workers) for record in page),
+            name=name,
+        )
+
+    def map(self, function, workers=None, buffer=None, name=None):
+        """
+        Add a stage which replaces each record with the result of calling 'function' with it.
+
+        Args:
+            function: A callable taking a record.
+            workers: Optional number of threads to call the function in.
+            buffer: The most records in flight at once when using workers. Defaults to twice the
+                number of workers.
+            name: The name to report stats for this stage under. Defaults to the function's name.
+
+        Returns:
+            The pipeline, so stages can be chained.
+        """
+        return self._add_stage(
+            self._map, function, workers, buffer, name or _name(function, 'map')
+        )
+
+    def filter(self, function, workers=None, buffer=None, name=None):
+        """
+        Add a stage which only passes on records for which 'function' returns a true value.
+
+        Takes the same arguments as 'map'.
+        """
+        return self._add_stage(
+            self._filter, function, workers, buffer, name or _name(function, 'filter')
+        )
+
+    def batch(self, size, name='batch'):
+        """
+        Add a stage which groups records into lists of up to 'size' records, such as for a sink's
+        write_batch.
+        """
+        if size < 1:
+            raise ValueError('Batch size must be at least 1')
+        self.stats.append(StageStats(name))
+        self._stages.append((self._batch, size, self.stats[-1]))
+        return self
+
+    def __iter__(self):
+        self._check_not_started()
+        self._started = True
+
+        items = self._source(self.stats[0])
+        for stage in self._stages:
+            items = stage[0](items, *stage[1:])
+        return items
+
+    def run(self, sink=None, batch_size=1000):
+        """
+        Run the pipeline to completion.
+
+        Args:
+            sink: Optionally an object with a 'write_batch' method, such as an export sink, or a
+                callable, to pass each batch of records to. If the pipeline doesn't end with a
+                batch stage, records are batched into lists of 'batch_size' first.
+            batch_size: The size of batches to write, if the pipeline doesn't end with a batch.
+
+        Returns:
+            The number of records written to the sink, or without a sink the number of items the
+            pipeline produced.
+        """
+        self._check_not_started()
+        if sink is None:
+            count = 0
+            for _ in self:
+                count += 1
+            return count
+
+        if not self._stages or self._stages[-1][0] != self._batch:
+            self.batch(batch_size)
+        write_batch = getattr(sink, 'write_batch', sink)
+        stats = StageStats('sink')
+        self.stats.append(stats)
+
+        count = 0
+        for batch in self:
+            stats.items_in += len(batch)
+            started = time.perf_counter()
+            write_batch(batch)
+            stats.seconds += time.perf_counter() - started
+            stats.items_out += len(batch)
+            count += len(batch)
+        return count
+
+    def _check_not_started(self):
+        if self._started:
+            raise RuntimeError('A pipeline can only be run once')
+
+    def _add_stage(self, stage, function, workers, buffer, name):
+        self.stats.append(StageStats(name))
+        self._stages.append((stage, function, workers, buffer, self.stats[-1]))
+        return self
+
+    def _source(self, stats):
+        items = iter(self.source)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                stats.seconds += time.perf_counter() - started
+            stats.items_in += 1
+            stats.items_out += 1
+            yield item
+
+    def _map(self, items, function, workers, buffer, stats):
+        for item, result in _call(items, function, workers, buffer, stats):
+            stats.items_out += 1
+            yield result
+
+    def _filter(self, items, function, workers, buffer, stats):
+        for item, result in _call(items, function, workers, buffer, stats):
+            if result:
+                stats.items_out += 1
+                yield item
+
+    def _batch(self, items, size, stats):
+        batch = []
+        for item in items:
+            stats.items_in += 1
+            batch.append(item)
+            if len(batch) >= size:
+                stats.items_out += 1
+                yield batch
+                batch = []
+        if batch:
+            stats.items_out += 1
+            yield batch
+
+
+def _name(function, default):
+    name = getattr(function, '__name__', '<lambda>')
+    return default if name == '<lambda>' else name
+
+
+def _timed(function, item):
+    started = time.perf_counter()
+    result = function(item)
+    return time.perf_counter() - started, result
+
+
+def _call(items, function, workers, buffer, stats):
+    # Yields (item, function(item)) for each item in order, calling the function in a thread pool
+    # if there are workers
+    if not workers or workers < 2:
+        for item in items:
+            stats.items_in += 1
+            seconds, result = _timed(function, item)
+            stats.seconds += seconds
+            yield item, result
+        return
+
+    buffer = max(buffer or workers * 2, 1)
+    function = with_current_priority(function)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            # Only pull another item from upstream once there's room for it, so a slow consumer
+            # holds back the stages before it rather than letting records pile up in memory.
+            for item in items:
+                stats.items_in += 1
+                pending.append((item, executor.submit(_timed, function, item)))
+                if len(pending) >= buffer:
+                    item, future = pending.popleft()
+                    seconds, result = future.result()
+                    stats.seconds += seconds
+                    yield item, result
+
+            while pending:
+                item, future = pending.popleft()
+                seconds, result = future.result()
+                stats.seconds += seconds
+                yield item, result
+        finally:
+            for item, future in pending:
+                future.cancel()
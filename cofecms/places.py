@@ -0,0 +1,233 @@
+import datetime
+
+from cofecms.sync import fetch_changes
+
+
+class PlaceHierarchy(object):
+    """
+    An in-memory index of places, for answering hierarchy questions without any API calls.
+
+    Build it from one bulk pull of get_places(), then keep it up to date with refresh(), which only
+    fetches places updated or deleted since the last refresh:
+
+        >>> hierarchy = PlaceHierarchy.from_api(cofe)
+        >>> churches = hierarchy.descendants(deanery_id, place_type=cofecms.PLACE_TYPE_CHURCH)
+        >>> hierarchy.refresh(cofe)
+
+    Args:
+        places: Optionally an iterable of place records to start with.
+        id_field: The field holding each place's ID. Defaults to 'id'.
+        parent_field: The field holding the ID of each place's parent. Defaults to 'parent_id'.
+        type_field: The field holding each place's PLACE_TYPE_*. Defaults to 'place_type_id'.
+    """
+
+    def __init__(
+            self, places=(), id_field='id', parent_field='parent_id', type_field='place_type_id'
+    ):
+        self.id_field = id_field
+        self.parent_field = parent_field
+        self.type_field = type_field
+
+        self.places = {}
+        self.updated_at = None
+        self._children = {}
+
+        for place in places:
+            self.add(place)
+
+    @classmethod
+    def from_api(
+            cls, api, diocese_id=None, search_params=None, limit=1000, workers=None, **kwargs
+    ):
+        """
+        Build a hierarchy from every place returned by get_places().
+
+        Args:
+            api: The CofeCMS instance to use.
+            diocese_id: Optionally supply the diocese_id.
+            search_params: Optionally provide a dict of search params.
+            limit: The number of places to request per page.
+            workers: Optional number of pages to fetch concurrently.
+            **kwargs: Passed on to PlaceHierarchy.
+        """
+        hierarchy = cls(**kwargs)
+        hierarchy.refresh(
+            api,
+            diocese_id=diocese_id,
+            search_params=search_params,
+            limit=limit,
+            workers=workers,
+        )
+        return hierarchy
+
+    def __len__(self):
+        return len(self.places)
+
+    def __contains__(self, place_id):
+        return place_id in self.places
+
+    def add(self, place):
+        """
+        Add or update a place, moving it if its parent has changed.
+        """
+        place_id = place[self.id_field]
+        existing = self.places.get(place_id)
+        if existing is not None:
+            self._unlink(place_id, existing.get(self.parent_field))
+
+        self.places[place_id] = place
+        parent_id = place.get(self.parent_field)
+        if parent_id is not None:
+            self._children.setdefault(parent_id, set()).add(place_id)
+
+    def remove(self, place_id):
+        """
+        Remove a place. Any children are kept, but will have no parent until it's added again.
+        """
+        place = self.places.pop(place_id, None)
+        if place is not None:
+            self._unlink(place_id, place.get(self.parent_field))
+
+    def refresh(
+            self, api, since=None, diocese_id=None, search_params=None, limit=1000, workers=None
+    ):
+        """
+        Update the hierarchy with places which have been updated or deleted.
+
+        Args:
+            api: The CofeCMS instance to use.
+            since: Only fetch places updated on or after this datetime. Defaults to when the
+                hierarchy was last refreshed, or every place if it never has been.
+            diocese_id: Optionally supply the diocese_id.
+            search_params: Optionally provide a dict of search params.
+            limit: The number of places to request per page.
+            workers: Optional number of pages to fetch concurrently.
+
+        Returns:
+            A tuple of the number of places (updated, deleted).
+        """
+        if since is None:
+            since = self.updated_at
+        started_at = datetime.datetime.now()
+
+        updated, deleted = fetch_changes(
+            api,
+            'places',
+            since,
+            self.add,
+            lambda place: self.remove(place[self.id_field]),
+            diocese_id=diocese_id,
+            search_params=search_params,
+            limit=limit,
+            workers=workers,
+        )
+
+        self.updated_at = started_at
+        return updated, deleted
+
+    def get(self, place_id):
+        """
+        Returns the place record, or None if it isn't in the hierarchy.
+        """
+        return self.places.get(place_id)
+
+    def parent(self, place_id):
+        """
+        Returns the parent place record, or None if it has no parent in the hierarchy.
+        """
+        place = self.places.get(place_id)
+        if place is None:
+            return None
+        return self.places.get(place.get(self.parent_field))
+
+    def children(self, place_id, place_type=None):
+        """
+        Returns a list of the place records directly below a place.
+
+        Args:
+            place_id: The ID of the place.
+            place_type: Optionally only return children of this PLACE_TYPE_*.
+        """
+        children = [self.places[child_id] for child_id in self._children.get(place_id, ())]
+        if place_type is not None:
+            children = [child for child in children if child.get(self.type_field) == place_type]
+        return children
+
+    def descendants(self, place_id, place_type=None):
+        """
+        A generator of every place record below a place, at any depth.
+
+        Args:
+            place_id: The ID of the place.
+            place_type: Optionally only yield places of this PLACE_TYPE_*, for example all the
+                churches in a deanery.
+        """
+        seen = set([place_id])
+        stack = list(self._children.get(place_id, ()))
+        while stack:
+            child_id = stack.pop()
+            if child_id in seen:
+                continue
+            seen.add(child_id)
+
+            child = self.places[child_id]
+            if place_type is None or child.get(self.type_field) == place_type:
+                yield child
+            stack.extend(self._children.get(child_id, ()))
+
+    def ancestors(self, place_id):
+        """
+        Returns a list of the place records above a place, starting with its parent.
+        """
+        ancestors = []
+        seen = set([place_id])
+        place = self.parent(place_id)
+        while place is not None and place[self.id_field] not in seen:
+            ancestors.append(place)
+            seen.add(place[self.id_field])
+            place = self.parent(place[self.id_field])
+        return ancestors
+
+    def path(self, place_id):
+        """
+        Returns a list of the place records from the top of the hierarchy down to the place, for
+        example for breadcrumbs.
+        """
+        place = self.places.get(place_id)
+        if place is None:
+            return []
+        return list(reversed(self.ancestors(place_id))) + [place]
+
+    def ancestor_of_type(self, place_id, place_type):
+        """
+        Returns the closest place record above a place with the given PLACE_TYPE_*, such as the
+        deanery a church is in, or None.
+        """
+        for ancestor in self.ancestors(place_id):
+            if ancestor.get(self.type_field) == place_type:
+                return ancestor
+        return None
+
+    def roots(self):
+        """
+        Returns a list of the place records which have no parent in the hierarchy.
+        """
+        return [
+            place for place in self.places.values()
+            if place.get(self.parent_field) not in self.places
+        ]
+
+    def of_type(self, place_type):
+        """
+        A generator of every place record with the given PLACE_TYPE_*.
+        """
+        for place in self.places.values():
+            if place.get(self.type_field) == place_type:
+                yield place
+
+    def _unlink(self, place_id, parent_id):
+        siblings = self._children.get(parent_id)
+        if siblings is not None:
+            siblings.discard(place_id)
+            if not siblings:
+                del self._children[parent_id]
@@ -0,0 +1,325 @@
+from collections import OrderedDict
+
+from cofecms.api import PRIVACY_SETTING_PRIVATE, PRIVACY_SETTING_PUBLIC
+
+PRIVACY_SETTING_SUFFIX = '_privacy_setting'
+
+
+def privacy_key_map(keys):
+    """
+    Find the fields which have privacy settings, from the keys of a record or schema.
+
+    Args:
+        keys: An iterable of field names.
+
+    Returns:
+        A tuple of (field, privacy_key) pairs, for each field with a privacy setting field.
+    """
+    keys = set(keys)
+    return tuple(
+        (key, key + PRIVACY_SETTING_SUFFIX) for key in sorted(keys)
+        if key + PRIVACY_SETTING_SUFFIX in keys
+    )
+
+
+def schema_sections(schema):
+    """
+    Iterate through the sections in the output of get_contact_fields() (or the post and place
+    equivalents).
+
+    Args:
+        schema: A CofeCMSResult or list of dicts, or a single dict, mapping each section name to a
+            list of field names or a dict keyed by field name.
+
+    Yields:
+        A tuple of (section, field_names) for each section.
+    """
+    if isinstance(schema, dict):
+        schema = [schema]
+
+    for item in schema:
+        for section, section_fields in item.items():
+            yield section, list(section_fields)
+
+
+def schema_field_names(schema):
+    """
+    Flatten the output of get_contact_fields() (or the post and place equivalents) into a list of
+    field names.
+
+    Args:
+        schema: A schema as accepted by schema_sections(). A plain list of field names is also
+            accepted.
+
+    Returns:
+        A list of unique field names, in the order they appear.
+    """
+    if isinstance(schema, (list, tuple)) and not any(isinstance(item, dict) for item in schema):
+        return list(OrderedDict.fromkeys(schema))
+
+    field_names = OrderedDict()
+    for section, section_fields in schema_sections(schema):
+        for field_name in section_fields:
+            field_names[field_name] = None
+    return list(field_names)
+
+
+def request_fields(schema, max_access_level=PRIVACY_SETTING_PUBLIC, wanted=None):
+    """
+    Work out the smallest 'fields' selection to request, to show records at an access level.
+
+    Privacy settings are stored on each record, so a privacy controlled field still needs its
+    '_privacy_setting' field requesting to decide whether it can be shown, unless the access level
+    allows everything to be seen. Privacy setting fields for fields which aren't wanted are never
+    requested.
+
+        >>> fields = request_fields(cofe.get_contact_fields(), wanted=['forenames', 'surname'])
+        >>> result = cofe.get_contacts(fields=fields)
+
+    Args:
+        schema: The output of get_contact_fields(), get_post_fields() or get_place_fields().
+        max_access_level: The highest privacy setting which will be shown.
+        wanted: Optionally the fields which will be used, either as a list of field names or a dict
+            of section to field names. Defaults to every field in the schema.
+
+    Returns:
+        An OrderedDict of section to a list of field names, to be passed as 'fields'.
+    """
+    all_field_names = set(schema_field_names(schema))
+    privacy_keys = dict(
+        (privacy_key, key) for key, privacy_key in privacy_key_map(all_field_names)
+    )
+    needs_privacy_settings = max_access_level < PRIVACY_SETTING_PRIVATE
+
+    if isinstance(wanted, dict):
+        all_wanted = set(field_name for names in wanted.values() for field_name in names)
+    elif wanted is not None:
+        all_wanted = set(wanted)
+    else:
+        all_wanted = all_field_names.difference(privacy_keys)
+
+    fields = OrderedDict()
+    for section, section_fields in schema_sections(schema):
+        if isinstance(wanted, dict):
+            section_wanted = set(wanted.get(section, ()))
+        else:
+            section_wanted = all_wanted
+
+        selected = []
+        for field_name in section_fields:
+            if field_name in privacy_keys:
+                include = needs_privacy_settings and privacy_keys[field_name] in all_wanted
+            else:
+                include = field_name in section_wanted
+            if include:
+                selected.append(field_name)
+
+        if selected:
+            fields[section] = selected
+    return fields
+
+
+class CompiledProjection(object):
+    """
+    Projects records onto a fixed set of fields for one access level, redacting as it goes.
+
+    Created by PrivacyProjection.for_access_level(), call it with a record to get a flat, already
+    redacted dict. Fields missing from the record are None.
+    """
+    __slots__ = (
+        'access_level', 'plain_fields', 'controlled_fields', 'schema_fields', 'dropped_fields'
+    )
+
+    def __init__(
+            self, access_level, plain_fields, controlled_fields, schema_fields, dropped_fields
+    ):
+        self.access_level = access_level
+        self.plain_fields = plain_fields
+        self.controlled_fields = controlled_fields
+        self.schema_fields = schema_fields
+        self.dropped_fields = dropped_fields
+
+    def __call__(self, record):
+        if record.keys() == self.schema_fields:
+            # The record has exactly the fields in the schema, so copying it in one go and removing
+            # the privacy setting fields is much quicker than building it field by field.
+            projected = dict(record)
+            for key in self.dropped_fields:
+                del projected[key]
+        else:
+            projected = {key: record.get(key) for key in self.plain_fields}
+            for key, privacy_key in self.controlled_fields:
+                projected[key] = record.get(key)
+
+        access_level = self.access_level
+        for key, privacy_key in self.controlled_fields:
+            if privacy_key in record and record[privacy_key] > access_level:
+                projected[key] = None
+        return projected
+
+    def many(self, records):
+        """
+        Returns a list of projected records.
+        """
+        return [self(record) for record in records]
+
+
+class PrivacyProjection(object):
+    """
+    Builds a CompiledProjection for each access level from a contact fields schema.
+
+    The work of deciding which fields have privacy settings is done once, when a projection is
+    first needed for an access level, and the compiled projection is kept for reuse. A single
+    PrivacyProjection can be shared across requests and threads.
+
+        >>> projection = PrivacyProjection.from_api(cofe)
+        >>> public = projection.for_access_level(cofecms.PRIVACY_SETTING_PUBLIC)
+        >>> contacts = public.many(cofe.get_contacts())
+
+    Args:
+        field_names: The names of the fields in the schema, see schema_field_names().
+        include_privacy_settings: Whether to keep the '_privacy_setting' fields in the projected
+            records. Defaults to False.
+    """
+
+    def __init__(self, field_names, include_privacy_settings=False):
+        self.field_names = tuple(field_names)
+        self.include_privacy_settings = include_privacy_settings
+        self.key_map = privacy_key_map(self.field_names)
+        self._compiled = {}
+
+    @classmethod
+    def from_schema(cls, schema, **kwargs):
+        return cls(schema_field_names(schema), **kwargs)
+
+    @classmethod
+    def from_api(cls, api, diocese_id=None, **kwargs):
+        """
+        Create a projection from the output of get_contact_fields().
+        """
+        return cls.from_schema(api.get_contact_fields(diocese_id=diocese_id), **kwargs)
+
+    def for_access_level(self, max_access_level=PRIVACY_SETTING_PUBLIC):
+        """
+        Returns the CompiledProjection for an access level, compiling it on first use.
+        """
+        try:
+            return self._compiled[max_access_level]
+        except KeyError:
+            compiled = self._compiled[max_access_level] = self._compile(max_access_level)
+            return compiled
+
+    def _compile(self, max_access_level):
+        privacy_keys = set(privacy_key for key, privacy_key in self.key_map)
+        if self.include_privacy_settings:
+            output_fields = self.field_names
+        else:
+            output_fields = [key for key in self.field_names if key not in privacy_keys]
+
+        if max_access_level >= PRIVACY_SETTING_PRIVATE:
+            # Nothing can be hidden at the highest access level
+            controlled = {}
+        else:
+            controlled = dict(self.key_map)
+
+        return CompiledProjection(
+            access_level=max_access_level,
+            plain_fields=tuple(key for key in output_fields if key not in controlled),
+            controlled_fields=tuple(
+                (key, controlled[key]) for key in output_fields if key in controlled
+            ),
+            schema_fields=frozenset(self.field_names),
+            dropped_fields=tuple(key for key in self.field_names if key not in output_fields),
+        )
+
+
+class PrivacyFilter(object):
+    """
+    Applies contact privacy settings to many records at once.
+
+    This gives the same results as wrapping each record in ContactData and reading every field,
+    but works out which fields have privacy settings once for each set of fields (rather than on
+    every field access), and only checks those fields for each record.
+
+    Args:
+        max_access_level: The highest privacy setting which can be seen. Defaults to
+            PRIVACY_SETTING_PUBLIC.
+    """
+
+    def __init__(self, max_access_level=PRIVACY_SETTING_PUBLIC):
+        self.max_access_level = max_access_level
+        self._key_maps = {}
+
+    def redact(self, record):
+        """
+        Returns a copy of the record, with any values the privacy settings don't allow set to None.
+        """
+        redacted = dict(record)
+        for key, privacy_key in self._get_key_map(record):
+            if record[privacy_key] > self.max_access_level:
+                redacted[key] = None
+        return redacted
+
+    def records(self, records):
+        """
+        A generator of redacted copies of each record.
+
+        Args:
+            records: Any iterable of records, such as a CofeCMSResult or the records from each page
+                of 'pages_generator'.
+        """
+        max_access_level = self.max_access_level
+        get_key_map = self._get_key_map
+        for record in records:
+            redacted = dict(record)
+            for key, privacy_key in get_key_map(record):
+                if record[privacy_key] > max_access_level:
+                    redacted[key] = None
+            yield redacted
+
+    def columns(self, records):
+        """
+        Redact records into columns.
+
+        Args:
+            records: Any iterable of records.
+
+        Returns:
+            An OrderedDict of field name to a list of values, one for each record. The fields are
+            taken from the first record, and missing values are None.
+        """
+        columns = None
+        max_access_level = self.max_access_level
+        for record in records:
+            if columns is None:
+                columns = OrderedDict((key, []) for key in record)
+            hidden = set(
+                key for key, privacy_key in self._get_key_map(record)
+                if record[privacy_key] > max_access_level
+            )
+            for key, values in columns.items():
+                values.append(None if key in hidden else record.get(key))
+        return columns if columns is not None else OrderedDict()
+
+    def _get_key_map(self, record):
+        # Records from the same query share the same fields, so this is usually a cache hit
+        keys = tuple(record)
+        try:
+            return self._key_maps[keys]
+        except KeyError:
+            key_map = self._key_maps[keys] = privacy_key_map(keys)
+            return key_map
+
+
+def redact(records, max_access_level=PRIVACY_SETTING_PUBLIC):
+    """
+    Redact a whole set of records, such as a CofeCMSResult, in one pass.
+
+    Args:
+        records: Any iterable of records.
+        max_access_level: The highest privacy setting which can be seen.
+
+    Returns:
+        A list of redacted copies of the records.
+    """
+    return list(PrivacyFilter(max_access_level).records(records))
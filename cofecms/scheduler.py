@@ -0,0 +1,250 @@
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BULK = 'bulk'
+# Ties between priority classes are broken in this order
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+# The priority classes set with RequestScheduler.priority() in each thread, as a dict of scheduler
+# to priority class
+_local = threading.local()
+
+# How many requests of each priority class are sent for every one of weight 1, when both classes
+# have requests waiting
+DEFAULT_WEIGHTS = {
+    PRIORITY_INTERACTIVE: 10,
+    PRIORITY_BULK: 1,
+}
+
+
+def classify_request(endpoint_url, request_params):
+    """
+    The default way of choosing a request's priority class. Requests for the second or later page
+    of a paged query, such as those made by all() and pages_generator(), are bulk requests, and
+    everything else is interactive.
+    """
+    try:
+        offset = int(request_params.get('offset') or 0)
+    except (TypeError, ValueError):
+        offset = 0
+    return PRIORITY_BULK if offset > 0 else PRIORITY_INTERACTIVE
+
+
+def _overrides():
+    overrides = getattr(_local, 'overrides', None)
+    if overrides is None:
+        overrides = _local.overrides = {}
+    return overrides
+
+
+def with_current_priority(function):
+    """
+    Wrap a function so that when it's called, in any thread, its requests use the priority classes
+    set with RequestScheduler.priority() in the current thread. Used for work handed to a thread
+    pool, such as by pages_generator().
+    """
+    overrides = dict(_overrides())
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'overrides', None)
+        _local.overrides = dict(overrides)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.overrides = previous
+
+    return wrapper
+
+
+class RequestScheduler(object):
+    """
+    Limits how many requests a client makes at once, and decides which waiting request goes next,
+    so interactive requests aren't stuck behind the page fetches of a bulk export.
+
+    Each request is put in a priority class. Waiting requests are sent using weighted fair
+    queuing, so with the default weights ten interactive requests are sent for each bulk request
+    while both are waiting, but bulk requests never starve. Within a class, requests are sent in
+    the order they were made:
+
+        >>> scheduler = RequestScheduler(max_concurrent=4)
+        >>> cofe = CofeCMS(API_ID, API_KEY, diocese_id, scheduler=scheduler)
+        >>> with scheduler.priority(PRIORITY_BULK):
+        ...     contacts = cofe.get_contacts(limit=1000).all(workers=4)
+
+    The 'X-RateLimit-Remaining' header of each response is tracked, and once it falls to 'reserve'
+    of the rate limit, the rest is kept for interactive requests. Bulk requests are then slowed to
+    one every 'backoff' seconds, until a response shows the rate limit has been reset.
+
+    Args:
+        max_concurrent: The most requests in flight at once.
+        weights: Optionally a dict of priority class to weight, to update DEFAULT_WEIGHTS with.
+        reserve: The fraction of the rate limit to keep for interactive requests.
+        backoff: How long to wait between bulk requests while the rate limit is low, in seconds.
+        classify: Optionally a callable taking the endpoint URL and request params, which returns
+            the priority class of a request. Defaults to classify_request.
+
+    Attributes:
+        rate_limit: The last rate limit reported by the API, or None.
+        rate_limit_remaining: The last number of remaining requests reported by the API, or None.
+        stats: A Counter of the number of requests sent for each priority class, and 'waited' for
+            the number which had to wait.
+    """
+
+    def __init__(
+            self,
+            max_concurrent=4,
+            weights=None,
+            reserve=0.1,
+            backoff=1.0,
+            classify=classify_request,
+    ):
+        self.max_concurrent = max_concurrent
+        self.weights = dict(DEFAULT_WEIGHTS)
+        if weights:
+            self.weights.update(weights)
+        self.reserve = reserve
+        self.backoff = backoff
+        self.classify = classify
+
+        self.rate_limit = None
+        self.rate_limit_remaining = None
+        self.stats = Counter()
+
+        self._condition = threading.Condition()
+        self._queues = {}
+        # The virtual finish time of each class's last request, for weighted fair queuing
+        self._finish_times = {}
+        self._virtual_time = 0.0
+        self._in_flight = 0
+        self._throttled = False
+        self._throttled_until = 0.0
+
+    @contextmanager
+    def priority(self, priority):
+        """
+        A context manager which makes every request from the current thread use a priority class,
+        rather than the one chosen by 'classify'.
+
+        This includes requests made by the client's own worker threads on behalf of the current
+        thread, such as by pages_generator(workers=...), Pipeline stages and RequestHedger. Code
+        which starts threads of its own can use with_current_priority() to do the same.
+        """
+        overrides = _overrides()
+        previous = overrides.get(self)
+        overrides[self] = priority
+        try:
+            yield
+        finally:
+            if previous is None:
+                overrides.pop(self, None)
+            else:
+                overrides[self] = previous
+
+    def acquire(self, endpoint_url, request_params, timeout=None):
+        """
+        Wait until a request can be sent.
+
+        Every call must be followed by a call to 'release' once the request has finished.
+
+        Args:
+            endpoint_url: The absolute URL for the endpoint.
+            request_params: The request params.
+            timeout: Optionally the most seconds to wait.
+
+        Returns:
+            The request's priority class.
+
+        Raises:
+            TimeoutError: If the request couldn't be sent within 'timeout' seconds.
+        """
+        priority = _overrides().get(self)
+        if priority is None:
+            priority = self.classify(endpoint_url, request_params)
+        waiter = object()
+
+        with self._condition:
+            queue = self._queues.setdefault(priority, deque())
+            if not queue:
+                # A class which has been idle doesn't get to make up for lost time
+                self._finish_times[priority] = max(
+                    self._finish_times.get(priority, 0.0), self._virtual_time
+                )
+            queue.append(waiter)
+
+            waited = False
+            expires_at = None if timeout is None else time.monotonic() + timeout
+            try:
+                while self._next_waiter() is not waiter:
+                    waited = True
+                    wait = None
+                    if self._throttled:
+                        wait = max(self._throttled_until - time.monotonic(), 0.001)
+                    if expires_at is not None:
+                        remaining = expires_at - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError('Timed out waiting for the request to be sent')
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._condition.wait(wait)
+            except BaseException:
+                # Such as a timeout or KeyboardInterrupt, so don't leave the waiter blocking the
+                # queue
+                queue.remove(waiter)
+                self._condition.notify_all()
+                raise
+
+            queue.popleft()
+            self._in_flight += 1
+            self._virtual_time = self._finish_times[priority]
+            self._finish_times[priority] += 1.0 / self.weights.get(priority, 1)
+            if self._throttled and priority != PRIORITY_INTERACTIVE:
+                self._throttled_until = time.monotonic() + self.backoff
+
+            self.stats[priority] += 1
+            if waited:
+                self.stats['waited'] += 1
+            # Another waiter may be able to go too
+            self._condition.notify_all()
+        return priority
+
+    def release(self, headers=None):
+        """
+        Mark a request as finished, and update the rate limit from its response headers.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if headers is not None:
+                self._update_rate_limit(headers)
+            self._condition.notify_all()
+
+    def _update_rate_limit(self, headers):
+        try:
+            self.rate_limit = int(headers.get('X-RateLimit-Limit'))
+            self.rate_limit_remaining = int(headers.get('X-RateLimit-Remaining'))
+        except (TypeError, ValueError):
+            return
+        throttled = self.rate_limit_remaining <= self.reserve * self.rate_limit
+        if throttled and not self._throttled:
+            self._throttled_until = time.monotonic() + self.backoff
+        self._throttled = throttled
+
+    def _next_waiter(self):
+        if self._in_flight >= self.max_concurrent:
+            return None
+        throttled = self._throttled and time.monotonic() < self._throttled_until
+
+        best = None
+        for priority, queue in self._queues.items():
+            if not queue or (throttled and priority != PRIORITY_INTERACTIVE):
+                continue
+            key = (
+                self._finish_times[priority],
+                PRIORITIES.index(priority) if priority in PRIORITIES else len(PRIORITIES),
+            )
+            if best is None or key < best[0]:
+                best = (key, queue[0])
+        return best[1] if best is not None else None
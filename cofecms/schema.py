@@ -0,0 +1,297 @@
+import difflib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from cofecms.privacy import PrivacyProjection, schema_field_names, schema_sections
+
+SCHEMA_CONTACT = 'contact'
+SCHEMA_POST = 'post'
+SCHEMA_PLACE = 'place'
+
+# Maps each schema to the CofeCMS method which retrieves it
+SCHEMA_METHODS = OrderedDict([
+    (SCHEMA_CONTACT, 'get_contact_fields'),
+    (SCHEMA_POST, 'get_post_fields'),
+    (SCHEMA_PLACE, 'get_place_fields'),
+])
+
+# Maps endpoint paths which accept 'fields' to the schema the fields come from
+ENDPOINT_SCHEMAS = {
+    '/v2/contacts': SCHEMA_CONTACT,
+    '/v2/contacts/deleted': SCHEMA_CONTACT,
+    '/v2/posts': SCHEMA_POST,
+    '/v2/posts/deleted': SCHEMA_POST,
+    '/v2/places': SCHEMA_PLACE,
+    '/v2/places/deleted': SCHEMA_PLACE,
+}
+
+CACHE_FORMAT_VERSION = 1
+
+
+class InvalidFieldsError(ValueError):
+    """
+    Raised when a 'fields' selection contains sections or fields which aren't in the schema.
+    """
+
+    def __init__(self, message, invalid_fields):
+        super().__init__(message)
+        self.invalid_fields = invalid_fields
+
+
+def fingerprint(schemas):
+    """
+    Generate a fingerprint for a dict of schemas, which changes whenever any schema changes.
+    """
+    canonical = json.dumps(schemas, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class SchemaRegistry(object):
+    """
+    Fetches the contact, post and place field schemas once, and caches them on disk.
+
+    Once attached to a client, any 'fields' selection is checked against the schema before the
+    request is sent, so misspelt fields fail straight away with an InvalidFieldsError:
+
+        >>> registry = SchemaRegistry(cache_dir='/var/cache/cofecms')
+        >>> cofe = CofeCMS(API_ID, API_KEY, diocese_id, schema_registry=registry)
+        >>> cofe.get_contacts(fields={'contact': ['surnmae']})
+        InvalidFieldsError: Unknown field "contact.surnmae" (did you mean "surname"?)
+
+    The schemas also drive PrivacyProjection and columnar decoding of records.
+
+    Args:
+        api: The CofeCMS instance to fetch schemas with. If not given, it's set to the client the
+            registry is passed to as 'schema_registry'.
+        cache_dir: Optionally the directory to cache schemas in. If not given, schemas are only
+            cached in memory.
+        max_age: The number of seconds before cached schemas are fetched again. Defaults to a day.
+        diocese_id: Optionally supply the diocese_id.
+    """
+
+    def __init__(self, api=None, cache_dir=None, max_age=86400, diocese_id=None):
+        self.api = api
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.diocese_id = diocese_id
+
+        self.schemas = None
+        self.fingerprint = None
+        self.fetched_at = None
+
+        self._lock = threading.RLock()
+        self._projections = {}
+
+    @property
+    def cache_path(self):
+        if self.cache_dir is None:
+            return None
+        diocese_id = self.diocese_id or self.api.diocese_id
+        return os.path.join(self.cache_dir, 'cofecms-schema-{}.json'.format(diocese_id))
+
+    def load(self):
+        """
+        Ensure the schemas are loaded, from the disk cache if it's fresh, or from the API.
+        """
+        with self._lock:
+            if self.schemas is not None and not self._is_stale(self.fetched_at):
+                return
+            if self._load_cache():
+                return
+            self.refresh()
+
+    def refresh(self):
+        """
+        Fetch the schemas from the API, and update the disk cache.
+
+        Returns:
+            True if the schemas changed since they were last loaded.
+        """
+        with self._lock:
+            schemas = OrderedDict()
+            for name, method_name in SCHEMA_METHODS.items():
+                schema = getattr(self.api, method_name)(diocese_id=self.diocese_id)
+                # Store as plain lists and dicts, so they can be saved as JSON
+                schemas[name] = json.loads(json.dumps(list(schema)))
+
+            changed = self._set_schemas(schemas, time.time())
+            self._save_cache()
+            return changed
+
+    def get_schema(self, name):
+        """
+        Returns the schema for 'contact', 'post' or 'place', as returned by the API.
+        """
+        self.load()
+        return self.schemas[name]
+
+    def field_names(self, name):
+        """
+        Returns a list of every field name in a schema.
+        """
+        return schema_field_names(self.get_schema(name))
+
+    def sections(self, name):
+        """
+        Returns an OrderedDict of section to the list of field names in that section.
+        """
+        return OrderedDict(schema_sections(self.get_schema(name)))
+
+    def validate(self, name, fields):
+        """
+        Check a 'fields' selection against a schema.
+
+        Args:
+            name: The schema name, 'contact', 'post' or 'place'.
+            fields: A dict of section to a list of field names, or a list of field names.
+
+        Raises:
+            InvalidFieldsError: If any sections or fields aren't in the schema.
+        """
+        invalid_fields = []
+        messages = []
+
+        if not isinstance(fields, dict):
+            field_names = self.field_names(name)
+            for field_name in fields:
+                if field_name not in field_names:
+                    invalid_fields.append(field_name)
+                    messages.append('Unknown field "{}"{}'.format(
+                        field_name, _suggest(field_name, field_names)
+                    ))
+            if invalid_fields:
+                raise InvalidFieldsError('; '.join(messages), invalid_fields)
+            return
+
+        sections = self.sections(name)
+        for section, field_names in fields.items():
+            if section not in sections:
+                invalid_fields.append(section)
+                messages.append(
+                    'Unknown section "{}"{}'.format(section, _suggest(section, sections))
+                )
+                continue
+
+            for field_name in field_names:
+                if field_name not in sections[section]:
+                    invalid_fields.append('{}.{}'.format(section, field_name))
+                    messages.append(
+                        'Unknown field "{}.{}"{}'.format(
+                            section, field_name, _suggest(field_name, sections[section])
+                        )
+                    )
+
+        if invalid_fields:
+            raise InvalidFieldsError('; '.join(messages), invalid_fields)
+
+    def validate_request(self, endpoint_url, fields):
+        """
+        Check the 'fields' for a request to an endpoint, if the endpoint has a known schema.
+        """
+        name = ENDPOINT_SCHEMAS.get(urlsplit(endpoint_url).path.rstrip('/'))
+        if name is not None:
+            self.validate(name, fields)
+
+    def projection(self, name=SCHEMA_CONTACT):
+        """
+        Returns a PrivacyProjection for a schema, which is kept until the schema changes.
+        """
+        self.load()
+        with self._lock:
+            key = (name, self.fingerprint)
+            if key not in self._projections:
+                self._projections[key] = PrivacyProjection.from_schema(self.schemas[name])
+            return self._projections[key]
+
+    def columns(self, name, records):
+        """
+        Decode records into columns, with one column for every field in the schema.
+
+        Args:
+            name: The schema name, 'contact', 'post' or 'place'.
+            records: Any iterable of records.
+
+        Returns:
+            An OrderedDict of field name to a list of values, with None for missing values.
+        """
+        field_names = self.field_names(name)
+        columns = OrderedDict((field_name, []) for field_name in field_names)
+        appends = [(field_name, columns[field_name].append) for field_name in field_names]
+        for record in records:
+            get = record.get
+            for field_name, append in appends:
+                append(get(field_name))
+        return columns
+
+    def _is_stale(self, fetched_at):
+        return fetched_at is None or time.time() - fetched_at > self.max_age
+
+    def _set_schemas(self, schemas, fetched_at):
+        new_fingerprint = fingerprint(schemas)
+        changed = new_fingerprint != self.fingerprint
+        self.schemas = schemas
+        self.fingerprint = new_fingerprint
+        self.fetched_at = fetched_at
+        if changed:
+            self._projections.clear()
+        return changed
+
+    def _load_cache(self):
+        path = self.cache_path
+        if path is None or not os.path.exists(path):
+            return False
+
+        try:
+            with open(path) as f:
+                cached = json.load(f, object_pairs_hook=OrderedDict)
+        except (OSError, ValueError):
+            return False
+
+        if cached.get('format_version') != CACHE_FORMAT_VERSION:
+            return False
+        if self._is_stale(cached.get('fetched_at')):
+            return False
+        if fingerprint(cached['schemas']) != cached.get('fingerprint'):
+            # The file has been changed or corrupted
+            return False
+
+        self._set_schemas(cached['schemas'], cached['fetched_at'])
+        return True
+
+    def _save_cache(self):
+        path = self.cache_path
+        if path is None:
+            return
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        cached = OrderedDict([
+            ('format_version', CACHE_FORMAT_VERSION),
+            ('fingerprint', self.fingerprint),
+            ('fetched_at', self.fetched_at),
+            ('schemas', self.schemas),
+        ])
+
+        # Write to a temporary file first, so other processes never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cached, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def _suggest(name, choices):
+    matches = difflib.get_close_matches(name, list(choices), n=1)
+    if matches:
+        return ' (did you mean "{}"?)'.format(matches[0])
+    return ''
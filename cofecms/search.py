@@ -0,0 +1,267 @@
+import bisect
+import datetime
+import heapq
+import re
+import unicodedata
+
+from cofecms.api import PRIVACY_SETTING_PUBLIC
+from cofecms.privacy import PrivacyFilter
+from cofecms.sync import fetch_changes
+
+# The contact fields which are searched by default
+DEFAULT_SEARCH_FIELDS = ('title', 'forenames', 'known_as', 'surname', 'email', 'town', 'postcode')
+
+WORD_RE = re.compile(r'\w+')
+
+# Relative scores for each kind of match, so exact matches rank above prefix matches, which rank
+# above fuzzy ones
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.75
+FUZZY_SCORE = 0.5
+
+
+def tokenize(text):
+    """
+    Split text into lower case words, with any accents removed.
+    """
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return WORD_RE.findall(text.lower())
+
+
+def trigrams(token):
+    """
+    Returns the set of trigrams in a token, padded so short tokens still have some.
+    """
+    padded = '^{}$'.format(token)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class ContactSearchIndex(object):
+    """
+    A local inverted index over contacts, for search as you type without any API calls.
+
+    Each word of a query matches words in a contact which it is a prefix of, so 'smi' finds
+    'Smith'. Words with no prefix matches fall back to fuzzy trigram matching, so misspellings like
+    'wilsn' still find something. Contacts must match every word in the query.
+
+    Privacy settings are applied before contacts are indexed, so values which can't be seen at
+    'max_access_level' are never searchable or returned. Use a separate index for each access
+    level which is needed.
+
+        >>> index = ContactSearchIndex.from_api(cofe)
+        >>> index.search('jo smi')
+        [{'id': 123, 'forenames': 'John', 'surname': 'Smith', ...}]
+        >>> index.refresh(cofe)
+
+    Args:
+        fields: The contact fields to index. Defaults to DEFAULT_SEARCH_FIELDS.
+        max_access_level: The highest privacy setting which can be seen. Defaults to
+            PRIVACY_SETTING_PUBLIC.
+        id_field: The field holding each contact's ID. Defaults to 'id'.
+        min_similarity: The lowest trigram similarity, between 0 and 1, for a fuzzy match.
+        join_index: Optionally a JoinIndex, so contacts can also be found by the names of the
+            places and roles of their posts.
+        name_field: The field holding the name of each place and role. Defaults to 'name'.
+    """
+
+    def __init__(
+            self,
+            fields=DEFAULT_SEARCH_FIELDS,
+            max_access_level=PRIVACY_SETTING_PUBLIC,
+            id_field='id',
+            min_similarity=0.3,
+            join_index=None,
+            name_field='name',
+    ):
+        self.fields = tuple(fields)
+        self.privacy_filter = PrivacyFilter(max_access_level)
+        self.id_field = id_field
+        self.min_similarity = min_similarity
+        self.join_index = join_index
+        self.name_field = name_field
+        self.updated_at = None
+
+        self.contacts = {}
+        self._contact_tokens = {}
+        self._postings = {}
+        self._trigrams = {}
+        self._sorted_tokens = None
+
+    @classmethod
+    def from_api(cls, api, diocese_id=None, limit=1000, workers=None, **kwargs):
+        """
+        Build an index from every contact returned by get_contacts().
+
+        Args:
+            api: The CofeCMS instance to use.
+            diocese_id: Optionally supply the diocese_id.
+            limit: The number of contacts to request per page.
+            workers: Optional number of pages to fetch concurrently.
+            **kwargs: Passed on to ContactSearchIndex.
+        """
+        index = cls(**kwargs)
+        index.refresh(api, diocese_id=diocese_id, limit=limit, workers=workers)
+        return index
+
+    @property
+    def max_access_level(self):
+        return self.privacy_filter.max_access_level
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def add(self, contact, extra_text=()):
+        """
+        Add or update a contact.
+
+        Args:
+            contact: The contact record.
+            extra_text: Optionally other text to find the contact by.
+        """
+        contact_id = contact[self.id_field]
+        self.remove(contact_id)
+
+        redacted = self.privacy_filter.redact(contact)
+        tokens = set()
+        for field in self.fields:
+            value = redacted.get(field)
+            if value is not None:
+                tokens.update(tokenize(value))
+        for text in extra_text:
+            tokens.update(tokenize(text))
+        if self.join_index is not None:
+            for assignment in self.join_index.assignments(contact_id=contact_id):
+                for linked in (assignment.place, assignment.role):
+                    if linked is not None and linked.get(self.name_field) is not None:
+                        tokens.update(tokenize(linked[self.name_field]))
+
+        self.contacts[contact_id] = redacted
+        self._contact_tokens[contact_id] = tokens
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                for trigram in trigrams(token):
+                    self._trigrams.setdefault(trigram, set()).add(token)
+                self._sorted_tokens = None
+            postings.add(contact_id)
+
+    def remove(self, contact_id):
+        """
+        Remove a contact, if it's in the index.
+        """
+        tokens = self._contact_tokens.pop(contact_id, None)
+        if tokens is None:
+            return
+        del self.contacts[contact_id]
+
+        for token in tokens:
+            postings = self._postings[token]
+            postings.discard(contact_id)
+            if not postings:
+                del self._postings[token]
+                for trigram in trigrams(token):
+                    trigram_tokens = self._trigrams[trigram]
+                    trigram_tokens.discard(token)
+                    if not trigram_tokens:
+                        del self._trigrams[trigram]
+                self._sorted_tokens = None
+
+    def refresh(self, api, since=None, diocese_id=None, limit=1000, workers=None):
+        """
+        Update the index with contacts which have been updated or deleted.
+
+        Args:
+            api: The CofeCMS instance to use.
+            since: Only fetch contacts updated on or after this datetime. Defaults to when the
+                index was last refreshed, or every contact if it never has been.
+            diocese_id: Optionally supply the diocese_id.
+            limit: The number of contacts to request per page.
+            workers: Optional number of pages to fetch concurrently.
+        """
+        if since is None:
+            since = self.updated_at
+        started_at = datetime.datetime.now()
+
+        fetch_changes(
+            api,
+            'contacts',
+            since,
+            self.add,
+            lambda contact: self.remove(contact[self.id_field]),
+            diocese_id=diocese_id,
+            limit=limit,
+            workers=workers,
+        )
+
+        self.updated_at = started_at
+
+    def search(self, query, limit=20, fuzzy=True):
+        """
+        Find contacts matching every word in a query.
+
+        Args:
+            query: The text to search for.
+            limit: The maximum number of contacts to return.
+            fuzzy: Whether to fall back to fuzzy matching for words with no prefix matches.
+
+        Returns:
+            A list of redacted contact records, best matches first.
+        """
+        scores = None
+        for term in set(tokenize(query)):
+            term_scores = self._match(term, fuzzy)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = dict(
+                    (contact_id, score + term_scores[contact_id])
+                    for contact_id, score in scores.items() if contact_id in term_scores
+                )
+            if not scores:
+                return []
+
+        if scores is None:
+            return []
+        ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [self.contacts[contact_id] for contact_id, score in ranked]
+
+    def _match(self, term, fuzzy):
+        # Returns a dict of contact ID to the best score for any token matching the term
+        scores = {}
+        for token in self._prefixed(term):
+            score = EXACT_SCORE if token == term else PREFIX_SCORE
+            self._score(scores, token, score)
+
+        if not scores and fuzzy:
+            for token, similarity in self._similar(term):
+                self._score(scores, token, FUZZY_SCORE * similarity)
+        return scores
+
+    def _score(self, scores, token, score):
+        for contact_id in self._postings[token]:
+            if scores.get(contact_id, 0) < score:
+                scores[contact_id] = score
+
+    def _prefixed(self, term):
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._postings)
+        sorted_tokens = self._sorted_tokens
+        position = bisect.bisect_left(sorted_tokens, term)
+        while position < len(sorted_tokens) and sorted_tokens[position].startswith(term):
+            yield sorted_tokens[position]
+            position += 1
+
+    def _similar(self, term):
+        term_trigrams = trigrams(term)
+        shared = {}
+        for trigram in term_trigrams:
+            for token in self._trigrams.get(trigram, ()):
+                shared[token] = shared.get(token, 0) + 1
+
+        for token, count in shared.items():
+            # Jaccard similarity of the two sets of trigrams
+            similarity = count / (len(term_trigrams) + len(trigrams(token)) - count)
+            if similarity >= self.min_similarity:
+                yield token, similarity
@@ -0,0 +1,59 @@
+from cofecms.api import RESOURCES
+
+
+def fetch_changes(
+        api,
+        resource,
+        since,
+        on_updated,
+        on_deleted=None,
+        diocese_id=None,
+        search_params=None,
+        limit=1000,
+        workers=None,
+):
+    """
+    Fetch the records for a resource which have been updated since a datetime, and then those
+    which have been deleted since it, a page at a time. Used to keep local copies of records up to
+    date.
+
+    If 'since' is None every record is fetched, and deletions aren't, as the deleted endpoints
+    only return recently deleted records.
+
+    Args:
+        api: The CofeCMS instance to use.
+        resource: One of 'contacts', 'posts' or 'places'.
+        since: Only fetch records updated or deleted on or after this datetime, or None.
+        on_updated: A callable taking each updated record.
+        on_deleted: Optionally a callable taking each deleted record.
+        diocese_id: Optionally supply the diocese_id.
+        search_params: Optionally provide a dict of search params.
+        limit: The number of records to request per page.
+        workers: Optional number of pages to fetch concurrently.
+
+    Returns:
+        A tuple of the number of records (updated, deleted).
+    """
+    kwargs = {
+        'diocese_id': diocese_id,
+        'search_params': search_params,
+        'start_date': since,
+        'limit': limit,
+    }
+
+    updated = 0
+    result = getattr(api, RESOURCES[resource])(**kwargs)
+    for page in result.pages_generator(workers=workers):
+        for record in page:
+            on_updated(record)
+            updated += 1
+
+    deleted = 0
+    if since is not None and on_deleted is not None:
+        result = getattr(api, RESOURCES['deleted-' + resource])(**kwargs)
+        for page in result.pages_generator(workers=workers):
+            for record in page:
+                on_deleted(record)
+                deleted += 1
+
+    return updated, deleted
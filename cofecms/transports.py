@@ -0,0 +1,396 @@
+import datetime
+import gzip
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from cofecms.compression import accept_encoding
+
+# Params which change with the credentials used, rather than the query being made
+UNMATCHED_PARAMS = ('api_id', 'sig')
+
+# Headers describing the encoding on the wire, which no longer apply to the decoded body we record
+UNRECORDED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+
+class CassetteMissError(LookupError):
+    """
+    Raised when replaying a request which isn't in the cassette.
+    """
+
+
+class BaseTransport(object):
+    """
+    A transport performs the HTTP requests for a CofeCMS client.
+
+    Subclasses need to implement 'get', which should return a response object with 'status_code',
+    'headers', 'content', 'json()' and 'raise_for_status()', like a requests.Response. The optional
+    'headers' argument is a dict of extra request headers, and 'timeout' is a timeout in seconds or
+    a tuple of (connect timeout, read timeout).
+
+    Requests which fail without a response should raise the matching requests exception, such as
+    requests.exceptions.ConnectionError or requests.exceptions.ReadTimeout, so callers can handle
+    failures the same way whichever transport is used.
+    """
+
+    def get(self, url, params, headers=None, timeout=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RequestsTransport(BaseTransport):
+    """
+    Performs requests using a requests Session. This is the default transport.
+
+    Args:
+        session: Optionally supply the requests Session to use.
+        pool_maxsize: Optionally set the number of connections kept open to the API, which should
+            be at least the number of pages fetched concurrently.
+    """
+
+    def __init__(self, session=None, pool_maxsize=None):
+        import requests
+        self.session = session or requests.Session()
+
+        if pool_maxsize is not None:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
+    def get(self, url, params, headers=None, timeout=None):
+        kwargs = {}
+        if headers:
+            kwargs['headers'] = headers
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        return self.session.get(url, params=params, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class HttpxTransport(BaseTransport):
+    """
+    Performs requests using httpx, which can multiplex concurrent requests over a single HTTP/2
+    connection.
+
+    Requires httpx to be installed, and the h2 package for HTTP/2 (pip install httpx[http2]).
+
+    Args:
+        client: Optionally supply the httpx Client to use.
+        http2: Whether to use HTTP/2 when the server supports it. Defaults to True.
+        max_connections: Optionally limit the number of connections to the API.
+    """
+
+    def __init__(self, client=None, http2=True, max_connections=None):
+        if client is None:
+            try:
+                import httpx
+            except ImportError:
+                raise ImportError('httpx must be installed to use HttpxTransport')
+
+            # Without a timeout, so the client's timeout is the only limit, as with the other
+            # transports, rather than httpx's default of 5 seconds
+            client = httpx.Client(
+                http2=http2, limits=httpx.Limits(max_connections=max_connections), timeout=None
+            )
+        self.client = client
+
+    def get(self, url, params, headers=None, timeout=None):
+        kwargs = {}
+        if timeout is not None:
+            import httpx
+            if isinstance(timeout, tuple):
+                connect, read = timeout
+                timeout = httpx.Timeout(read, connect=connect)
+            kwargs['timeout'] = timeout
+        try:
+            response = self.client.get(url, params=params, headers=headers, **kwargs)
+        except Exception as e:
+            error = _httpx_error(e)
+            if error is None:
+                raise
+            raise error from e
+        return Response(
+            url=str(response.url),
+            status_code=response.status_code,
+            headers=response.headers,
+            content=response.content,
+            elapsed=response.elapsed.total_seconds(),
+            wire_bytes=response.num_bytes_downloaded,
+        )
+
+    def close(self):
+        self.client.close()
+
+
+class Urllib3Transport(BaseTransport):
+    """
+    Performs requests using urllib3 directly, avoiding the overhead of a requests Session.
+
+    Like the requests transport, failed requests aren't retried, so the client's timeout and
+    circuit breaker see every failure.
+
+    Args:
+        pool_manager: Optionally supply the urllib3 PoolManager to use.
+        maxsize: Optionally set the number of connections kept open to the API.
+    """
+
+    def __init__(self, pool_manager=None, maxsize=10):
+        if pool_manager is None:
+            import urllib3
+            pool_manager = urllib3.PoolManager(
+                maxsize=maxsize, headers={'Accept-Encoding': accept_encoding()}, retries=False
+            )
+        self.pool_manager = pool_manager
+
+    def get(self, url, params, headers=None, timeout=None):
+        if headers:
+            # Headers passed to request() replace the pool manager's, rather than adding to them
+            headers = dict(self.pool_manager.headers, **headers)
+        kwargs = {}
+        if timeout is not None:
+            import urllib3
+            if isinstance(timeout, tuple):
+                connect, read = timeout
+            else:
+                connect = read = timeout
+            kwargs['timeout'] = urllib3.Timeout(connect=connect, read=read)
+        start = time.perf_counter()
+        try:
+            response = self.pool_manager.request(
+                'GET', url, fields=params, headers=headers, **kwargs
+            )
+        except Exception as e:
+            error = _urllib3_error(e)
+            if error is None:
+                raise
+            raise error from e
+        return Response(
+            url=url,
+            status_code=response.status,
+            headers=response.headers,
+            content=response.data,
+            elapsed=time.perf_counter() - start,
+            wire_bytes=response.tell(),
+        )
+
+    def close(self):
+        self.pool_manager.clear()
+
+
+def _httpx_error(error):
+    # Returns the requests exception matching an httpx one, or None
+    try:
+        import httpx
+    except ImportError:
+        return None
+    import requests
+
+    if isinstance(error, httpx.ConnectTimeout):
+        error_class = requests.exceptions.ConnectTimeout
+    elif isinstance(error, httpx.ReadTimeout):
+        error_class = requests.exceptions.ReadTimeout
+    elif isinstance(error, httpx.TimeoutException):
+        error_class = requests.exceptions.Timeout
+    elif isinstance(error, httpx.TransportError):
+        error_class = requests.exceptions.ConnectionError
+    else:
+        return None
+    return error_class(str(error))
+
+
+def _urllib3_error(error):
+    # Returns the requests exception matching a urllib3 one, or None
+    import requests
+    import urllib3
+
+    if isinstance(error, urllib3.exceptions.MaxRetryError) and error.reason is not None:
+        # Raised instead of the original error when a pool manager is set up to retry
+        return _urllib3_error(error.reason) or requests.exceptions.ConnectionError(str(error))
+    if isinstance(error, urllib3.exceptions.NewConnectionError):
+        # Checked first, as it's a subclass of ConnectTimeoutError
+        error_class = requests.exceptions.ConnectionError
+    elif isinstance(error, urllib3.exceptions.ConnectTimeoutError):
+        error_class = requests.exceptions.ConnectTimeout
+    elif isinstance(error, urllib3.exceptions.ReadTimeoutError):
+        error_class = requests.exceptions.ReadTimeout
+    elif isinstance(error, urllib3.exceptions.TimeoutError):
+        error_class = requests.exceptions.Timeout
+    elif isinstance(error, urllib3.exceptions.SSLError):
+        error_class = requests.exceptions.SSLError
+    elif isinstance(error, urllib3.exceptions.HTTPError):
+        error_class = requests.exceptions.ConnectionError
+    else:
+        return None
+    return error_class(str(error))
+
+
+TRANSPORTS = OrderedDict([
+    ('requests', RequestsTransport),
+    ('httpx', HttpxTransport),
+    ('urllib3', Urllib3Transport),
+])
+
+
+def get_transport(name, **kwargs):
+    """
+    Create one of the built in transports by name.
+
+    Args:
+        name: One of 'requests', 'httpx' or 'urllib3'.
+        **kwargs: Passed on to the transport class.
+
+    Returns:
+        A transport instance.
+    """
+    try:
+        transport_class = TRANSPORTS[name]
+    except KeyError:
+        raise ValueError('Unknown transport: {}'.format(name))
+    return transport_class(**kwargs)
+
+
+class Response(object):
+    """
+    A minimal stand in for requests.Response, used for responses which weren't made by requests.
+
+    The 'wire_bytes' attribute holds the size of the body before it was decompressed, if known.
+    """
+
+    def __init__(self, url, status_code, headers, content, elapsed=0, wire_bytes=None):
+        # Imported here so importing cofecms doesn't import requests
+        from requests.structures import CaseInsensitiveDict
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+        self.wire_bytes = wire_bytes
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            import requests
+            raise requests.HTTPError(
+                '{} Error for url: {}'.format(self.status_code, self.url), response=self
+            )
+
+
+def cassette_key(url, params):
+    """
+    Generate the key used to match a request against those recorded in a cassette.
+
+    Only the path of the URL is matched, and the 'api_id' and 'sig' params are ignored, so
+    cassettes can be replayed against another BASE_URL or with other credentials.
+    """
+    matched_params = sorted(
+        (key, str(value)) for key, value in params.items() if key not in UNMATCHED_PARAMS
+    )
+    return json.dumps([urlsplit(url).path, matched_params])
+
+
+class RecordingTransport(BaseTransport):
+    """
+    Records every response from another transport to a cassette file, as it's received.
+
+    Cassettes are gzipped JSON lines, with one response per line, and can be replayed with
+    ReplayTransport. Recording to an existing cassette will add to it.
+
+    Args:
+        path: The path of the cassette file.
+        transport: The transport to record responses from. Defaults to a RequestsTransport.
+    """
+
+    def __init__(self, path, transport=None):
+        self.path = path
+        self.transport = transport or RequestsTransport()
+        self._lock = threading.Lock()
+        self._fileobj = gzip.open(path, 'at', encoding='utf-8')
+
+    def get(self, url, params, headers=None, timeout=None):
+        kwargs = {}
+        if headers:
+            kwargs['headers'] = headers
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        start = time.perf_counter()
+        response = self.transport.get(url, params, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        entry = OrderedDict([
+            ('key', cassette_key(url, params)),
+            ('url', url),
+            ('status_code', response.status_code),
+            ('headers', dict(
+                (key, value) for key, value in response.headers.items()
+                if key.lower() not in UNRECORDED_HEADERS
+            )),
+            ('body', response.content.decode('utf-8')),
+            ('elapsed', round(elapsed, 6)),
+        ])
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._fileobj.write(line)
+            self._fileobj.flush()
+        return response
+
+    def close(self):
+        with self._lock:
+            self._fileobj.close()
+        self.transport.close()
+
+
+class ReplayTransport(BaseTransport):
+    """
+    Replays responses from a cassette recorded by RecordingTransport, without using the network.
+
+    If the same request was recorded more than once, the responses are replayed in the order they
+    were recorded, with the last one repeated after that. Request headers aren't matched.
+
+    Args:
+        path: The path of the cassette file.
+        realtime: If True, each response is delayed by the time it originally took. Otherwise
+            responses are returned as fast as possible.
+    """
+
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry['key'], []).append(entry)
+
+    def get(self, url, params, headers=None, timeout=None):
+        key = cassette_key(url, params)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMissError('No recorded response for {} {}'.format(url, key))
+            entry = entries.pop(0) if len(entries) > 1 else entries[0]
+
+        if self.realtime:
+            time.sleep(entry['elapsed'])
+
+        return Response(
+            url=entry['url'],
+            status_code=entry['status_code'],
+            headers=entry['headers'],
+            content=entry['body'].encode('utf-8'),
+            elapsed=entry['elapsed'],
+        )
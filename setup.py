@@ -32,6 +32,11 @@ setup(
     package_dir={'pycofecms':
                  'cofecms'},
     include_package_data=True,
+    entry_points={
+        'console_scripts': [
+            'cofecms = cofecms.cli:main',
+        ],
+    },
     install_requires=requirements,
     license='BSD license',
     zip_safe=False,
@@ -5,6 +5,7 @@ import httpretty
 import requests
 
 import cofecms
+from cofecms import transports
 from cofecms.api import CofeCMS, CofeCMSResult, ContactData
 
 
@@ -376,6 +377,7 @@ class CofeCMSTest(TestCase):
         self.cofecms.do_request.assert_called_once_with(
             endpoint_url='https://cmsapi.cofeportal.org/v2/some_end_point',
             request_params=request_params,
+            deadline=None,
         )
 
     def test_get__dict_response(self):
@@ -414,6 +416,7 @@ class CofeCMSTest(TestCase):
         self.cofecms.do_request.assert_called_once_with(
             endpoint_url='https://cmsapi.cofeportal.org/v2/some_end_point',
             request_params=request_params,
+            deadline=None,
         )
 
     def test_paged_get(self):
@@ -438,6 +441,7 @@ class CofeCMSTest(TestCase):
             endpoint_url=endpoint_url,
             diocese_id=123,
             search_params=None,
+            deadline=None,
             offset=0,
             limit=100,
         )
@@ -469,6 +473,7 @@ class CofeCMSTest(TestCase):
             endpoint_url=endpoint_url,
             diocese_id=123,
             search_params=None,
+            deadline=None,
             offset=100,
             limit=500,
         )
@@ -477,6 +482,10 @@ class CofeCMSTest(TestCase):
         result = self.cofecms.generate_endpoint_url('/v2/contacts')
         self.assertEqual(result, 'https://cmsapi.cofeportal.org/v2/contacts')
 
+        self.cofecms.BASE_URL = 'http://127.0.0.1:8000'
+        result = self.cofecms.generate_endpoint_url('/v2/contacts')
+        self.assertEqual(result, 'http://127.0.0.1:8000/v2/contacts')
+
     def test_generate_request_params(self):
         prepared_search_params = {'diocese_id': 123}
         self.cofecms._prepare_search_params = mock.Mock(
@@ -598,6 +607,58 @@ class CofeCMSTest(TestCase):
         mock_session.get.assert_called_once_with(endpoint_url, params=request_params)
         mock_response.raise_for_status.assert_called_once_with()
 
+    def test_do_request__transport(self):
+        mock_transport = mock.Mock()
+        cofecms = CofeCMS(
+            api_id='test_api_id', api_key='test_api_key', diocese_id=123, transport=mock_transport
+        )
+
+        result = cofecms.do_request('http://example.com/endpoint', {'wibble': 'wobble'})
+
+        self.assertEqual(result, mock_transport.get.return_value)
+        self.assertIsNone(cofecms.session)
+        mock_transport.get.assert_called_once_with(
+            'http://example.com/endpoint', {'wibble': 'wobble'}
+        )
+        result.raise_for_status.assert_called_once_with()
+
+    def test_do_request__headers(self):
+        mock_transport = mock.Mock()
+        cofecms = CofeCMS(
+            api_id='test_api_id', api_key='test_api_key', diocese_id=123, transport=mock_transport
+        )
+
+        cofecms.do_request('http://example.com/endpoint', {}, headers={'If-None-Match': '"abc"'})
+
+        mock_transport.get.assert_called_once_with(
+            'http://example.com/endpoint', {}, headers={'If-None-Match': '"abc"'}
+        )
+
+    def test_do_request__timeout(self):
+        mock_transport = mock.Mock()
+        cofecms = CofeCMS(
+            api_id='test_api_id',
+            api_key='test_api_key',
+            diocese_id=123,
+            transport=mock_transport,
+            timeout=(3, 30),
+        )
+
+        cofecms.do_request('http://example.com/endpoint', {})
+        cofecms.do_request('http://example.com/endpoint', {}, timeout=5)
+
+        self.assertEqual(mock_transport.get.call_args_list, [
+            mock.call('http://example.com/endpoint', {}, timeout=(3, 30)),
+            mock.call('http://example.com/endpoint', {}, timeout=5),
+        ])
+
+    def test__get_transport(self):
+        transport = self.cofecms._get_transport()
+
+        self.assertIsInstance(transport, transports.RequestsTransport)
+        self.assertEqual(transport.session, self.cofecms.session)
+        self.assertEqual(self.cofecms._get_transport(), transport)
+
     def test__get_session(self):
         self.assertIsNone(self.cofecms.session)
         session = self.cofecms._get_session()
@@ -650,6 +711,7 @@ class CofeCMSResultTest(TestCase):
         result = cofecms_result.all()
 
         self.assertEqual(result, [{'a': 'aa'}, {'b': 'bb'}])
+        cofecms_result.pages_generator.assert_called_once_with(workers=None, deadline=None)
 
     def test_pages_generator(self):
         with mock.patch(
@@ -670,7 +732,25 @@ class CofeCMSResultTest(TestCase):
                 results.append(result)
 
             self.assertEqual(results, [[{'a': 'aa'}], [{'b': 'bb'}]])
-            cofecms_result.get_data_for_page.assert_called_once_with(1)
+            cofecms_result.get_data_for_page.assert_called_once_with(1, None)
+
+    def test_pages_generator__workers(self):
+        with mock.patch(
+                'cofecms.api.CofeCMSResult.total_pages',
+                new_callable=mock.PropertyMock,
+        ) as mock_total_pages:
+            mock_total_pages.return_value = 6
+
+            cofecms_result = CofeCMSResult([0])
+            cofecms_result.get_data_for_page = mock.Mock(
+                spec=cofecms_result.get_data_for_page,
+                side_effect=lambda page_num, deadline: [page_num],
+            )
+
+            results = list(cofecms_result.pages_generator(workers=2))
+
+            self.assertEqual(results, [[0], [1], [2], [3], [4], [5]])
+            self.assertEqual(cofecms_result.get_data_for_page.call_count, 5)
 
     def test_get_data_for_page(self):
         cofecms_result = CofeCMSResult()
@@ -695,6 +775,7 @@ class CofeCMSResultTest(TestCase):
             endpoint_url='http://example.com/some_end_point',
             diocese_id=123,
             search_params={'keyword': 'smith'},
+            deadline=None,
             offset=15,
             limit=5,
             fields=['forenames', 'surname'],
@@ -0,0 +1,342 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from unittest import TestCase, mock, skipIf, skipUnless
+
+import requests
+
+from cofecms.api import CofeCMS
+from cofecms.cache import (
+    SERIALIZER_JSON, SERIALIZER_PICKLE, CacheEntry, MemoryBackend, RedisBackend, ResponseCache,
+    cache_key
+)
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+from cofecms.transports import Response
+
+ENDPOINT_URL = 'https://cmsapi.cofeportal.org/v2/roles'
+
+
+def make_response(status_code=200, body=None, headers=None):
+    content = json.dumps(body).encode('utf-8') if body is not None else b''
+    return Response(ENDPOINT_URL, status_code, headers or {}, content)
+
+
+class CacheKeyTest(TestCase):
+
+    def test_cache_key(self):
+        self.assertEqual(
+            cache_key(ENDPOINT_URL, {'api_id': 'a', 'data': '{}', 'sig': '123'}),
+            cache_key(ENDPOINT_URL, {'sig': '456', 'data': '{}', 'api_id': 'a'}),
+        )
+        self.assertNotEqual(
+            cache_key(ENDPOINT_URL, {'api_id': 'a'}), cache_key(ENDPOINT_URL, {'api_id': 'b'})
+        )
+
+
+class CacheEntryTest(TestCase):
+
+    def test_validators(self):
+        entry = CacheEntry([], {}, '"abc"', 'Mon, 20 Mar 2017 12:00:00 GMT', 'hash', 0)
+        self.assertEqual(entry.validators(), {
+            'If-None-Match': '"abc"', 'If-Modified-Since': 'Mon, 20 Mar 2017 12:00:00 GMT'
+        })
+        self.assertEqual(CacheEntry([], {}, None, None, 'hash', 0).validators(), {})
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache()
+        self.cofecms = CofeCMS(
+            api_id='test_api_id', api_key='test_api_key', diocese_id=123, cache=self.cache
+        )
+        self.cofecms.do_request = mock.Mock(spec=self.cofecms.do_request)
+
+    def test_not_modified(self):
+        self.cofecms.do_request.side_effect = [
+            make_response(body=[{'id': 1}], headers={
+                'ETag': '"abc"', 'X-Total-Count': '1', 'X-RateLimit-Remaining': '10',
+                'X-RateLimit-Limit': '20', 'Content-Length': '9',
+            }),
+            make_response(304, headers={'X-RateLimit-Remaining': '9', 'X-RateLimit-Limit': '20'}),
+        ]
+
+        first = self.cofecms.get_roles()
+        second = self.cofecms.get_roles()
+
+        self.assertEqual(second, [{'id': 1}])
+        self.assertIs(second[0], first[0])
+        self.assertEqual(second.headers['X-Total-Count'], '1')
+        self.assertNotIn('Content-Length', second.headers)
+        self.assertEqual(second.rate_limit_remaining, 9)
+        self.assertEqual(self.cache.stats, {'miss': 1, 'not_modified': 1})
+
+        first_call, second_call = self.cofecms.do_request.call_args_list
+        self.assertIsNone(first_call[1]['headers'])
+        self.assertEqual(second_call[1]['headers'], {'If-None-Match': '"abc"'})
+
+    def test_content_hash(self):
+        self.cofecms.do_request.side_effect = [
+            make_response(body=[{'id': 1}], headers={'Last-Modified': 'yesterday'}),
+            make_response(body=[{'id': 1}]),
+            make_response(body=[{'id': 2}]),
+        ]
+
+        first = self.cofecms.get_roles()
+        with mock.patch.object(Response, 'json') as mock_json:
+            second = self.cofecms.get_roles()
+        mock_json.assert_not_called()
+        third = self.cofecms.get_roles()
+
+        self.assertIs(second[0], first[0])
+        self.assertEqual(third, [{'id': 2}])
+        self.assertEqual(self.cache.stats, {'miss': 1, 'unchanged': 1, 'changed': 1})
+        self.assertEqual(
+            self.cofecms.do_request.call_args_list[1][1]['headers'],
+            {'If-Modified-Since': 'yesterday'},
+        )
+
+    def test_max_entries(self):
+        cache = ResponseCache(max_entries=2)
+        self.assertIsInstance(cache.backend, MemoryBackend)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        cache.get('b')
+        cache.set('d', 'd')
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(cache.get('b'), 'b')
+        cache.delete('b')
+        cache.clear()
+        self.assertIsNone(cache.get('d'))
+
+
+class StaleWhileRevalidateTest(TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(max_age=60, stale_while_revalidate=600, workers=2)
+        self.cofecms = CofeCMS(
+            api_id='test_api_id', api_key='test_api_key', diocese_id=123, cache=self.cache
+        )
+        self.cofecms.do_request = mock.Mock(spec=self.cofecms.do_request)
+        self.cofecms.do_request.return_value = make_response(body=[{'id': 1}])
+        self.cofecms.get_roles()
+        self.entry = next(iter(self.cache.backend._entries.values()))
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_fresh(self):
+        result = self.cofecms.get_roles()
+
+        self.assertEqual(result, [{'id': 1}])
+        self.assertIsNone(result.response)
+        self.assertEqual(self.cofecms.do_request.call_count, 1)
+        self.assertEqual(self.cache.stats['fresh'], 1)
+
+    def test_stale(self):
+        self.entry.stored_at -= 120
+        self.cofecms.do_request.return_value = make_response(body=[{'id': 2}])
+
+        result = self.cofecms.get_roles()
+        self.cache.close()
+
+        self.assertEqual(result, [{'id': 1}])
+        self.assertEqual(self.cofecms.do_request.call_count, 2)
+        self.assertEqual(self.cache.stats['stale'], 1)
+        self.assertEqual(self.cofecms.get_roles(), [{'id': 2}])
+
+    def test_expired(self):
+        self.entry.stored_at -= 1000
+        self.cofecms.do_request.return_value = make_response(body=[{'id': 2}])
+
+        self.assertEqual(self.cofecms.get_roles(), [{'id': 2}])
+        self.assertEqual(self.cache.stats['stale'], 0)
+
+    def test_one_request_in_flight(self):
+        self.entry.stored_at -= 1000
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_request(*args, **kwargs):
+            started.set()
+            release.wait(5)
+            return make_response(body=[{'id': 2}])
+        self.cofecms.do_request.side_effect = slow_request
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(self.cofecms.get_roles)
+            started.wait(5)
+            second = executor.submit(self.cofecms.get_roles)
+            while not self.cache.stats['coalesced']:
+                time.sleep(0.001)
+            release.set()
+
+        self.assertEqual(first.result(), [{'id': 2}])
+        self.assertEqual(second.result(), [{'id': 2}])
+        self.assertEqual(self.cofecms.do_request.call_count, 2)
+
+    def test_background_error(self):
+        self.entry.stored_at -= 120
+        self.cofecms.do_request.side_effect = requests.HTTPError
+
+        self.assertEqual(self.cofecms.get_roles(), [{'id': 1}])
+        self.cache.close()
+
+        self.assertEqual(self.cache.stats['revalidation_errors'], 1)
+        self.assertEqual(self.cache._in_flight, {})
+
+
+class DictRedis(object):
+    """
+    Just enough of a Redis client to test RedisBackend without a server.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.expiry[key] = ex
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in self.values if fnmatch(key, match)]
+
+
+class RedisBackendTest(TestCase):
+
+    def setUp(self):
+        self.entry = CacheEntry(
+            [{'id': 1, 'name': 'Vicar'}], {'X-Total-Count': '1'}, '"abc"', None, 'hash', 123.5
+        )
+
+    def assertEntryEqual(self, entry, expected):
+        for name in CacheEntry.__slots__:
+            self.assertEqual(getattr(entry, name), getattr(expected, name))
+
+    def test_get_set(self):
+        client = DictRedis()
+        backend = RedisBackend(client=client, prefix='test:', ttl=60, serializer=SERIALIZER_JSON)
+
+        self.assertIsNone(backend.get('key'))
+        backend.set('key', self.entry)
+        self.assertEntryEqual(backend.get('key'), self.entry)
+
+        redis_key, = client.values
+        self.assertTrue(redis_key.startswith('test:'))
+        self.assertEqual(client.expiry[redis_key], 60)
+
+        backend.delete('key')
+        self.assertIsNone(backend.get('key'))
+
+    def test_clear(self):
+        client = DictRedis()
+        client.set('other', b'1')
+        backend = RedisBackend(client=client, serializer=SERIALIZER_JSON)
+        backend.set('a', self.entry)
+        backend.set('b', self.entry)
+
+        backend.clear()
+
+        self.assertEqual(list(client.values), ['other'])
+
+    def test_serializers(self):
+        serializers = [SERIALIZER_JSON, SERIALIZER_PICKLE] + (['msgpack'] if msgpack else [])
+        for serializer in serializers:
+            backend = RedisBackend(client=DictRedis(), serializer=serializer)
+            self.assertEntryEqual(backend.loads(backend.dumps(self.entry)), self.entry)
+
+    def test_unreadable(self):
+        client = DictRedis()
+        RedisBackend(client=client, serializer=SERIALIZER_PICKLE).set('key', self.entry)
+        json_backend = RedisBackend(client=client, serializer=SERIALIZER_JSON)
+
+        # Pickled entries are never loaded by a backend which isn't using pickle
+        self.assertIsNone(json_backend.get('key'))
+
+        client.values[next(iter(client.values))] = b'j{corrupt'
+        self.assertIsNone(json_backend.get('key'))
+
+    def test_unknown_serializer(self):
+        with self.assertRaises(ValueError):
+            RedisBackend(client=DictRedis(), serializer='wibble')
+
+    @skipIf(msgpack, 'msgpack is installed')
+    def test_default_serializer(self):
+        self.assertEqual(RedisBackend(client=DictRedis()).serializer, SERIALIZER_JSON)
+        with self.assertRaises(ImportError):
+            RedisBackend(client=DictRedis(), serializer='msgpack')
+
+    @skipIf(redis, 'redis is installed')
+    def test_redis_not_installed(self):
+        with self.assertRaises(ImportError):
+            RedisBackend()
+
+    def test_shared_between_clients(self):
+        backend = RedisBackend(client=DictRedis(), serializer=SERIALIZER_JSON)
+        clients = []
+        for _ in range(2):
+            cofecms = CofeCMS(
+                api_id='test_api_id',
+                api_key='test_api_key',
+                diocese_id=123,
+                cache=ResponseCache(max_age=60, backend=backend),
+            )
+            cofecms.do_request = mock.Mock(
+                spec=cofecms.do_request, return_value=make_response(body=[{'id': 1}])
+            )
+            clients.append(cofecms)
+
+        self.assertEqual(clients[0].get_roles(), [{'id': 1}])
+        self.assertEqual(clients[1].get_roles(), [{'id': 1}])
+        clients[1].do_request.assert_not_called()
+
+    def test_redis_down(self):
+        # The cache is skipped while Redis is down, rather than failing requests
+        client = mock.Mock(spec=DictRedis)
+        client.get.side_effect = ConnectionError('Redis is down')
+        client.set.side_effect = ConnectionError('Redis is down')
+        cache = ResponseCache(max_age=60, backend=RedisBackend(client=client))
+        cofecms = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                          cache=cache)
+        cofecms.do_request = mock.Mock(
+            spec=cofecms.do_request, return_value=make_response(body=[{'id': 1}])
+        )
+
+        self.assertEqual(cofecms.get_roles(), [{'id': 1}])
+        self.assertEqual(cofecms.get_roles(), [{'id': 1}])
+        self.assertEqual(cofecms.do_request.call_count, 2)
+        self.assertGreaterEqual(cache.stats['backend_errors'], 4)
+
+    @skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_fakeredis(self):
+        backend = RedisBackend(client=fakeredis.FakeRedis())
+        backend.set('key', self.entry)
+        self.assertEntryEqual(backend.get('key'), self.entry)
+        backend.clear()
+        self.assertIsNone(backend.get('key'))
@@ -0,0 +1,125 @@
+import datetime
+from collections import OrderedDict
+from unittest import TestCase, mock
+
+from cofecms.changes import (
+    EVENT_CREATED, EVENT_DELETED, EVENT_UPDATED, ChangeEvent, ChangeTracker, content_hash
+)
+from cofecms.records import compact_records
+from tests.utils import mock_result
+
+
+def mock_api(contacts=(), deleted_contacts=(), posts=()):
+    api = mock.Mock()
+    api.get_contacts.return_value = mock_result(list(contacts))
+    api.get_deleted_contacts.return_value = mock_result(list(deleted_contacts))
+    api.get_posts.return_value = mock_result(list(posts))
+    api.get_deleted_posts.return_value = mock_result([])
+    return api
+
+
+class ContentHashTest(TestCase):
+
+    def test_content_hash(self):
+        record = OrderedDict([('id', 1), ('surname', 'Smith')])
+        reordered = OrderedDict([('surname', 'Smith'), ('id', 1)])
+        self.assertEqual(content_hash(record), content_hash(reordered))
+        self.assertEqual(content_hash(record), content_hash(compact_records([record])[0]))
+        self.assertNotEqual(content_hash(record), content_hash({'id': 1, 'surname': 'Jones'}))
+
+
+class ChangeTrackerTest(TestCase):
+
+    def setUp(self):
+        self.api = mock_api(
+            contacts=[{'id': 1, 'surname': 'Smith'}, {'id': 2, 'surname': 'Jones'}],
+            posts=[{'post_id': 10, 'contact_id': 1}],
+        )
+        self.tracker = ChangeTracker(self.api, resources=['contacts', 'posts'])
+        self.events = []
+        self.tracker.subscribe(self.events.append)
+
+    def test_first_sync(self):
+        counts = self.tracker.sync(diocese_id=123)
+
+        self.assertEqual(counts, {EVENT_CREATED: 3})
+        self.assertEqual(self.events[0], ChangeEvent(
+            EVENT_CREATED, 'contacts', 1, {'id': 1, 'surname': 'Smith'}
+        ))
+        self.assertEqual(self.events[2].record_id, 10)
+        self.assertEqual(sorted(self.tracker.hashes['contacts']), [1, 2])
+        self.assertIsNotNone(self.tracker.updated_at)
+        self.api.get_contacts.assert_called_once_with(
+            diocese_id=123, search_params=None, start_date=None, limit=1000
+        )
+        self.api.get_deleted_contacts.assert_not_called()
+
+    def test_incremental_sync(self):
+        self.tracker.sync()
+        since = self.tracker.updated_at
+        del self.events[:]
+        self.tracker.api = mock_api(
+            contacts=[{'id': 1, 'surname': 'Smith'}, {'id': 2, 'surname': 'Jones-Smith'},
+                      {'id': 3, 'surname': 'Brown'}],
+            deleted_contacts=[{'id': 1}, {'id': 99}],
+        )
+
+        counts = self.tracker.sync()
+
+        self.assertEqual(counts, {EVENT_CREATED: 1, EVENT_UPDATED: 1, EVENT_DELETED: 1})
+        self.assertEqual(
+            [(event.event_type, event.record_id) for event in self.events],
+            [(EVENT_UPDATED, 2), (EVENT_CREATED, 3), (EVENT_DELETED, 1)],
+        )
+        self.assertEqual(self.events[2].record, {'id': 1})
+        self.tracker.api.get_deleted_contacts.assert_called_once_with(
+            diocese_id=None, search_params=None, start_date=since, limit=1000
+        )
+
+    def test_full_sync_finds_deletions(self):
+        self.tracker.sync()
+        del self.events[:]
+        self.tracker.api = mock_api(contacts=[{'id': 2, 'surname': 'Jones'}])
+        self.tracker.updated_at = None
+
+        self.assertEqual(self.tracker.sync(), {EVENT_DELETED: 2})
+        self.assertEqual(
+            sorted((event.resource, event.record_id) for event in self.events),
+            [('contacts', 1), ('posts', 10)],
+        )
+
+    def test_subscriber_filters(self):
+        deleted = []
+        posts = []
+        self.tracker.subscribe(deleted.append, event_types=[EVENT_DELETED])
+        self.tracker.subscribe(posts.append, resource='posts')
+        self.tracker.unsubscribe(self.events.append)
+
+        self.tracker.sync()
+
+        self.assertEqual(deleted, [])
+        self.assertEqual([event.record_id for event in posts], [10])
+        self.assertEqual(self.events, [])
+
+    def test_subscriber_error(self):
+        self.tracker.subscribe(mock.Mock(side_effect=ValueError))
+
+        with self.assertRaises(ValueError):
+            self.tracker.sync()
+
+        self.assertEqual(self.tracker.hashes['contacts'], {})
+        self.assertIsNone(self.tracker.updated_at)
+
+    def test_resume(self):
+        self.tracker.sync()
+        updated_at = datetime.datetime(2020, 1, 1)
+        api = mock_api(contacts=[{'id': 1, 'surname': 'Smith'}])
+
+        tracker = ChangeTracker(
+            api, resources=['contacts'], hashes=self.tracker.hashes, updated_at=updated_at
+        )
+
+        self.assertEqual(tracker.sync(), {})
+        api.get_contacts.assert_called_once_with(
+            diocese_id=None, search_params=None, start_date=updated_at, limit=1000
+        )
@@ -0,0 +1,177 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+import httpretty
+import requests
+
+from cofecms.api import CofeCMS
+from cofecms.cache import ResponseCache
+from cofecms.circuit import (
+    STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, CircuitOpenError
+)
+from cofecms.scheduler import RequestScheduler
+
+ROLES_URL = 'https://cmsapi.cofeportal.org/v2/roles'
+
+
+class CircuitBreakerTest(TestCase):
+
+    def test_trips_after_failures(self):
+        changes = []
+        breaker = CircuitBreaker(
+            failure_threshold=3,
+            reset_timeout=60,
+            on_state_change=lambda *states: changes.append(states),
+        )
+
+        for _ in range(2):
+            breaker.record(False, 0.1, breaker.before_request())
+        breaker.record(True, 0.1, breaker.before_request())
+        self.assertEqual(breaker.consecutive_failures, 0)
+
+        for _ in range(3):
+            breaker.record(False, 0.1, breaker.before_request())
+        self.assertEqual(breaker.state, STATE_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+        status = breaker.status()
+        self.assertEqual(status['state'], STATE_OPEN)
+        self.assertGreater(status['retry_in'], 59)
+        self.assertEqual(status['rejected'], 1)
+        self.assertEqual(status['opened'], 1)
+        self.assertEqual(changes, [(STATE_CLOSED, STATE_OPEN)])
+
+    def test_slow_calls(self):
+        breaker = CircuitBreaker(failure_threshold=2, slow_call_duration=1)
+        breaker.record(True, 1.5, breaker.before_request())
+        breaker.record(True, 2, breaker.before_request())
+
+        self.assertEqual(breaker.state, STATE_OPEN)
+        self.assertEqual(breaker.stats['slow_calls'], 2)
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05, half_open_max_calls=1)
+        breaker.record(False, 0.1, breaker.before_request())
+        time.sleep(0.06)
+
+        self.assertEqual(breaker.state, STATE_HALF_OPEN)
+        probe = breaker.before_request()
+        self.assertTrue(probe)
+        # Only one probe at a time
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+        # A failed probe opens the breaker again
+        breaker.record(False, 0.1, probe)
+        self.assertEqual(breaker.state, STATE_OPEN)
+        time.sleep(0.06)
+
+        breaker.record(True, 0.1, breaker.before_request())
+        self.assertEqual(breaker.state, STATE_CLOSED)
+        self.assertFalse(breaker.before_request())
+
+    def test_on_state_change__status(self):
+        statuses = []
+        breaker = CircuitBreaker(
+            failure_threshold=1,
+            on_state_change=lambda *states: statuses.append(breaker.status()),
+        )
+        breaker.record(False, 0.1, breaker.before_request())
+
+        self.assertEqual(len(statuses), 1)
+        self.assertEqual(statuses[0]['state'], STATE_OPEN)
+
+    def test_reset(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.record(False, 0.1)
+        breaker.reset()
+        self.assertEqual(breaker.state, STATE_CLOSED)
+
+
+class ClientCircuitBreakerTest(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    def test_fails_fast(self):
+        transport = mock.Mock()
+        transport.get.side_effect = requests.exceptions.ConnectionError
+        cofe = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                       transport=transport, circuit_breaker=self.breaker)
+
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                cofe.get_roles()
+        with self.assertRaises(CircuitOpenError):
+            cofe.get_roles()
+        self.assertEqual(transport.get.call_count, 2)
+
+    @httpretty.activate
+    def test_server_errors(self):
+        httpretty.register_uri(httpretty.GET, ROLES_URL, status=503, body='{}')
+        cofe = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                       circuit_breaker=self.breaker)
+
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                cofe.get_roles()
+        self.assertEqual(self.breaker.state, STATE_OPEN)
+
+    @httpretty.activate
+    def test_client_errors(self):
+        httpretty.register_uri(httpretty.GET, ROLES_URL, status=404, body='{}')
+        cofe = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                       circuit_breaker=self.breaker)
+
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                cofe.get_roles()
+        self.assertEqual(self.breaker.state, STATE_CLOSED)
+
+    @httpretty.activate
+    def test_serve_from_cache(self):
+        httpretty.register_uri(httpretty.GET, ROLES_URL, responses=[
+            httpretty.Response(body='[{"id": 1}]'),
+            httpretty.Response(body='{}', status=500),
+            httpretty.Response(body='{}', status=500),
+        ])
+        cofe = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                       circuit_breaker=self.breaker, cache=ResponseCache())
+
+        self.assertEqual(cofe.get_roles(), [{'id': 1}])
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                cofe.get_roles()
+
+        self.assertEqual(cofe.get_roles(), [{'id': 1}])
+        self.assertEqual(self.breaker.stats['served_from_cache'], 1)
+        with self.assertRaises(CircuitOpenError):
+            cofe.get_contact(1)
+
+        self.breaker.serve_from_cache = False
+        with self.assertRaises(CircuitOpenError):
+            cofe.get_roles()
+
+    def test_scheduler_wait(self):
+        # Time spent waiting for the scheduler doesn't count towards a slow call
+        breaker = CircuitBreaker(failure_threshold=1, slow_call_duration=0.05)
+        scheduler = RequestScheduler(max_concurrent=1)
+        transport = mock.Mock()
+        transport.get.return_value.status_code = 200
+        transport.get.return_value.headers = {}
+        transport.get.return_value.json.return_value = []
+        cofe = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                       transport=transport, circuit_breaker=breaker, scheduler=scheduler)
+
+        scheduler.acquire('url', {})
+        thread = threading.Thread(target=cofe.get_roles)
+        thread.start()
+        time.sleep(0.1)
+        scheduler.release()
+        thread.join()
+
+        self.assertEqual(breaker.stats['successes'], 1)
+        self.assertEqual(breaker.stats['slow_calls'], 0)
+        self.assertEqual(breaker.state, STATE_CLOSED)
@@ -0,0 +1,133 @@
+import gzip
+import json
+from unittest import TestCase, mock
+
+import httpretty
+
+from cofecms.api import CofeCMS
+from cofecms.compression import (
+    CompressionStats, accept_encoding, supported_encodings, wire_size
+)
+from cofecms.transports import Response
+
+
+class AcceptEncodingTest(TestCase):
+
+    def test_accept_encoding(self):
+        with mock.patch(
+                'cofecms.compression.supported_encodings',
+                return_value={'deflate', 'gzip', 'br', 'zstd'},
+        ):
+            self.assertEqual(accept_encoding(), 'zstd, br, gzip, deflate')
+
+        with mock.patch(
+                'cofecms.compression.supported_encodings', return_value={'gzip', 'deflate'}
+        ):
+            self.assertEqual(accept_encoding(), 'gzip, deflate')
+
+    def test_supported_encodings__no_urllib3(self):
+        # Older versions of requests don't install urllib3 as a package of its own
+        with mock.patch.dict('sys.modules', {
+                'urllib3.util.request': None,
+                'requests.packages.urllib3.util.request': None,
+        }):
+            self.assertEqual(supported_encodings(), {'gzip', 'deflate'})
+
+    def test_session_accept_encoding(self):
+        cofecms = CofeCMS(api_id='test_api_id', api_key='test_api_key')
+        session = cofecms._get_session()
+        self.assertEqual(session.headers['Accept-Encoding'], accept_encoding())
+
+
+class WireSizeTest(TestCase):
+
+    def test_wire_bytes(self):
+        response = Response('http://example.com', 200, {}, b'12345', wire_bytes=3)
+        self.assertEqual(wire_size(response), 3)
+
+    def test_raw(self):
+        response = mock.Mock(spec=['headers', 'raw'], headers={})
+        response.raw.tell.return_value = 4
+        self.assertEqual(wire_size(response), 4)
+
+    def test_content_length(self):
+        response = Response('http://example.com', 200, {'Content-Length': '5'}, b'1234567')
+        self.assertEqual(wire_size(response), 5)
+
+    def test_unknown(self):
+        response = Response('http://example.com', 200, {}, b'1234567')
+        self.assertIsNone(wire_size(response))
+
+
+class CompressionStatsTest(TestCase):
+
+    def test_record(self):
+        stats = CompressionStats()
+        stats.record(
+            'https://cmsapi.cofeportal.org/v2/contacts',
+            Response('', 200, {'Content-Encoding': 'gzip'}, b'x' * 100, wire_bytes=20),
+        )
+        stats.record(
+            'https://cmsapi.cofeportal.org/v2/contacts',
+            Response('', 200, {'Content-Encoding': 'gzip'}, b'x' * 100, wire_bytes=30),
+        )
+        stats.record('https://cmsapi.cofeportal.org/v2/contacts/123', Response('', 200, {}, b'xx'))
+
+        self.assertEqual(
+            stats.summary(), {
+                '/v2/contacts': {
+                    'requests': 2,
+                    'wire_bytes': 50,
+                    'decoded_bytes': 200,
+                    'ratio': 0.25,
+                    'encodings': {'gzip': 2},
+                },
+                '/v2/contacts/{id}': {
+                    'requests': 1,
+                    'wire_bytes': 2,
+                    'decoded_bytes': 2,
+                    'ratio': 1.0,
+                    'encodings': {'identity': 1},
+                },
+            }
+        )
+        self.assertEqual(
+            stats.totals(), {
+                'requests': 3, 'wire_bytes': 52, 'decoded_bytes': 202, 'ratio': 52 / 202
+            }
+        )
+
+        stats.reset()
+        self.assertEqual(stats.summary(), {})
+        self.assertEqual(stats.totals()['ratio'], None)
+
+    @httpretty.activate
+    def test_client_records_gzip_response(self):
+        body = json.dumps([{'surname': 'Smith'}] * 100).encode('utf-8')
+        compressed = gzip.compress(body)
+        httpretty.register_uri(
+            httpretty.GET,
+            'https://cmsapi.cofeportal.org/v2/roles',
+            body=compressed,
+            adding_headers={'Content-Encoding': 'gzip', 'Content-Length': str(len(compressed))},
+        )
+
+        stats = CompressionStats()
+        cofecms = CofeCMS(
+            api_id='test_api_id',
+            api_key='test_api_key',
+            diocese_id=123,
+            compression_stats=stats,
+        )
+        result = cofecms.get_roles()
+
+        self.assertEqual(len(result), 100)
+        self.assertEqual(
+            stats.summary()['/v2/roles'], {
+                'requests': 1,
+                'wire_bytes': len(compressed),
+                'decoded_bytes': len(body),
+                'ratio': len(compressed) / len(body),
+                'encodings': {'gzip': 1},
+            }
+        )
@@ -0,0 +1,125 @@
+import time
+from unittest import TestCase, mock
+
+from benchmarks.server import MockCMSServer
+from cofecms.api import CofeCMS, CofeCMSResult
+from cofecms.deadlines import Deadline, DeadlineExceededError
+from cofecms.scheduler import RequestScheduler
+
+
+class DeadlineTest(TestCase):
+
+    def test_coerce(self):
+        deadline = Deadline(10)
+        self.assertIs(Deadline.coerce(deadline), deadline)
+        self.assertIsNone(Deadline.coerce(None))
+        self.assertAlmostEqual(Deadline.coerce(5).remaining(), 5, places=1)
+
+    def test_expired(self):
+        deadline = Deadline(0.01)
+        self.assertFalse(deadline.expired)
+        deadline.check()
+
+        time.sleep(0.02)
+        self.assertTrue(deadline.expired)
+        with self.assertRaises(DeadlineExceededError) as cm:
+            deadline.check(partial=[1])
+        self.assertEqual(cm.exception.partial, [1])
+        self.assertIsInstance(cm.exception, TimeoutError)
+
+    def test_timeout(self):
+        deadline = Deadline(10)
+        self.assertLessEqual(deadline.timeout(), 10)
+        self.assertEqual(deadline.timeout(3), 3)
+        connect, read = deadline.timeout((3, 30))
+        self.assertEqual(connect, 3)
+        self.assertLessEqual(read, 10)
+        self.assertGreater(read, 9)
+
+
+class ClientDeadlineTest(TestCase):
+
+    def setUp(self):
+        self.transport = mock.Mock()
+        self.cofecms = CofeCMS(
+            api_id='test_api_id',
+            api_key='test_api_key',
+            diocese_id=123,
+            transport=self.transport,
+            timeout=(3, 30),
+        )
+
+    def test_get__timeout_from_deadline(self):
+        self.transport.get.return_value.json.return_value = []
+
+        self.cofecms.get(self.cofecms.generate_endpoint_url('/v2/roles'), deadline=10)
+
+        connect, read = self.transport.get.call_args[1]['timeout']
+        self.assertEqual(connect, 3)
+        self.assertLessEqual(read, 10)
+
+    def test_get__expired(self):
+        with self.assertRaises(DeadlineExceededError):
+            self.cofecms.get('http://example.com/endpoint', deadline=0)
+        self.transport.get.assert_not_called()
+
+    def test_get__timed_out(self):
+        def slow_get(url, params, timeout):
+            time.sleep(0.02)
+            raise IOError('Read timed out')
+
+        self.transport.get.side_effect = slow_get
+        with self.assertRaises(DeadlineExceededError) as cm:
+            self.cofecms.get('http://example.com/endpoint', deadline=0.01)
+        self.assertIsInstance(cm.exception.__cause__, IOError)
+
+        # Other errors are raised as they are while there's time left
+        self.transport.get.side_effect = IOError
+        with self.assertRaises(IOError) as cm:
+            self.cofecms.get('http://example.com/endpoint', deadline=10)
+        self.assertNotIsInstance(cm.exception, DeadlineExceededError)
+
+    def test_get__scheduler(self):
+        # Time spent waiting for the scheduler counts towards the deadline
+        self.transport.get.return_value.json.return_value = []
+        self.cofecms.scheduler = RequestScheduler(max_concurrent=1)
+        self.cofecms.scheduler.acquire('url', {})
+
+        with self.assertRaises(DeadlineExceededError):
+            self.cofecms.get('http://example.com/endpoint', deadline=0.05)
+        self.transport.get.assert_not_called()
+
+        self.cofecms.scheduler.release()
+        self.cofecms.get('http://example.com/endpoint', deadline=10)
+        connect, read = self.transport.get.call_args[1]['timeout']
+        self.assertEqual(connect, 3)
+        self.assertLessEqual(read, 10)
+
+    def test_all__partial(self):
+        result = CofeCMSResult([1, 2])
+        result.total_count = 6
+        result.limit = 2
+        result.get_data_for_page = mock.Mock(
+            side_effect=[CofeCMSResult([3, 4]), DeadlineExceededError()]
+        )
+
+        with self.assertRaises(DeadlineExceededError) as cm:
+            result.all(deadline=10)
+        self.assertEqual(cm.exception.partial, [1, 2, 3, 4])
+
+        # The same Deadline is passed to every page
+        deadline = result.get_data_for_page.call_args[0][1]
+        self.assertIsInstance(deadline, Deadline)
+        self.assertIs(result.get_data_for_page.call_args_list[0][0][1], deadline)
+
+    def test_pages_generator__server(self):
+        with MockCMSServer('test_api_id', 'test_api_key', contacts=50, latency=0.05) as server:
+            cofecms = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123)
+            cofecms.BASE_URL = server.url
+            result = cofecms.get_contacts(limit=10)
+
+            started = time.monotonic()
+            with self.assertRaises(DeadlineExceededError) as cm:
+                result.all(workers=2, deadline=0.12)
+            self.assertLess(time.monotonic() - started, 0.5)
+            self.assertEqual(cm.exception.partial[:10], list(result))
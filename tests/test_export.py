@@ -0,0 +1,306 @@
+import csv
+import datetime
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock, skipUnless
+
+from benchmarks.server import MockCMSServer, make_contact
+from cofecms import cli, export
+from cofecms.api import CofeCMS, CofeCMSResult
+from cofecms.records import compact_records
+
+try:
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+
+def surname_only(contact):
+    # Defined at the top level so it can be sent to worker processes
+    if contact['id'] % 2:
+        return {'id': contact['id'], 'surname': contact['surname']}
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.cofecms = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123)
+
+    def test_export(self):
+        first_page = CofeCMSResult([{'surname': 'Smith'}])
+        first_page.pages_generator = mock.Mock(
+            spec=first_page.pages_generator,
+            return_value=[first_page, [{'surname': 'Jones'}, {'surname': 'Brown'}], []],
+        )
+        self.cofecms.get_deleted_contacts = mock.Mock(
+            spec=self.cofecms.get_deleted_contacts, return_value=first_page
+        )
+        sink = mock.Mock(spec=export.NDJSONSink)
+        start_date = datetime.datetime(2017, 3, 20)
+
+        count = export.export(
+            self.cofecms,
+            'deleted-contacts',
+            sink,
+            fields={'contact': ['surname']},
+            start_date=start_date,
+            workers=4,
+        )
+
+        self.assertEqual(count, 3)
+        self.cofecms.get_deleted_contacts.assert_called_once_with(
+            diocese_id=None,
+            search_params=None,
+            end_date=None,
+            fields={'contact': ['surname']},
+            limit=1000,
+            start_date=start_date,
+        )
+        first_page.pages_generator.assert_called_once_with(workers=4)
+        self.assertEqual(
+            sink.write_batch.call_args_list, [
+                mock.call([{'surname': 'Smith'}]),
+                mock.call([{'surname': 'Jones'}, {'surname': 'Brown'}]),
+            ]
+        )
+
+    def test_export__transform(self):
+        first_page = CofeCMSResult([{'id': 1, 'surname': 'Smith'}, {'id': 2, 'surname': 'Jones'}])
+        first_page.pages_generator = mock.Mock(return_value=[first_page])
+        self.cofecms.get_contacts = mock.Mock(return_value=first_page)
+        sink = mock.Mock(spec=export.NDJSONSink)
+
+        count = export.export(self.cofecms, 'contacts', sink, transform=surname_only)
+
+        self.assertEqual(count, 1)
+        sink.write_batch.assert_called_once_with([{'id': 1, 'surname': 'Smith'}])
+
+    def test_export__processes(self):
+        with MockCMSServer('test_api_id', 'test_api_key', contacts=2500) as server:
+            self.cofecms.BASE_URL = server.url
+            sink = mock.Mock(spec=export.NDJSONSink)
+            count = export.export(self.cofecms, 'contacts', sink, processes=2)
+            self.assertEqual(count, 2500)
+            batches = [args[0][0] for args in sink.write_batch.call_args_list]
+            self.assertEqual([record['id'] for batch in batches for record in batch],
+                             list(range(1, 2501)))
+
+            sink = mock.Mock(spec=export.NDJSONSink)
+            count = export.export(
+                self.cofecms, 'contacts', sink, processes=2, transform=surname_only
+            )
+            self.assertEqual(count, 1250)
+            self.assertEqual(sink.write_batch.call_count, 3)
+            first_batch = sink.write_batch.call_args_list[0][0][0]
+            self.assertEqual(first_batch[0], {'id': 1, 'surname': make_contact(1)['surname']})
+
+    def test_fetch_page__timeout(self):
+        # Worker processes make their requests with the client's timeout
+        config = ('test_api_id', 'test_api_key', 123, False, (3, 30))
+        self.addCleanup(export._worker_clients.pop, config, None)
+        query = ('https://cmsapi.cofeportal.org/v2/contacts', 123, None, 10, {})
+        with mock.patch('cofecms.export.CofeCMS') as mock_client:
+            mock_client.return_value.paged_get.return_value = CofeCMSResult([{'id': 1}])
+            self.assertEqual(export._fetch_page(config, query, 1, None), [{'id': 1}])
+
+        mock_client.assert_called_once_with(
+            'test_api_id', 'test_api_key', 123, compact_records=False, timeout=(3, 30)
+        )
+
+    def test_export__unknown_resource(self):
+        with self.assertRaises(ValueError):
+            export.export(self.cofecms, 'wibble', mock.Mock())
+
+    def test_guess_format(self):
+        self.assertEqual(export.guess_format('out.csv'), ('csv', None))
+        self.assertEqual(export.guess_format('out.ndjson.gz'), ('ndjson', 'gzip'))
+        self.assertEqual(export.guess_format('out.parquet'), ('parquet', None))
+        self.assertEqual(export.guess_format('-'), (None, None))
+
+    def test_ndjson_sink(self):
+        fileobj = io.StringIO()
+        sink = export.NDJSONSink(fileobj)
+        sink.write_batch([{'a': 1}, {'a': 2}])
+        sink.write_batch([{'a': 3}])
+        self.assertEqual(fileobj.getvalue(), '{"a":1}\n{"a":2}\n{"a":3}\n')
+
+    def test_ndjson_sink__compact_records(self):
+        fileobj = io.StringIO()
+        sink = export.NDJSONSink(fileobj)
+        sink.write_batch(compact_records([{'a': 1}]))
+        self.assertEqual(fileobj.getvalue(), '{"a":1}\n')
+
+    def test_csv_sink(self):
+        fileobj = io.StringIO()
+        sink = export.CSVSink(fileobj)
+        sink.write_batch([{'a': 1, 'b': ['x']}])
+        sink.write_batch([{'a': 2, 'b': None, 'c': 'ignored'}])
+
+        rows = list(csv.reader(io.StringIO(fileobj.getvalue())))
+        self.assertEqual(rows, [['a', 'b'], ['1', '["x"]'], ['2', '']])
+
+
+class ExportFilesTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_open_output__gzip(self):
+        path = os.path.join(self.tmp_dir, 'out.ndjson.gz')
+        fileobj = export.open_output(path, 'gzip')
+        fileobj.write('wibble\n')
+        fileobj.close()
+
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual(f.read(), 'wibble\n')
+
+    def test_open_output__stdout(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with mock.patch('sys.stdout', stdout):
+            fileobj = export.open_output('-')
+            fileobj.write('wibble\n')
+            fileobj.close()
+
+        self.assertFalse(stdout.closed)
+        self.assertEqual(stdout.buffer.getvalue(), b'wibble\n')
+
+    def test_open_output__stdout_gzip(self):
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        with mock.patch('sys.stdout', stdout):
+            fileobj = export.open_output('-', 'gzip')
+            fileobj.write('wibble\n')
+            fileobj.close()
+
+        self.assertFalse(stdout.closed)
+        self.assertEqual(gzip.decompress(stdout.buffer.getvalue()), b'wibble\n')
+
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_parquet_sink(self):
+        path = os.path.join(self.tmp_dir, 'out.parquet')
+        sink = export.ParquetSink(path)
+        sink.write_batch([{'a': 1}, {'a': 2}])
+        sink.write_batch([{'a': 3}])
+        sink.close()
+
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.to_pylist(), [{'a': 1}, {'a': 2}, {'a': 3}])
+
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_parquet_sink__sparse(self):
+        # Columns which are null throughout the first page get their type from a later page
+        path = os.path.join(self.tmp_dir, 'out.parquet')
+        sink = export.ParquetSink(path, infer_pages=2)
+        sink.write_batch([{'a': 1, 'b': None, 'c': None}])
+        sink.write_batch([{'a': 2, 'b': 'x', 'c': None}])
+        sink.write_batch([{'a': 3, 'b': None, 'c': {'d': 1}}])
+        sink.close()
+
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(str(table.schema.field('b').type), 'string')
+        self.assertEqual(table.to_pylist(), [
+            {'a': 1, 'b': None, 'c': None},
+            {'a': 2, 'b': 'x', 'c': None},
+            {'a': 3, 'b': None, 'c': '{"d": 1}'},
+        ])
+
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_parquet_sink__new_column(self):
+        path = os.path.join(self.tmp_dir, 'out.parquet')
+        sink = export.ParquetSink(path)
+        sink.write_batch([{'a': 1}])
+        with self.assertRaises(export.SchemaMismatchError) as cm:
+            sink.write_batch([{'a': 2, 'b': 'x'}])
+        sink.close()
+
+        self.assertEqual(cm.exception.columns, ['b'])
+        self.assertIn('pass a schema', str(cm.exception))
+        self.assertEqual(pyarrow.parquet.read_table(path).to_pylist(), [{'a': 1}])
+
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_parquet_sink__type_changed(self):
+        path = os.path.join(self.tmp_dir, 'out.parquet')
+        sink = export.ParquetSink(path)
+        sink.write_batch([{'a': 1, 'b': 'x'}])
+        with self.assertRaises(export.SchemaMismatchError) as cm:
+            sink.write_batch([{'a': 'one', 'b': 'y'}])
+        sink.close()
+
+        self.assertEqual(cm.exception.columns, ['a'])
+
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_parquet_sink__schema(self):
+        path = os.path.join(self.tmp_dir, 'out.parquet')
+        schema = pyarrow.schema([('a', pyarrow.int64()), ('b', pyarrow.int32())])
+        sink = export.ParquetSink(path, schema=schema)
+        sink.write_batch([{'a': 1, 'b': None}])
+        sink.write_batch([{'a': 2, 'b': 3}])
+        sink.close()
+
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.schema, schema)
+        self.assertEqual(table.to_pylist(), [{'a': 1, 'b': None}, {'a': 2, 'b': 3}])
+
+    def test_cli_export(self):
+        path = os.path.join(self.tmp_dir, 'places.csv.gz')
+        with mock.patch('cofecms.export.export', return_value=0) as mock_export:
+            exit_code = cli.main([
+                'export',
+                'places',
+                '-o',
+                path,
+                '--fields',
+                'place.id,place.name',
+                '--since',
+                '2017-03-20',
+                '--processes',
+                '2',
+                '--timeout',
+                '30',
+                '--api-id',
+                'test_api_id',
+                '--api-key',
+                'test_api_key',
+                '--diocese-id',
+                '123',
+            ])
+
+        self.assertEqual(exit_code, 0)
+        args, kwargs = mock_export.call_args
+        self.assertEqual(args[1], 'places')
+        self.assertIsInstance(args[2], export.CSVSink)
+        self.assertEqual(kwargs['fields'], {'place': ['id', 'name']})
+        self.assertEqual(kwargs['start_date'], datetime.datetime(2017, 3, 20))
+        self.assertEqual(kwargs['processes'], 2)
+        self.assertEqual(args[0].timeout, 30)
+        self.assertTrue(os.path.exists(path))
+
+    def test_cli_export__parquet_compress(self):
+        path = os.path.join(self.tmp_dir, 'places.parquet')
+        with self.assertRaises(SystemExit), mock.patch('sys.stderr'):
+            cli.main([
+                'export', 'places', '-o', path, '--compress', 'gzip', '--api-id', 'test_api_id',
+                '--api-key', 'test_api_key', '--diocese-id', '123',
+            ])
+
+
+class CLITest(TestCase):
+
+    def test_parse_fields(self):
+        self.assertEqual(
+            cli.parse_fields('contact.forenames, contact.surname,place.name'),
+            {'contact': ['forenames', 'surname'], 'place': ['name']},
+        )
+        with self.assertRaises(Exception):
+            cli.parse_fields('surname')
+
+    def test_parse_date(self):
+        self.assertEqual(cli.parse_date('2017-03-20'), datetime.datetime(2017, 3, 20))
+        self.assertEqual(
+            cli.parse_date('2017-03-20 14:30'), datetime.datetime(2017, 3, 20, 14, 30)
+        )
+        with self.assertRaises(Exception):
+            cli.parse_date('yesterday')
@@ -0,0 +1,114 @@
+import datetime
+import random
+from unittest import TestCase, mock
+
+from cofecms.api import PLACE_TYPE_CHURCH, PLACE_TYPE_PARISH
+from cofecms.geo import Nearby, SpatialIndex, haversine
+from tests.utils import mock_result
+
+COVENTRY = (52.4068, -1.5197)
+BIRMINGHAM = (52.4862, -1.8904)
+
+
+def make_places(count, seed=1):
+    rand = random.Random(seed)
+    return [
+        {
+            'id': place_id,
+            'place_type_id': rand.choice((PLACE_TYPE_CHURCH, PLACE_TYPE_PARISH)),
+            'latitude': rand.uniform(50.0, 55.0),
+            'longitude': rand.uniform(-4.0, 1.5),
+        } for place_id in range(1, count + 1)
+    ]
+
+
+class HaversineTest(TestCase):
+
+    def test_haversine(self):
+        self.assertAlmostEqual(haversine(*(COVENTRY + BIRMINGHAM)), 26.6, places=1)
+        self.assertEqual(haversine(*(COVENTRY + COVENTRY)), 0)
+
+
+class SpatialIndexTest(TestCase):
+
+    def setUp(self):
+        self.places = make_places(2000)
+        self.index = SpatialIndex()
+        for place in self.places:
+            self.index.add(place)
+
+    def brute_force(self, latitude, longitude, place_type=None):
+        return sorted(
+            (haversine(latitude, longitude, place['latitude'], place['longitude']), place['id'])
+            for place in self.places
+            if place_type is None or place['place_type_id'] == place_type
+        )
+
+    def test_nearest(self):
+        rand = random.Random(2)
+        for _ in range(50):
+            latitude, longitude = rand.uniform(49.0, 56.0), rand.uniform(-5.0, 2.5)
+            expected = self.brute_force(latitude, longitude)[:5]
+            nearest = self.index.nearest(latitude, longitude, k=5)
+            self.assertEqual([place['id'] for distance, place in nearest],
+                             [place_id for distance, place_id in expected])
+            self.assertAlmostEqual(nearest[0].distance, expected[0][0])
+
+    def test_nearest_place_type(self):
+        expected = self.brute_force(*COVENTRY, place_type=PLACE_TYPE_CHURCH)[:3]
+        nearest = self.index.nearest(*COVENTRY, k=3, place_type=PLACE_TYPE_CHURCH)
+        self.assertEqual([place['id'] for distance, place in nearest],
+                         [place_id for distance, place_id in expected])
+        self.assertEqual(
+            len(self.index.nearest(*COVENTRY, k=3, place_type=[PLACE_TYPE_CHURCH, 999])), 3
+        )
+        self.assertEqual(self.index.nearest(*COVENTRY, place_type=999), [])
+
+    def test_nearest_far_away(self):
+        index = SpatialIndex()
+        index.add({'id': 1, 'latitude': COVENTRY[0], 'longitude': COVENTRY[1]})
+        index.add({'id': 2, 'latitude': -33.8688, 'longitude': 151.2093})
+
+        nearest = index.nearest(-36.8485, 174.7633, k=5)
+        self.assertEqual([place['id'] for distance, place in nearest], [2, 1])
+        self.assertEqual(index.nearest(*COVENTRY, k=5, max_distance=100), [
+            Nearby(0, index.places[1])
+        ])
+
+    def test_within(self):
+        expected = [
+            place_id for distance, place_id in self.brute_force(*COVENTRY) if distance <= 30
+        ]
+        within = self.index.within(*COVENTRY, radius=30)
+        self.assertEqual([place['id'] for distance, place in within], expected)
+        self.assertTrue(all(distance <= 30 for distance, place in within))
+        self.assertEqual(len(self.index.within(*COVENTRY, radius=100000)), 2000)
+
+    def test_update_and_remove(self):
+        self.index.add({'id': 1, 'place_type_id': PLACE_TYPE_CHURCH,
+                        'latitude': COVENTRY[0], 'longitude': COVENTRY[1]})
+        self.assertEqual(self.index.nearest(*COVENTRY)[0].place['id'], 1)
+
+        self.index.add({'id': 1, 'place_type_id': PLACE_TYPE_CHURCH, 'latitude': None})
+        self.assertNotIn(1, self.index)
+        self.index.remove(2)
+        self.index.remove(99999)
+        self.assertEqual(len(self.index), 1998)
+
+    def test_refresh(self):
+        since = datetime.datetime(2020, 1, 1)
+        api = mock.Mock()
+        api.get_places.return_value = mock_result([
+            {'id': 1, 'latitude': BIRMINGHAM[0], 'longitude': BIRMINGHAM[1]}
+        ])
+        api.get_deleted_places.return_value = mock_result([{'id': 2}])
+
+        self.index.refresh(api, since=since)
+
+        self.assertEqual(self.index.nearest(*BIRMINGHAM)[0].place['id'], 1)
+        self.assertNotIn(2, self.index)
+
+    def test_from_api(self):
+        api = mock.Mock()
+        api.get_places.return_value = mock_result(self.places[:10], self.places[10:20])
+        self.assertEqual(len(SpatialIndex.from_api(api)), 20)
@@ -0,0 +1,101 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from cofecms.api import CofeCMS
+from cofecms.hedging import RequestHedger, is_single_record
+
+
+class SlowFirst(object):
+    # Makes the first call slow and the rest fast, returning which call it was
+
+    def __init__(self, delay=0.3, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if call == 1:
+            time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error(call)
+        return mock.Mock(call=call, headers={})
+
+
+class RequestHedgerTest(TestCase):
+
+    def setUp(self):
+        self.hedger = RequestHedger(initial_delay=0.02, budget=1)
+        self.addCleanup(self.hedger.close)
+
+    def test_is_single_record(self):
+        self.assertTrue(is_single_record('https://cmsapi.cofeportal.org/v2/contacts/123', {}))
+        self.assertTrue(is_single_record('https://cmsapi.cofeportal.org/v2/places/1/', {}))
+        self.assertFalse(is_single_record('https://cmsapi.cofeportal.org/v2/contacts', {}))
+        self.assertFalse(is_single_record('https://cmsapi.cofeportal.org/v2/roles', {}))
+
+    def test_delay(self):
+        hedger = RequestHedger(percentile=90, initial_delay=0.5, min_delay=0.01, min_samples=10)
+        self.assertEqual(hedger.delay(), 0.5)
+
+        hedger._latencies.extend(i / 100.0 for i in range(100))
+        self.assertAlmostEqual(hedger.delay(), 0.9)
+
+        hedger._latencies.clear()
+        hedger._latencies.extend([0.001] * 20)
+        self.assertEqual(hedger.delay(), 0.01)
+
+    def test_fast(self):
+        function = SlowFirst(delay=0)
+        self.assertEqual(self.hedger.request(function).call, 1)
+        self.assertEqual(function.calls, 1)
+        self.assertEqual(self.hedger.stats, {'requests': 1})
+
+    def test_hedged(self):
+        function = SlowFirst()
+        started = time.monotonic()
+
+        self.assertEqual(self.hedger.request(function).call, 2)
+        self.assertLess(time.monotonic() - started, 0.2)
+        self.assertEqual(self.hedger.stats['hedged'], 1)
+        self.assertEqual(self.hedger.stats['hedge_wins'], 1)
+
+    def test_hedge_fails(self):
+        function = SlowFirst(delay=0.1, error=IOError)
+        with self.assertRaises(IOError) as cm:
+            self.hedger.request(function)
+        self.assertEqual(cm.exception.args, (1,))
+
+    def test_budget(self):
+        hedger = RequestHedger(initial_delay=0.02, budget=0.05)
+        self.addCleanup(hedger.close)
+
+        # Without a known rate limit, hedging is limited to 5% of requests
+        self.assertEqual(hedger.request(SlowFirst(delay=0.05)).call, 1)
+        self.assertEqual(hedger.stats['over_budget'], 1)
+
+        hedger.rate_limit = 100
+        self.assertEqual(hedger.request(SlowFirst()).call, 2)
+        for _ in range(4):
+            hedger.request(SlowFirst(delay=0.03))
+        self.assertEqual(hedger.stats['hedged'], 5)
+        self.assertEqual(hedger.request(SlowFirst(delay=0.05)).call, 1)
+        self.assertEqual(hedger.stats['over_budget'], 2)
+
+    def test_client(self):
+        transport = mock.Mock()
+        transport.get.return_value.headers = {'X-RateLimit-Limit': '60', 'X-Total-Count': '1'}
+        transport.get.return_value.json.return_value = {'id': 1}
+        cofecms = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                          transport=transport, hedger=self.hedger)
+
+        cofecms.get_contact(1)
+        self.assertEqual(self.hedger.stats['requests'], 1)
+        self.assertEqual(self.hedger.rate_limit, 60)
+
+        cofecms.get_contacts()
+        self.assertEqual(self.hedger.stats['requests'], 1)
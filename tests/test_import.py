@@ -0,0 +1,19 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+# Modules which are only needed once a request is made
+HEAVY_MODULES = ('requests', 'urllib3', 'concurrent.futures')
+
+
+class ImportTest(TestCase):
+
+    def test_import_is_lightweight(self):
+        code = (
+            'import sys\n'
+            'import cofecms\n'
+            'from cofecms.api import PLACE_TYPE_CHURCH, PRIVACY_SETTING_PUBLIC, ContactData\n'
+            'print(",".join(name for name in {!r} if name in sys.modules))\n'
+        ).format(HEAVY_MODULES)
+        output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+        self.assertEqual(output.strip(), '')
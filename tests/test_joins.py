@@ -0,0 +1,91 @@
+import datetime
+from unittest import TestCase, mock
+
+from cofecms.joins import Assignment, JoinIndex
+from tests.utils import mock_result
+
+POSTS = [
+    {'post_id': 1, 'contact_id': 10, 'place_id': 100, 'role_id': 1000},
+    {'post_id': 2, 'contact_id': 10, 'place_id': 101, 'role_id': 1001},
+    {'post_id': 3, 'contact_id': 11, 'place_id': 100, 'role_id': 1001},
+]
+CONTACTS = [{'id': 10, 'surname': 'Smith'}, {'id': 11, 'surname': 'Jones'}]
+PLACES = [{'id': 100, 'name': 'St Mary'}, {'id': 101, 'name': 'St John'}]
+ROLES = [{'id': 1000, 'name': 'Vicar'}, {'id': 1001, 'name': 'Churchwarden'}]
+
+
+def mock_api(posts=(), contacts=(), places=(), deleted_posts=(), deleted_contacts=()):
+    api = mock.Mock()
+    api.get_posts.return_value = mock_result(list(posts))
+    api.get_contacts.return_value = mock_result(list(contacts))
+    api.get_places.return_value = mock_result(list(places))
+    api.get_deleted_posts.return_value = mock_result(list(deleted_posts))
+    api.get_deleted_contacts.return_value = mock_result(list(deleted_contacts))
+    api.get_deleted_places.return_value = mock_result([])
+    api.get_roles.return_value = ROLES
+    return api
+
+
+class JoinIndexTest(TestCase):
+
+    def setUp(self):
+        self.api = mock_api(POSTS, CONTACTS, PLACES)
+        self.index = JoinIndex.from_api(self.api, diocese_id=123)
+
+    def post_ids(self, posts):
+        return sorted(post['post_id'] for post in posts)
+
+    def test_from_api(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(len(self.index.contacts), 2)
+        self.assertEqual(len(self.index.roles), 2)
+        self.api.get_posts.assert_called_once_with(
+            diocese_id=123, search_params=None, start_date=None, limit=1000
+        )
+        self.api.get_deleted_posts.assert_not_called()
+        self.api.get_roles.assert_called_once_with(diocese_id=123)
+
+    def test_lookups(self):
+        self.assertEqual(self.post_ids(self.index.posts_for_contact(10)), [1, 2])
+        self.assertEqual(self.post_ids(self.index.posts_for_place(100)), [1, 3])
+        self.assertEqual(self.post_ids(self.index.posts_for_role(1001)), [2, 3])
+        self.assertEqual(self.index.posts_for_role(9999), [])
+
+    def test_assignments(self):
+        self.assertEqual(self.index.assignments(place_id=100, role_id=1001), [
+            Assignment(POSTS[2], CONTACTS[1], PLACES[0], ROLES[1]),
+        ])
+        self.assertEqual(len(self.index.assignments()), 3)
+        self.assertEqual(self.index.assignments(contact_id=11, place_id=101), [])
+
+    def test_join_missing(self):
+        assignment = self.index.join({'post_id': 4, 'contact_id': 12})
+        self.assertIsNone(assignment.contact)
+        self.assertIsNone(assignment.place)
+
+    def test_update_and_remove(self):
+        self.index.add_post({'post_id': 1, 'contact_id': 11, 'place_id': 101, 'role_id': 1000})
+        self.assertEqual(self.post_ids(self.index.posts_for_contact(10)), [2])
+        self.assertEqual(self.post_ids(self.index.posts_for_contact(11)), [1, 3])
+
+        self.index.remove_post(1)
+        self.index.remove_post(99)
+        self.assertEqual(self.index.posts_for_role(1000), [])
+        self.assertNotIn(1000, self.index._by_role)
+
+    def test_refresh(self):
+        since = datetime.datetime(2020, 1, 1)
+        api = mock_api(
+            posts=[{'post_id': 4, 'contact_id': 11, 'place_id': 101, 'role_id': 1000}],
+            deleted_posts=[{'post_id': 3}],
+            deleted_contacts=[{'id': 10}],
+        )
+
+        self.index.refresh(api, since=since)
+
+        api.get_deleted_posts.assert_called_once_with(
+            diocese_id=None, search_params=None, start_date=since, limit=1000
+        )
+        self.assertEqual(self.post_ids(self.index.posts_for_contact(11)), [4])
+        self.assertNotIn(10, self.index.contacts)
+        self.assertEqual(self.index.assignments(contact_id=11)[0].role, ROLES[0])
@@ -0,0 +1,89 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from cofecms.pipeline import Pipeline
+from tests.utils import mock_result
+
+
+def is_even(number):
+    return number % 2 == 0
+
+
+class PipelineTest(TestCase):
+
+    def test_from_result(self):
+        result = mock_result([1, 2], [3])
+        pipeline = Pipeline.from_result(result, workers=4)
+
+        self.assertEqual(list(pipeline), [1, 2, 3])
+        result.pages_generator.assert_called_once_with(workers=4)
+
+    def test_map_filter_batch(self):
+        pipeline = Pipeline(range(10)).filter(is_even).map(lambda number: number * 10).batch(2)
+
+        self.assertEqual(list(pipeline), [[0, 20], [40, 60], [80]])
+        self.assertEqual(
+            [(stats.name, stats.items_in, stats.items_out) for stats in pipeline.stats],
+            [('source', 10, 10), ('is_even', 10, 5), ('map', 5, 5), ('batch', 5, 3)],
+        )
+
+    def test_workers(self):
+        threads = set()
+
+        def slow_double(number):
+            threads.add(threading.current_thread())
+            time.sleep(0.001 * (number % 3))
+            return number * 2
+
+        pipeline = Pipeline(range(50)).map(slow_double, workers=4).filter(is_even, workers=2)
+
+        self.assertEqual(list(pipeline), [number * 2 for number in range(50)])
+        self.assertGreater(len(threads), 1)
+        self.assertGreater(pipeline.stats[1].seconds, 0)
+
+    def test_backpressure(self):
+        pulled = []
+
+        def source():
+            for number in range(100):
+                pulled.append(number)
+                yield number
+
+        items = iter(Pipeline(source()).map(str, workers=2, buffer=4))
+        self.assertEqual(next(items), '0')
+        self.assertEqual(len(pulled), 4)
+        items.close()
+
+    def test_run(self):
+        sink = mock.Mock(spec=['write_batch'])
+        pipeline = Pipeline(range(5)).map(str)
+
+        self.assertEqual(pipeline.run(sink, batch_size=2), 5)
+        self.assertEqual(sink.write_batch.call_args_list, [
+            mock.call(['0', '1']), mock.call(['2', '3']), mock.call(['4'])
+        ])
+        self.assertEqual(pipeline.stats[-1].name, 'sink')
+        self.assertEqual(pipeline.stats[-1].items_out, 5)
+
+        with self.assertRaises(RuntimeError):
+            pipeline.run(sink)
+
+    def test_run__callable(self):
+        batches = []
+        pipeline = Pipeline(range(5)).batch(3)
+
+        self.assertEqual(pipeline.run(batches.append), 5)
+        self.assertEqual(batches, [[0, 1, 2], [3, 4]])
+        self.assertEqual(Pipeline(range(5)).run(), 5)
+
+    def test_error(self):
+        def fail(number):
+            if number == 3:
+                raise ValueError('wibble')
+            return number
+
+        with self.assertRaises(ValueError):
+            Pipeline(range(10)).map(fail, workers=2).run()
+        with self.assertRaises(ValueError):
+            Pipeline(range(10)).batch(0)
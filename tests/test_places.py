@@ -0,0 +1,118 @@
+import datetime
+from unittest import TestCase, mock
+
+from cofecms.api import (
+    PLACE_TYPE_CHURCH, PLACE_TYPE_DEANERY, PLACE_TYPE_DIOCESE, PLACE_TYPE_PARISH
+)
+from cofecms.places import PlaceHierarchy
+from tests.utils import mock_result
+
+PLACES = [
+    {'id': 1, 'parent_id': None, 'place_type_id': PLACE_TYPE_DIOCESE},
+    {'id': 2, 'parent_id': 1, 'place_type_id': PLACE_TYPE_DEANERY},
+    {'id': 3, 'parent_id': 2, 'place_type_id': PLACE_TYPE_PARISH},
+    {'id': 4, 'parent_id': 3, 'place_type_id': PLACE_TYPE_CHURCH},
+    {'id': 5, 'parent_id': 3, 'place_type_id': PLACE_TYPE_CHURCH},
+    {'id': 6, 'parent_id': 1, 'place_type_id': PLACE_TYPE_DEANERY},
+]
+
+
+class PlaceHierarchyTest(TestCase):
+
+    def setUp(self):
+        self.hierarchy = PlaceHierarchy(PLACES)
+
+    def ids(self, places):
+        return sorted(place['id'] for place in places)
+
+    def test_lookups(self):
+        self.assertEqual(len(self.hierarchy), 6)
+        self.assertIn(4, self.hierarchy)
+        self.assertEqual(self.hierarchy.get(4), PLACES[3])
+        self.assertIsNone(self.hierarchy.get(99))
+        self.assertEqual(self.hierarchy.parent(4), PLACES[2])
+        self.assertIsNone(self.hierarchy.parent(1))
+        self.assertEqual(self.ids(self.hierarchy.children(1)), [2, 6])
+        self.assertEqual(
+            self.ids(self.hierarchy.children(3, place_type=PLACE_TYPE_CHURCH)), [4, 5]
+        )
+        self.assertEqual(self.hierarchy.children(4), [])
+        self.assertEqual(self.ids(self.hierarchy.roots()), [1])
+        self.assertEqual(self.ids(self.hierarchy.of_type(PLACE_TYPE_DEANERY)), [2, 6])
+
+    def test_descendants(self):
+        self.assertEqual(self.ids(self.hierarchy.descendants(1)), [2, 3, 4, 5, 6])
+        self.assertEqual(
+            self.ids(self.hierarchy.descendants(2, place_type=PLACE_TYPE_CHURCH)), [4, 5]
+        )
+        self.assertEqual(list(self.hierarchy.descendants(6)), [])
+
+    def test_ancestors(self):
+        self.assertEqual([place['id'] for place in self.hierarchy.ancestors(4)], [3, 2, 1])
+        self.assertEqual([place['id'] for place in self.hierarchy.path(4)], [1, 2, 3, 4])
+        self.assertEqual(self.hierarchy.path(99), [])
+        self.assertEqual(self.hierarchy.ancestor_of_type(4, PLACE_TYPE_DEANERY), PLACES[1])
+        self.assertIsNone(self.hierarchy.ancestor_of_type(4, PLACE_TYPE_CHURCH))
+
+    def test_cycle(self):
+        hierarchy = PlaceHierarchy([{'id': 1, 'parent_id': 2}, {'id': 2, 'parent_id': 1}])
+        self.assertEqual([place['id'] for place in hierarchy.ancestors(1)], [2])
+        self.assertEqual([place['id'] for place in hierarchy.descendants(1)], [2])
+
+    def test_move_and_remove(self):
+        self.hierarchy.add({'id': 3, 'parent_id': 6, 'place_type_id': PLACE_TYPE_PARISH})
+        self.assertEqual(self.ids(self.hierarchy.children(2)), [])
+        self.assertEqual(self.ids(self.hierarchy.children(6)), [3])
+        self.assertEqual(self.ids(self.hierarchy.descendants(6)), [3, 4, 5])
+
+        self.hierarchy.remove(3)
+        self.hierarchy.remove(99)
+        self.assertNotIn(3, self.hierarchy)
+        self.assertEqual(self.hierarchy.children(6), [])
+        self.assertIsNone(self.hierarchy.parent(4))
+        self.assertEqual(self.ids(self.hierarchy.roots()), [1, 4, 5])
+
+    def test_field_names(self):
+        hierarchy = PlaceHierarchy(
+            [{'place_id': 1}, {'place_id': 2, 'parent': 1, 'type': PLACE_TYPE_CHURCH}],
+            id_field='place_id',
+            parent_field='parent',
+            type_field='type',
+        )
+        self.assertEqual(hierarchy.parent(2), {'place_id': 1})
+        self.assertEqual(len(list(hierarchy.descendants(1, place_type=PLACE_TYPE_CHURCH))), 1)
+
+    def test_from_api(self):
+        api = mock.Mock()
+        api.get_places.return_value = mock_result(PLACES[:3], PLACES[3:])
+
+        hierarchy = PlaceHierarchy.from_api(api, diocese_id=123, workers=2)
+
+        self.assertEqual(len(hierarchy), 6)
+        self.assertIsNotNone(hierarchy.updated_at)
+        api.get_places.assert_called_once_with(
+            diocese_id=123, search_params=None, start_date=None, limit=1000
+        )
+        api.get_places.return_value.pages_generator.assert_called_once_with(workers=2)
+        api.get_deleted_places.assert_not_called()
+
+    def test_refresh(self):
+        since = datetime.datetime(2020, 1, 1)
+        self.hierarchy.updated_at = since
+        api = mock.Mock()
+        api.get_places.return_value = mock_result(
+            [{'id': 7, 'parent_id': 6, 'place_type_id': PLACE_TYPE_PARISH}]
+        )
+        api.get_deleted_places.return_value = mock_result([{'id': 5}])
+
+        self.assertEqual(self.hierarchy.refresh(api), (1, 1))
+
+        api.get_places.assert_called_once_with(
+            diocese_id=None, search_params=None, start_date=since, limit=1000
+        )
+        api.get_deleted_places.assert_called_once_with(
+            diocese_id=None, search_params=None, start_date=since, limit=1000
+        )
+        self.assertEqual(self.ids(self.hierarchy.children(6)), [7])
+        self.assertEqual(self.ids(self.hierarchy.children(3)), [4])
+        self.assertGreater(self.hierarchy.updated_at, since)
@@ -0,0 +1,202 @@
+from unittest import TestCase, mock
+
+import cofecms
+from cofecms.api import CofeCMS, CofeCMSResult, ContactData
+from cofecms.privacy import (
+    PrivacyFilter, PrivacyProjection, privacy_key_map, redact, request_fields, schema_field_names
+)
+
+RAW_CONTACT_DATA = {
+    'wibble': 'wobble',  # No privacy settings
+    'public': 'a',
+    'public_privacy_setting': cofecms.PRIVACY_SETTING_PUBLIC,
+    'diocese': 'b',
+    'diocese_privacy_setting': cofecms.PRIVACY_SETTING_DIOCESE_ONLY,
+    'private': 'c',
+    'private_privacy_setting': cofecms.PRIVACY_SETTING_PRIVATE,
+}
+
+
+class PrivacyKeyMapTest(TestCase):
+
+    def test_privacy_key_map(self):
+        self.assertEqual(
+            privacy_key_map(RAW_CONTACT_DATA.keys()), (
+                ('diocese', 'diocese_privacy_setting'),
+                ('private', 'private_privacy_setting'),
+                ('public', 'public_privacy_setting'),
+            )
+        )
+        self.assertEqual(privacy_key_map(['wibble']), ())
+
+
+class PrivacyFilterTest(TestCase):
+
+    def test_redact(self):
+        privacy_filter = PrivacyFilter()
+        redacted = privacy_filter.redact(RAW_CONTACT_DATA)
+
+        self.assertEqual(redacted['wibble'], 'wobble')
+        self.assertEqual(redacted['public'], 'a')
+        self.assertEqual(redacted['diocese'], None)
+        self.assertEqual(redacted['private'], None)
+        self.assertEqual(RAW_CONTACT_DATA['private'], 'c')
+
+    def test_matches_contact_data(self):
+        records = [
+            RAW_CONTACT_DATA,
+            dict(RAW_CONTACT_DATA, private_privacy_setting=cofecms.PRIVACY_SETTING_PUBLIC),
+            {'wibble': 'wobble'},
+        ]
+        for max_access_level in (
+                cofecms.PRIVACY_SETTING_PUBLIC,
+                cofecms.PRIVACY_SETTING_DIOCESE_ONLY,
+                cofecms.PRIVACY_SETTING_PRIVATE,
+        ):
+            redacted = PrivacyFilter(max_access_level).records(records)
+            for record, redacted_record in zip(records, redacted):
+                contact_data = ContactData(record, max_access_level=max_access_level)
+                self.assertEqual(
+                    redacted_record, dict((key, contact_data[key]) for key in record)
+                )
+
+    def test_key_maps_cached(self):
+        privacy_filter = PrivacyFilter()
+        list(privacy_filter.records([RAW_CONTACT_DATA, RAW_CONTACT_DATA, {'wibble': 'wobble'}]))
+        self.assertEqual(len(privacy_filter._key_maps), 2)
+
+    def test_columns(self):
+        records = [
+            {'id': 1, 'email': 'a@example.com', 'email_privacy_setting': 0},
+            {'id': 2, 'email': 'b@example.com', 'email_privacy_setting': 2},
+            {'id': 3},
+        ]
+        columns = PrivacyFilter(cofecms.PRIVACY_SETTING_DIOCESE_ONLY).columns(records)
+
+        self.assertEqual(list(columns.keys()), ['id', 'email', 'email_privacy_setting'])
+        self.assertEqual(columns['id'], [1, 2, 3])
+        self.assertEqual(columns['email'], ['a@example.com', None, None])
+        self.assertEqual(columns['email_privacy_setting'], [0, 2, None])
+
+        self.assertEqual(PrivacyFilter().columns([]), {})
+
+    def test_redact_result(self):
+        result = CofeCMSResult([RAW_CONTACT_DATA, RAW_CONTACT_DATA])
+        redacted = redact(result, max_access_level=cofecms.PRIVACY_SETTING_PRIVATE)
+        self.assertEqual(redacted, [RAW_CONTACT_DATA, RAW_CONTACT_DATA])
+
+
+class SchemaFieldNamesTest(TestCase):
+
+    def test_schema_field_names(self):
+        self.assertEqual(
+            schema_field_names([{
+                'contact': ['id', 'email', 'email_privacy_setting'],
+                'role': {'role_id': {}},
+            }]),
+            ['id', 'email', 'email_privacy_setting', 'role_id'],
+        )
+        self.assertEqual(schema_field_names({'contact': ['id', 'id']}), ['id'])
+        self.assertEqual(schema_field_names(['id', 'surname']), ['id', 'surname'])
+
+
+class PrivacyProjectionTest(TestCase):
+
+    def setUp(self):
+        self.projection = PrivacyProjection(RAW_CONTACT_DATA.keys())
+
+    def test_for_access_level(self):
+        for max_access_level in (
+                cofecms.PRIVACY_SETTING_PUBLIC,
+                cofecms.PRIVACY_SETTING_DIOCESE_ONLY,
+                cofecms.PRIVACY_SETTING_PRIVATE,
+        ):
+            projected = self.projection.for_access_level(max_access_level)(RAW_CONTACT_DATA)
+            contact_data = ContactData(RAW_CONTACT_DATA, max_access_level=max_access_level)
+            fields = ('wibble', 'public', 'diocese', 'private')
+            self.assertEqual(projected, dict((key, contact_data[key]) for key in fields))
+
+    def test_cached(self):
+        self.assertIs(
+            self.projection.for_access_level(cofecms.PRIVACY_SETTING_PUBLIC),
+            self.projection.for_access_level(cofecms.PRIVACY_SETTING_PUBLIC),
+        )
+
+    def test_missing_fields(self):
+        public = self.projection.for_access_level(cofecms.PRIVACY_SETTING_PUBLIC)
+        self.assertEqual(
+            public({'private': 'c'}),
+            {'wibble': None, 'public': None, 'diocese': None, 'private': 'c'},
+        )
+
+    def test_include_privacy_settings(self):
+        projection = PrivacyProjection(RAW_CONTACT_DATA.keys(), include_privacy_settings=True)
+        projected = projection.for_access_level()(RAW_CONTACT_DATA)
+        self.assertEqual(projected['private_privacy_setting'], cofecms.PRIVACY_SETTING_PRIVATE)
+        self.assertEqual(projected['private'], None)
+
+    def test_many(self):
+        public = self.projection.for_access_level(cofecms.PRIVACY_SETTING_PUBLIC)
+        self.assertEqual(public.many([RAW_CONTACT_DATA] * 2)[1]['public'], 'a')
+
+    def test_from_api(self):
+        api = mock.Mock(spec=CofeCMS)
+        api.get_contact_fields.return_value = CofeCMSResult([{'contact': ['id', 'surname']}])
+
+        projection = PrivacyProjection.from_api(api, diocese_id=123)
+
+        self.assertEqual(projection.field_names, ('id', 'surname'))
+        api.get_contact_fields.assert_called_once_with(diocese_id=123)
+
+
+class RequestFieldsTest(TestCase):
+
+    def setUp(self):
+        self.schema = CofeCMSResult([{
+            'contact': [
+                'id', 'surname', 'email', 'email_privacy_setting', 'mobile',
+                'mobile_privacy_setting'
+            ],
+            'place': ['place_id', 'name'],
+        }])
+
+    def test_public(self):
+        self.assertEqual(
+            request_fields(self.schema), {
+                'contact': [
+                    'id', 'surname', 'email', 'email_privacy_setting', 'mobile',
+                    'mobile_privacy_setting'
+                ],
+                'place': ['place_id', 'name'],
+            }
+        )
+
+    def test_private(self):
+        self.assertEqual(
+            request_fields(self.schema, max_access_level=cofecms.PRIVACY_SETTING_PRIVATE), {
+                'contact': ['id', 'surname', 'email', 'mobile'],
+                'place': ['place_id', 'name'],
+            }
+        )
+
+    def test_wanted(self):
+        self.assertEqual(
+            request_fields(self.schema, wanted=['surname', 'email']),
+            {'contact': ['surname', 'email', 'email_privacy_setting']},
+        )
+        self.assertEqual(
+            request_fields(
+                self.schema,
+                max_access_level=cofecms.PRIVACY_SETTING_DIOCESE_ONLY,
+                wanted={'contact': ['mobile'], 'place': ['name']},
+            ),
+            {'contact': ['mobile', 'mobile_privacy_setting'], 'place': ['name']},
+        )
+
+    def test_used_for_request(self):
+        fields = request_fields(self.schema, wanted=['surname'])
+        cofecms_api = CofeCMS(api_id='test_api_id', api_key='test_api_key')
+        self.assertEqual(
+            cofecms_api._prepare_basic_params({'fields': fields}),
+            {'fields': '{"contact": ["surname"]}'},
+        )
@@ -0,0 +1,64 @@
+import json
+from unittest import TestCase, mock
+
+import requests
+
+from cofecms.api import CofeCMS
+from cofecms.privacy import PrivacyFilter, PrivacyProjection
+from cofecms.records import CompactRecord, compact_records
+
+
+class CompactRecordTest(TestCase):
+
+    def setUp(self):
+        self.view = CompactRecord({'id': 0, 'surname': 1}, (123, 'Smith'))
+
+    def test_mapping(self):
+        self.assertEqual(self.view['surname'], 'Smith')
+        self.assertEqual(self.view.get('surname'), 'Smith')
+        self.assertEqual(self.view.get('wibble', 'wobble'), 'wobble')
+        self.assertIn('id', self.view)
+        self.assertNotIn('wibble', self.view)
+        self.assertEqual(list(self.view), ['id', 'surname'])
+        self.assertEqual(len(self.view), 2)
+        self.assertEqual(self.view, {'id': 123, 'surname': 'Smith'})
+        with self.assertRaises(KeyError):
+            self.view['wibble']
+
+    def test_to_dict(self):
+        self.assertEqual(self.view.to_dict(), {'id': 123, 'surname': 'Smith'})
+        self.assertEqual(json.dumps(self.view.to_dict(), sort_keys=True), json.dumps(
+            {'id': 123, 'surname': 'Smith'}, sort_keys=True
+        ))
+
+    def test_works_with_privacy(self):
+        view = CompactRecord(
+            {'email': 0, 'email_privacy_setting': 1}, ('a@example.com', 2)
+        )
+        self.assertEqual(PrivacyFilter().redact(view)['email'], None)
+        projection = PrivacyProjection(['email', 'email_privacy_setting'])
+        self.assertEqual(projection.for_access_level()(view), {'email': None})
+
+
+class CompactRecordsTest(TestCase):
+
+    def test_compact_records(self):
+        views = compact_records([{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, 'wibble'])
+
+        self.assertEqual(views, [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, 'wibble'])
+        self.assertIsInstance(views[0], CompactRecord)
+        self.assertIs(views[0]._index, views[1]._index)
+
+    def test_client_compact_records(self):
+        cofecms = CofeCMS(
+            api_id='test_api_id', api_key='test_api_key', diocese_id=123, compact_records=True
+        )
+        mock_response = mock.Mock(spec=requests.Response)
+        mock_response.headers = {}
+        mock_response.json.return_value = [{'id': 1}, {'id': 2}]
+        cofecms.do_request = mock.Mock(spec=cofecms.do_request, return_value=mock_response)
+
+        result = cofecms.get('https://cmsapi.cofeportal.org/v2/contacts')
+
+        self.assertEqual(result, [{'id': 1}, {'id': 2}])
+        self.assertIsInstance(result[0], CompactRecord)
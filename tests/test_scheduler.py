@@ -0,0 +1,167 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+import httpretty
+
+from cofecms.api import CofeCMS
+from cofecms.scheduler import (
+    PRIORITY_BULK, PRIORITY_INTERACTIVE, RequestScheduler, classify_request, with_current_priority
+)
+
+
+class ClassifyRequestTest(TestCase):
+
+    def test_classify_request(self):
+        self.assertEqual(classify_request('url', {'offset': 0}), PRIORITY_INTERACTIVE)
+        self.assertEqual(classify_request('url', {}), PRIORITY_INTERACTIVE)
+        self.assertEqual(classify_request('url', {'offset': 1000}), PRIORITY_BULK)
+
+
+class RequestSchedulerTest(TestCase):
+
+    def run_waiting(self, scheduler, priorities):
+        # Queue a request for each priority while the only slot is taken, then let them through
+        # one at a time and return the order they were sent in
+        order = []
+
+        def request(priority):
+            with scheduler.priority(priority):
+                order.append(scheduler.acquire('url', {}))
+            scheduler.release()
+
+        with scheduler.priority('setup'):
+            scheduler.acquire('url', {})
+        threads = []
+        for count, priority in enumerate(priorities, 1):
+            thread = threading.Thread(target=request, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            while sum(len(queue) for queue in scheduler._queues.values()) < count:
+                time.sleep(0.001)
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+        return order
+
+    def test_interactive_first(self):
+        scheduler = RequestScheduler(max_concurrent=1)
+        order = self.run_waiting(scheduler, [PRIORITY_BULK] * 3 + [PRIORITY_INTERACTIVE])
+
+        self.assertEqual(order, [PRIORITY_INTERACTIVE] + [PRIORITY_BULK] * 3)
+        self.assertEqual(scheduler.stats[PRIORITY_BULK], 3)
+        self.assertEqual(scheduler.stats['waited'], 4)
+
+    def test_fair_queuing(self):
+        scheduler = RequestScheduler(max_concurrent=1, weights={PRIORITY_INTERACTIVE: 2})
+        order = self.run_waiting(scheduler, [PRIORITY_BULK] * 4 + [PRIORITY_INTERACTIVE] * 4)
+
+        i, b = PRIORITY_INTERACTIVE, PRIORITY_BULK
+        self.assertEqual(order, [i, b, i, i, b, i, b, b])
+
+    def test_interrupted_wait(self):
+        scheduler = RequestScheduler(max_concurrent=1)
+        scheduler.acquire('url', {})
+        with mock.patch.object(scheduler._condition, 'wait', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                scheduler.acquire('url', {})
+        self.assertFalse(any(scheduler._queues.values()))
+
+        scheduler.release()
+        self.assertEqual(scheduler.acquire('url', {}), PRIORITY_INTERACTIVE)
+
+    def test_acquire__timeout(self):
+        scheduler = RequestScheduler(max_concurrent=1)
+        scheduler.acquire('url', {})
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            scheduler.acquire('url', {}, timeout=0.05)
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertFalse(any(scheduler._queues.values()))
+
+    def test_with_current_priority(self):
+        scheduler = RequestScheduler()
+        priorities = []
+
+        def request():
+            priorities.append(scheduler.acquire('url', {'offset': 100}))
+            scheduler.release()
+
+        with scheduler.priority(PRIORITY_INTERACTIVE):
+            thread = threading.Thread(target=with_current_priority(request))
+            thread.start()
+            thread.join()
+            # Without it, the thread doesn't know about the priority
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+        request()
+
+        self.assertEqual(priorities, [PRIORITY_INTERACTIVE, PRIORITY_BULK, PRIORITY_BULK])
+
+    def test_rate_limit_reserve(self):
+        scheduler = RequestScheduler(reserve=0.1, backoff=0.2)
+        scheduler.acquire('url', {})
+        scheduler.release({'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '5'})
+        self.assertEqual(scheduler.rate_limit_remaining, 5)
+
+        started = time.monotonic()
+        scheduler.acquire('url', {})
+        scheduler.release()
+        self.assertLess(time.monotonic() - started, 0.1)
+
+        scheduler.acquire('url', {'offset': 100})
+        scheduler.release({'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '4'})
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+        # Once the rate limit is reset, bulk requests aren't held back
+        scheduler.acquire('url', {})
+        scheduler.release({'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '99'})
+        started = time.monotonic()
+        scheduler.acquire('url', {'offset': 100})
+        scheduler.release()
+        self.assertLess(time.monotonic() - started, 0.1)
+
+    @httpretty.activate
+    def test_client(self):
+        httpretty.register_uri(
+            httpretty.GET,
+            'https://cmsapi.cofeportal.org/v2/roles',
+            body='[]',
+            adding_headers={'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '50'},
+        )
+        scheduler = RequestScheduler()
+        cofe = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                       scheduler=scheduler)
+
+        cofe.get_roles()
+
+        self.assertEqual(scheduler.stats[PRIORITY_INTERACTIVE], 1)
+        self.assertEqual(scheduler.rate_limit_remaining, 50)
+        self.assertEqual(scheduler._in_flight, 0)
+
+    def test_client__error(self):
+        scheduler = RequestScheduler()
+        transport = mock.Mock()
+        transport.get.side_effect = IOError
+        cofe = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                       transport=transport, scheduler=scheduler)
+
+        with self.assertRaises(IOError):
+            cofe.do_request('url', {})
+        self.assertEqual(scheduler._in_flight, 0)
+
+    def test_client__workers(self):
+        # The priority is kept for pages fetched in worker threads
+        scheduler = RequestScheduler()
+        transport = mock.Mock()
+        transport.get.return_value.headers = {'X-Total-Count': '40'}
+        transport.get.return_value.json.return_value = []
+        cofe = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123,
+                       transport=transport, scheduler=scheduler)
+
+        with scheduler.priority(PRIORITY_INTERACTIVE):
+            cofe.get_contacts(limit=10).all(workers=2)
+
+        self.assertEqual(scheduler.stats[PRIORITY_INTERACTIVE], transport.get.call_count)
+        self.assertEqual(scheduler.stats[PRIORITY_BULK], 0)
@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from cofecms.api import CofeCMS, CofeCMSResult
+from cofecms.schema import InvalidFieldsError, SchemaRegistry, fingerprint
+
+CONTACT_FIELDS = [{'contact': ['id', 'forenames', 'surname', 'email', 'email_privacy_setting']}]
+POST_FIELDS = [{'post': ['post_id', 'role_id'], 'contact': ['id', 'surname']}]
+PLACE_FIELDS = [{'place': ['id', 'name', 'parent_id']}]
+
+
+class SchemaRegistryTest(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+        self.cofecms = CofeCMS(api_id='test_api_id', api_key='test_api_key', diocese_id=123)
+        self.cofecms.get_contact_fields = mock.Mock(
+            spec=self.cofecms.get_contact_fields, return_value=CofeCMSResult(CONTACT_FIELDS)
+        )
+        self.cofecms.get_post_fields = mock.Mock(
+            spec=self.cofecms.get_post_fields, return_value=CofeCMSResult(POST_FIELDS)
+        )
+        self.cofecms.get_place_fields = mock.Mock(
+            spec=self.cofecms.get_place_fields, return_value=CofeCMSResult(PLACE_FIELDS)
+        )
+        self.registry = SchemaRegistry(self.cofecms, cache_dir=self.cache_dir)
+
+    def test_get_schema(self):
+        self.assertEqual(self.registry.get_schema('contact'), CONTACT_FIELDS)
+        self.assertEqual(self.registry.get_schema('place'), PLACE_FIELDS)
+        self.assertEqual(
+            self.registry.field_names('post'), ['post_id', 'role_id', 'id', 'surname']
+        )
+
+        # Fetched only once
+        self.registry.get_schema('contact')
+        self.cofecms.get_contact_fields.assert_called_once_with(diocese_id=None)
+
+    def test_disk_cache(self):
+        self.registry.load()
+        path = os.path.join(self.cache_dir, 'cofecms-schema-123.json')
+        with open(path) as f:
+            cached = json.load(f)
+        self.assertEqual(cached['fingerprint'], self.registry.fingerprint)
+        self.assertEqual(cached['schemas']['contact'], CONTACT_FIELDS)
+
+        registry = SchemaRegistry(self.cofecms, cache_dir=self.cache_dir)
+        self.assertEqual(registry.get_schema('contact'), CONTACT_FIELDS)
+        self.assertEqual(registry.fingerprint, self.registry.fingerprint)
+        self.assertEqual(self.cofecms.get_contact_fields.call_count, 1)
+
+    def test_disk_cache__stale(self):
+        self.registry.load()
+
+        registry = SchemaRegistry(self.cofecms, cache_dir=self.cache_dir, max_age=60)
+        with mock.patch('cofecms.schema.time.time', return_value=time.time() + 120):
+            registry.load()
+        self.assertEqual(self.cofecms.get_contact_fields.call_count, 2)
+
+    def test_disk_cache__tampered(self):
+        self.registry.load()
+        path = os.path.join(self.cache_dir, 'cofecms-schema-123.json')
+        with open(path) as f:
+            cached = json.load(f)
+        cached['schemas']['contact'] = [{'contact': ['wibble']}]
+        with open(path, 'w') as f:
+            json.dump(cached, f)
+
+        registry = SchemaRegistry(self.cofecms, cache_dir=self.cache_dir)
+        self.assertEqual(registry.get_schema('contact'), CONTACT_FIELDS)
+
+    def test_refresh(self):
+        self.registry.load()
+        self.assertFalse(self.registry.refresh())
+
+        self.cofecms.get_place_fields.return_value = CofeCMSResult([{'place': ['id']}])
+        old_fingerprint = self.registry.fingerprint
+        self.assertTrue(self.registry.refresh())
+        self.assertNotEqual(self.registry.fingerprint, old_fingerprint)
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint({'a': [1], 'b': [2]}), fingerprint({'b': [2], 'a': [1]}))
+        self.assertNotEqual(fingerprint({'a': [1]}), fingerprint({'a': [2]}))
+
+    def test_validate(self):
+        self.registry.validate('contact', {'contact': ['forenames', 'surname']})
+
+        with self.assertRaises(InvalidFieldsError) as cm:
+            self.registry.validate('contact', {'contact': ['surnmae'], 'wibble': ['id']})
+        self.assertEqual(cm.exception.invalid_fields, ['contact.surnmae', 'wibble'])
+        self.assertIn('did you mean "surname"', str(cm.exception))
+
+    def test_validate__list(self):
+        self.registry.validate('contact', ['forenames', 'surname'])
+
+        with self.assertRaises(InvalidFieldsError) as cm:
+            self.registry.validate('contact', ['forenames', 'surnmae'])
+        self.assertEqual(cm.exception.invalid_fields, ['surnmae'])
+        self.assertIn('did you mean "surname"', str(cm.exception))
+
+    def test_client_validates_fields(self):
+        self.cofecms.schema_registry = self.registry
+        self.cofecms.do_request = mock.Mock(spec=self.cofecms.do_request)
+
+        with self.assertRaises(InvalidFieldsError):
+            self.cofecms.get_contacts(fields={'contact': ['surnmae']})
+        with self.assertRaises(InvalidFieldsError):
+            self.cofecms.get_deleted_places(fields={'place': ['title']})
+        with self.assertRaises(InvalidFieldsError):
+            self.cofecms.get_contacts(fields=['forenames', 'surnmae'])
+        self.cofecms.do_request.assert_not_called()
+
+        self.cofecms.do_request.return_value.headers = {'X-Total-Count': '0'}
+        self.cofecms.do_request.return_value.json.return_value = []
+        self.cofecms.get_contacts(fields=['forenames', 'surname'])
+        self.cofecms.do_request.assert_called_once()
+
+    def test_client_argument(self):
+        registry = SchemaRegistry(cache_dir=self.cache_dir)
+        cofecms = CofeCMS(
+            api_id='test_api_id', api_key='test_api_key', diocese_id=123, schema_registry=registry
+        )
+        self.assertIs(cofecms.schema_registry, registry)
+        self.assertIs(registry.api, cofecms)
+
+        # A registry using another client keeps it
+        cofecms = CofeCMS(
+            api_id='test_api_id', api_key='test_api_key', schema_registry=self.registry
+        )
+        self.assertIs(self.registry.api, self.cofecms)
+
+    def test_projection(self):
+        projection = self.registry.projection('contact')
+        self.assertIs(self.registry.projection('contact'), projection)
+        self.assertEqual(
+            projection.for_access_level()({'id': 1, 'email': 'a', 'email_privacy_setting': 2}),
+            {'id': 1, 'forenames': None, 'surname': None, 'email': None},
+        )
+
+    def test_columns(self):
+        columns = self.registry.columns('place', [{'id': 1, 'name': 'a'}, {'id': 2, 'extra': 'b'}])
+        self.assertEqual(
+            columns, {'id': [1, 2], 'name': ['a', None], 'parent_id': [None, None]}
+        )
+        self.assertEqual(list(columns.keys()), ['id', 'name', 'parent_id'])
@@ -0,0 +1,112 @@
+import datetime
+from unittest import TestCase, mock
+
+from cofecms.api import PRIVACY_SETTING_DIOCESE_ONLY, PRIVACY_SETTING_PRIVATE
+from cofecms.joins import JoinIndex
+from cofecms.search import ContactSearchIndex, tokenize, trigrams
+from tests.utils import mock_result
+
+CONTACTS = [
+    {'id': 1, 'forenames': 'John', 'surname': 'Smith', 'email': 'john@example.org',
+     'email_privacy_setting': PRIVACY_SETTING_PRIVATE},
+    {'id': 2, 'forenames': 'Joanna', 'surname': 'Smithson', 'email': 'jo@example.org',
+     'email_privacy_setting': PRIVACY_SETTING_DIOCESE_ONLY},
+    {'id': 3, 'forenames': 'Zoë', 'surname': 'Jones', 'email': None,
+     'email_privacy_setting': PRIVACY_SETTING_PRIVATE},
+]
+
+
+class TokenizeTest(TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Zoë  Aynsley-Smith'), ['zoe', 'aynsley', 'smith'])
+        self.assertEqual(tokenize(123), ['123'])
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams('jo'), {'^jo', 'jo$'})
+
+
+class ContactSearchIndexTest(TestCase):
+
+    def setUp(self):
+        self.index = ContactSearchIndex()
+        for contact in CONTACTS:
+            self.index.add(contact)
+
+    def ids(self, contacts):
+        return [contact['id'] for contact in contacts]
+
+    def test_prefix(self):
+        self.assertEqual(self.ids(self.index.search('smith')), [1, 2])
+        self.assertEqual(self.ids(self.index.search('jo smi')), [1, 2])
+        self.assertEqual(self.ids(self.index.search('smithson')), [2])
+        self.assertEqual(self.ids(self.index.search('zoe')), [3])
+        self.assertEqual(self.ids(self.index.search('SMITH', limit=1)), [1])
+
+    def test_no_matches(self):
+        self.assertEqual(self.index.search(''), [])
+        self.assertEqual(self.index.search('smith wibble'), [])
+
+    def test_fuzzy(self):
+        self.assertEqual(self.ids(self.index.search('jnoes')), [])
+        self.assertEqual(self.ids(self.index.search('joness')), [3])
+        self.assertEqual(self.index.search('joness', fuzzy=False), [])
+
+    def test_privacy(self):
+        self.assertEqual(self.index.search('example'), [])
+        self.assertIsNone(self.index.search('john')[0]['email'])
+
+        index = ContactSearchIndex(max_access_level=PRIVACY_SETTING_DIOCESE_ONLY)
+        for contact in CONTACTS:
+            index.add(contact)
+        self.assertEqual(self.ids(index.search('example')), [2])
+
+    def test_update_and_remove(self):
+        self.index.add({'id': 1, 'forenames': 'Jack', 'surname': 'Brown'})
+        self.assertEqual(self.ids(self.index.search('smith')), [2])
+        self.assertEqual(self.ids(self.index.search('brown')), [1])
+        self.assertNotIn('john', self.index._postings)
+
+        self.index.remove(1)
+        self.index.remove(99)
+        self.assertEqual(self.index.search('brown'), [])
+        self.assertEqual(len(self.index), 2)
+        self.assertFalse(any('brown' in tokens for tokens in self.index._trigrams.values()))
+
+    def test_extra_text(self):
+        self.index.add({'id': 4, 'surname': 'Green'}, extra_text=['St Mary'])
+        self.assertEqual(self.ids(self.index.search('mary')), [4])
+
+    def test_join_index(self):
+        join_index = JoinIndex()
+        join_index.add_post({'post_id': 1, 'contact_id': 1, 'place_id': 10, 'role_id': 20})
+        join_index.add_place({'id': 10, 'name': 'St Mary, Coventry'})
+        join_index.add_role({'id': 20, 'name': 'Churchwarden'})
+
+        index = ContactSearchIndex(join_index=join_index)
+        for contact in CONTACTS:
+            index.add(contact)
+        self.assertEqual(self.ids(index.search('churchwarden coventry')), [1])
+
+    def test_refresh(self):
+        since = datetime.datetime(2020, 1, 1)
+        api = mock.Mock()
+        api.get_contacts.return_value = mock_result([{'id': 4, 'surname': 'Green'}])
+        api.get_deleted_contacts.return_value = mock_result([{'id': 3}])
+
+        self.index.refresh(api, since=since)
+
+        api.get_contacts.assert_called_once_with(
+            diocese_id=None, search_params=None, start_date=since, limit=1000
+        )
+        self.assertEqual(self.ids(self.index.search('green')), [4])
+        self.assertEqual(self.index.search('jones'), [])
+
+    def test_from_api(self):
+        api = mock.Mock()
+        api.get_contacts.return_value = mock_result(CONTACTS)
+
+        index = ContactSearchIndex.from_api(api)
+
+        self.assertEqual(len(index), 3)
+        api.get_deleted_contacts.assert_not_called()
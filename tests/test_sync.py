@@ -0,0 +1,42 @@
+import datetime
+from unittest import TestCase, mock
+
+from cofecms.sync import fetch_changes
+from tests.utils import mock_result
+
+
+class FetchChangesTest(TestCase):
+
+    def setUp(self):
+        self.api = mock.Mock()
+        self.api.get_contacts.return_value = mock_result([{'id': 1}, {'id': 2}], [{'id': 3}])
+        self.api.get_deleted_contacts.return_value = mock_result([{'id': 4}])
+        self.updated = []
+        self.deleted = []
+
+    def test_everything(self):
+        counts = fetch_changes(
+            self.api, 'contacts', None, self.updated.append, self.deleted.append, diocese_id=123,
+            workers=2
+        )
+
+        self.assertEqual(counts, (3, 0))
+        self.assertEqual(self.updated, [{'id': 1}, {'id': 2}, {'id': 3}])
+        self.api.get_contacts.assert_called_once_with(
+            diocese_id=123, search_params=None, start_date=None, limit=1000
+        )
+        self.api.get_contacts.return_value.pages_generator.assert_called_once_with(workers=2)
+        self.api.get_deleted_contacts.assert_not_called()
+
+    def test_since(self):
+        since = datetime.datetime(2020, 1, 1)
+        counts = fetch_changes(
+            self.api, 'contacts', since, self.updated.append, self.deleted.append,
+            search_params={'postcode': 'CV1'}, limit=10
+        )
+
+        self.assertEqual(counts, (3, 1))
+        self.assertEqual(self.deleted, [{'id': 4}])
+        self.api.get_deleted_contacts.assert_called_once_with(
+            diocese_id=None, search_params={'postcode': 'CV1'}, start_date=since, limit=10
+        )
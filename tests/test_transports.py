@@ -0,0 +1,293 @@
+import os
+import shutil
+import socket
+import tempfile
+import datetime
+from unittest import TestCase, mock, skipUnless
+
+import requests
+import urllib3
+
+from cofecms.api import CofeCMS
+from cofecms.transports import (
+    BaseTransport, CassetteMissError, HttpxTransport, RecordingTransport, ReplayTransport,
+    RequestsTransport, Response, Urllib3Transport, cassette_key, get_transport
+)
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+class ResponseTest(TestCase):
+
+    def test_response(self):
+        response = Response(
+            url='http://example.com/endpoint',
+            status_code=200,
+            headers={'X-Total-Count': '1'},
+            content=b'[{"wibble": "wobble"}]',
+            elapsed=0.5,
+        )
+        self.assertEqual(response.headers['x-total-count'], '1')
+        self.assertEqual(response.json(), [{'wibble': 'wobble'}])
+        self.assertEqual(response.elapsed.total_seconds(), 0.5)
+        response.raise_for_status()
+
+    def test_raise_for_status(self):
+        response = Response('http://example.com/endpoint', 401, {}, b'')
+        with self.assertRaises(requests.HTTPError):
+            response.raise_for_status()
+
+
+class RequestsTransportTest(TestCase):
+
+    def test_get(self):
+        mock_session = mock.Mock(spec=requests.Session)
+        transport = RequestsTransport(mock_session)
+
+        result = transport.get('http://example.com/endpoint', {'wibble': 'wobble'})
+
+        self.assertEqual(result, mock_session.get.return_value)
+        mock_session.get.assert_called_once_with(
+            'http://example.com/endpoint', params={'wibble': 'wobble'}
+        )
+
+    def test_get_timeout(self):
+        mock_session = mock.Mock(spec=requests.Session)
+        transport = RequestsTransport(mock_session)
+
+        transport.get('http://example.com/endpoint', {}, timeout=(3, 30))
+
+        mock_session.get.assert_called_once_with(
+            'http://example.com/endpoint', params={}, timeout=(3, 30)
+        )
+
+    def test_pool_maxsize(self):
+        transport = RequestsTransport(pool_maxsize=32)
+        adapter = transport.session.get_adapter('https://cmsapi.cofeportal.org')
+        self.assertEqual(adapter._pool_maxsize, 32)
+
+
+class HttpxTransportTest(TestCase):
+
+    def test_get(self):
+        mock_client = mock.Mock()
+        mock_client.get.return_value = mock.Mock(
+            url='http://example.com/endpoint?wibble=wobble',
+            status_code=200,
+            headers={'X-Total-Count': '1'},
+            content=b'[1]',
+            elapsed=datetime.timedelta(seconds=1),
+        )
+        transport = HttpxTransport(client=mock_client)
+
+        result = transport.get('http://example.com/endpoint', {'wibble': 'wobble'})
+
+        self.assertIsInstance(result, Response)
+        self.assertEqual(result.json(), [1])
+        self.assertEqual(result.headers['x-total-count'], '1')
+        mock_client.get.assert_called_once_with(
+            'http://example.com/endpoint', params={'wibble': 'wobble'}, headers=None
+        )
+
+    @skipUnless(httpx, 'httpx is not installed')
+    def test_get_timeout(self):
+        mock_client = mock.Mock()
+        mock_client.get.return_value = mock.Mock(
+            status_code=200, headers={}, content=b'[]', elapsed=datetime.timedelta(seconds=1)
+        )
+        transport = HttpxTransport(client=mock_client)
+
+        transport.get('http://example.com/endpoint', {}, timeout=(3, 30))
+
+        timeout = mock_client.get.call_args[1]['timeout']
+        self.assertEqual((timeout.connect, timeout.read), (3, 30))
+
+    @skipUnless(httpx, 'httpx is not installed')
+    def test_init(self):
+        transport = HttpxTransport(http2=False)
+        self.assertIsInstance(transport.client, httpx.Client)
+        self.assertEqual(transport.client.timeout, httpx.Timeout(None))
+        transport.close()
+
+
+class Urllib3TransportTest(TestCase):
+
+    def test_get(self):
+        mock_pool_manager = mock.Mock(spec=urllib3.PoolManager)
+        mock_pool_manager.request.return_value = mock.Mock(
+            status=404, headers={'Content-Type': 'application/json'}, data=b'{}'
+        )
+        transport = Urllib3Transport(pool_manager=mock_pool_manager)
+
+        result = transport.get('http://example.com/endpoint', {'wibble': 'wobble'})
+
+        self.assertIsInstance(result, Response)
+        self.assertEqual(result.status_code, 404)
+        with self.assertRaises(requests.HTTPError):
+            result.raise_for_status()
+        mock_pool_manager.request.assert_called_once_with(
+            'GET', 'http://example.com/endpoint', fields={'wibble': 'wobble'}, headers=None
+        )
+
+    def test_get_timeout(self):
+        mock_pool_manager = mock.Mock(spec=urllib3.PoolManager)
+        mock_pool_manager.request.return_value = mock.Mock(status=200, headers={}, data=b'[]')
+        transport = Urllib3Transport(pool_manager=mock_pool_manager)
+
+        transport.get('http://example.com/endpoint', {}, timeout=(3, 30))
+
+        timeout = mock_pool_manager.request.call_args[1]['timeout']
+        self.assertEqual((timeout.connect_timeout, timeout.read_timeout), (3, 30))
+
+    def test_get_headers(self):
+        mock_pool_manager = mock.Mock(spec=urllib3.PoolManager)
+        mock_pool_manager.headers = {'Accept-Encoding': 'gzip'}
+        mock_pool_manager.request.return_value = mock.Mock(status=304, headers={}, data=b'')
+        transport = Urllib3Transport(pool_manager=mock_pool_manager)
+
+        transport.get('http://example.com/endpoint', {}, headers={'If-None-Match': '"abc"'})
+
+        mock_pool_manager.request.assert_called_once_with(
+            'GET', 'http://example.com/endpoint', fields={},
+            headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"abc"'}
+        )
+
+    def test_init(self):
+        transport = Urllib3Transport()
+        retries = transport.pool_manager.connection_pool_kw['retries']
+        # Newer versions of urllib3 turn False into a Retry
+        self.assertIs(getattr(retries, 'total', retries), False)
+
+
+class TransportErrorsTest(TestCase):
+    # Failed requests raise the same requests exceptions with every transport
+
+    def setUp(self):
+        self.transports = [
+            RequestsTransport(),
+            Urllib3Transport(),
+        ]
+        if httpx is not None:
+            self.transports.append(HttpxTransport(http2=False))
+        for transport in self.transports:
+            self.addCleanup(transport.close)
+
+    def test_read_timeout(self):
+        # Connections are queued by the listening socket, but never answered
+        server = socket.socket()
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.listen(8)
+        url = 'http://127.0.0.1:{}/v2/roles'.format(server.getsockname()[1])
+
+        for transport in self.transports:
+            with self.subTest(transport=type(transport).__name__):
+                with self.assertRaises(requests.exceptions.ReadTimeout):
+                    transport.get(url, {}, timeout=0.05)
+
+    def test_connection_error(self):
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:{}/v2/roles'.format(unused.getsockname()[1])
+        unused.close()
+
+        for transport in self.transports:
+            with self.subTest(transport=type(transport).__name__):
+                with self.assertRaises(requests.exceptions.ConnectionError) as cm:
+                    transport.get(url, {}, timeout=1)
+                self.assertNotIsInstance(cm.exception, requests.exceptions.Timeout)
+
+    def test_max_retry_error(self):
+        pool_manager = urllib3.PoolManager(retries=1)
+        transport = Urllib3Transport(pool_manager=pool_manager)
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:{}/v2/roles'.format(unused.getsockname()[1])
+        unused.close()
+
+        with self.assertRaises(requests.exceptions.ConnectionError) as cm:
+            transport.get(url, {}, timeout=1)
+        self.assertIsInstance(cm.exception.__cause__, urllib3.exceptions.MaxRetryError)
+
+
+class GetTransportTest(TestCase):
+
+    def test_get_transport(self):
+        self.assertIsInstance(get_transport('urllib3'), Urllib3Transport)
+        self.assertIsInstance(get_transport('requests'), RequestsTransport)
+        with self.assertRaises(ValueError):
+            get_transport('wibble')
+
+    def test_client_transport_name(self):
+        cofecms = CofeCMS(api_id='test_api_id', api_key='test_api_key', transport='urllib3')
+        self.assertIsInstance(cofecms._get_transport(), Urllib3Transport)
+
+
+class CassetteTest(TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'cassette.jsonl.gz')
+
+        self.inner_transport = mock.Mock(spec=BaseTransport)
+        self.inner_transport.get.side_effect = [
+            Response('http://example.com/endpoint', 200, {'X-Total-Count': '2'}, b'[1]'),
+            Response('http://example.com/endpoint', 200, {'X-Total-Count': '2'}, b'[2]'),
+        ]
+
+    def record(self):
+        transport = RecordingTransport(self.path, transport=self.inner_transport)
+        transport.get('http://example.com/endpoint', {'offset': 0, 'api_id': 'a', 'sig': 'x'})
+        transport.get('http://example.com/endpoint', {'offset': 0, 'api_id': 'a', 'sig': 'x'})
+        transport.close()
+
+    def test_cassette_key(self):
+        self.assertEqual(
+            cassette_key('http://example.com', {'offset': 0, 'api_id': 'a', 'sig': 'x'}),
+            cassette_key('http://example.com', {'sig': 'y', 'api_id': 'b', 'offset': '0'}),
+        )
+        self.assertNotEqual(
+            cassette_key('http://example.com', {'offset': 0}),
+            cassette_key('http://example.com', {'offset': 100}),
+        )
+
+    def test_record_and_replay(self):
+        self.record()
+
+        transport = ReplayTransport(self.path)
+        params = {'offset': 0, 'api_id': 'other', 'sig': 'other'}
+
+        response = transport.get('http://example.com/endpoint', params)
+        self.assertEqual(response.json(), [1])
+        self.assertEqual(response.headers['X-Total-Count'], '2')
+
+        # Responses are replayed in order, with the last one repeated
+        self.assertEqual(transport.get('http://example.com/endpoint', params).json(), [2])
+        self.assertEqual(transport.get('http://example.com/endpoint', params).json(), [2])
+
+        with self.assertRaises(CassetteMissError):
+            transport.get('http://example.com/endpoint', {'offset': 100})
+
+    def test_replay__realtime(self):
+        self.record()
+
+        transport = ReplayTransport(self.path, realtime=True)
+        with mock.patch('cofecms.transports.time.sleep') as mock_sleep:
+            transport.get('http://example.com/endpoint', {'offset': 0})
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_client_replay(self):
+        self.record()
+
+        cofecms = CofeCMS(
+            api_id='test_api_id',
+            api_key='test_api_key',
+            diocese_id=123,
+            transport=ReplayTransport(self.path),
+        )
+        result = cofecms.do_request('http://example.com/endpoint', {'offset': 0})
+        self.assertEqual(result.json(), [1])
@@ -0,0 +1,10 @@
+from unittest import mock
+
+
+def mock_result(*pages):
+    """
+    A stand in for a CofeCMSResult, whose pages_generator() returns each of 'pages'.
+    """
+    result = mock.Mock()
+    result.pages_generator.return_value = iter(pages)
+    return result